@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import sys
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -25,6 +26,8 @@ SECRET_KEY = 'django-insecure-#@=&@zwq_(a_84o1sb2fop3f-&b@mhtb5sa8if#x5ahjc4q#-^
 # SECURITY WARNING: don't run with debug turned on in production!
 DEBUG = True
 
+TESTING = sys.argv[1:2] == ['test']
+
 ALLOWED_HOSTS = ['*']
 
 
@@ -42,11 +45,14 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
+    'whitenoise.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'shop.profiling.ProfilingMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'shop.throttling.ThrottleMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -56,13 +62,21 @@ TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
                 'shop.context_processors.cart_count',
+                'shop.context_processors.navigation',
+            ],
+            # Compiled templates are kept in memory; runserver's autoreloader
+            # still resets them when a template file changes.
+            'loaders': [
+                ('django.template.loaders.cached.Loader', [
+                    'django.template.loaders.filesystem.Loader',
+                    'django.template.loaders.app_directories.Loader',
+                ]),
             ],
         },
     },
@@ -78,10 +92,32 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        'OPTIONS': {
+            # Seconds a connection waits for SQLite's write lock before
+            # raising "database is locked"
+            'timeout': 20,
+        },
     }
 }
 
 
+# Caches
+# Per-process memory caches: 'default' holds the catalog caches (facets,
+# navigation), 'throttle' keeps the request throttling buckets apart so
+# catalog churn never evicts them.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop-default',
+    },
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'shop-throttle',
+        'OPTIONS': {'MAX_ENTRIES': 50000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -119,6 +155,28 @@ USE_TZ = True
 STATIC_URL = 'static/'
 STATIC_ROOT = BASE_DIR / 'staticfiles'
 
+# In production `collectstatic` writes content-hashed copies of every file
+# plus pre-built .gz and .br variants (brotli needs the Brotli package).
+# WhiteNoise serves the hashed files with far-future immutable cache headers
+# and picks the precompressed variant from Accept-Encoding, so nothing is
+# compressed per request. Run collectstatic before serving with DEBUG off.
+# The manifest storage can't render a page until collectstatic has run, so
+# development and tests use the plain storage straight from the app folders.
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG or TESTING
+            else 'whitenoise.storage.CompressedManifestStaticFilesStorage'
+        ),
+    },
+}
+# Cache lifetime for static files that are not fingerprinted (hashed files
+# are always cached for ten years).
+WHITENOISE_MAX_AGE = 60 * 60
+
 MEDIA_URL = 'media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
@@ -141,3 +199,67 @@ DEFAULT_FROM_EMAIL = 'noreply@eshop.com'
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'product_list'
 LOGOUT_REDIRECT_URL = 'product_list'
+
+# Sessions
+# Anonymous catalog pages never create or load a session (see shop.cart). For
+# faster cart reads switch to 'django.contrib.sessions.backends.cached_db', or
+# the 'cache' backend once CACHES points at a shared cache. Cookie-based
+# sessions ('signed_cookies') avoid the store entirely but change their key on
+# every save, so the cached cart pricing and wishlist sets are rebuilt after
+# every cart change.
+# Compare them with `python manage.py benchmark_sessions`.
+# Expired sessions are deleted in batches by `python manage.py purge_sessions`
+# (use it instead of clearsessions, which deletes them in one statement).
+SESSION_ENGINE = 'django.contrib.sessions.backends.db'
+
+# Cart stock reservations: how long a cart line holds its quantity (seconds).
+# Expired holds are cleared by `python manage.py release_expired_reservations`.
+CART_RESERVATION_TTL = 15 * 60
+
+# Completed and cancelled orders older than this are moved to the archive
+# tables by `python manage.py archive_orders`
+ORDER_ARCHIVE_AFTER_DAYS = 365
+
+# Request throttling (limits are defined per URL name in shop/urls.py).
+# The 'throttle' cache is per process, so each worker enforces the limits on
+# its own; point SHOP_THROTTLE_CACHE at a shared cache to make them global
+# (buckets are timestamped with the wall clock, so keep the hosts' clocks in
+# sync). Visitors with a session cookie are limited per cookie.
+SHOP_THROTTLE_ENABLED = True
+SHOP_THROTTLE_CACHE = 'throttle'
+# Visitors without one are limited by IP address. Behind a CDN or load balancer
+# REMOTE_ADDR is the proxy's, so name the header the CDN puts the client
+# address in (e.g. 'CF-Connecting-IP'), or set how many proxies append to
+# X-Forwarded-For. Only trust headers that your proxies overwrite.
+SHOP_CLIENT_IP_HEADER = None
+SHOP_TRUSTED_PROXY_COUNT = 0
+
+# Staff can profile a request by adding ?_profile or an X-Profile header.
+# Profiles are kept in SHOP_PROFILE_DIR and browsed at /admin/profiles/.
+SHOP_PROFILING_ENABLED = True
+SHOP_PROFILE_DIR = BASE_DIR / 'profiles'
+SHOP_PROFILE_KEEP = 50
+
+# XML sitemaps, regenerated by `python manage.py build_sitemaps`
+SITE_URL = 'http://localhost:8000'
+SITEMAP_ROOT = BASE_DIR / 'sitemaps'
+
+# Anonymous catalog pages are served from this file, written by
+# `python manage.py export_catalog`, while it is younger than the max age
+# (seconds). Without the file, or once it is older, pages come from the database.
+# Schedule the export to run more often than the max age (e.g. every minute
+# from cron). A worker that saves a product, reprices in bulk or sells stock
+# stops using the file until the next export; other workers catch up within
+# the max age.
+CATALOG_SNAPSHOT_PATH = BASE_DIR / 'catalog.snapshot'
+CATALOG_SNAPSHOT_MAX_AGE = 5 * 60
+
+# Optional, for busy shops on SQLite: place orders through one writer thread
+# per process, which commits the orders that queued up meanwhile in a single
+# transaction (at most SHOP_CHECKOUT_BATCH_SIZE), and put the database in WAL
+# mode. A checkout waits at most SHOP_CHECKOUT_TIMEOUT seconds for the writer
+# before placing its order directly. Leave it off on databases with
+# row-level locking.
+SHOP_SERIALIZE_CHECKOUT = False
+SHOP_CHECKOUT_BATCH_SIZE = 50
+SHOP_CHECKOUT_TIMEOUT = 10
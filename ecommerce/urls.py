@@ -2,8 +2,13 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf import settings
 from django.conf.urls.static import static
+from shop import profiling
 
 urlpatterns = [
+    # Request profiles written by shop.profiling.ProfilingMiddleware
+    path('admin/profiles/', admin.site.admin_view(profiling.profile_list), name='admin_profiles'),
+    path('admin/profiles/<slug:profile_id>/', admin.site.admin_view(profiling.profile_detail), name='admin_profile_detail'),
+    path('admin/profiles/<slug:profile_id>/download/', admin.site.admin_view(profiling.profile_download), name='admin_profile_download'),
     path('admin/', admin.site.urls),
     path('', include('shop.urls')),
 ]
@@ -0,0 +1,22 @@
+# Gunicorn settings, picked up automatically by `gunicorn ecommerce.wsgi`.
+#
+# With preload_app the master loads Django and runs the warm-up once, and the
+# forked workers inherit the compiled URL resolvers, templates and in-process
+# caches. Without it each worker warms itself up before taking requests.
+
+preload_app = True
+
+
+def _warm_up(log):
+    from shop.warmup import warm_up
+    warm_up(log=log.info)
+
+
+def when_ready(server):
+    if server.cfg.preload_app:
+        _warm_up(server.log)
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        _warm_up(worker.log)
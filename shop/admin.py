@@ -1,11 +1,31 @@
+from django import forms
 from django.contrib import admin
+from django.contrib.admin.helpers import ACTION_CHECKBOX_NAME
+from django.template.response import TemplateResponse
+from django.utils import timezone
 from django.utils.html import format_html
-from .models import Category, Product, Order, OrderItem, UserProfile, ProductReview, Wishlist, Coupon, ProductImage
+from .models import (
+    Category, Product, Order, OrderItem, UserProfile, ProductReview, Wishlist, Coupon, ProductImage,
+    ProductRecommendation, StockReservation, DailySales, ArchivedOrder, ArchivedOrderItem,
+)
+from .analytics import dashboard_data
+from .bulk import adjust_stock, reprice
+from .facets import invalidate_facets
+
+
+class RepriceForm(forms.Form):
+    mode = forms.ChoiceField(choices=[('percent', 'Percentage'), ('amount', 'Fixed amount')])
+    value = forms.DecimalField(max_digits=10, decimal_places=2, help_text='Negative values lower the price')
+
+
+class StockAdjustForm(forms.Form):
+    delta = forms.IntegerField(help_text='Added to the stock of every selected product; negative values remove stock')
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
-    list_display = ['name', 'slug', 'get_image_preview', 'created_at']
+    list_display = ['name', 'parent', 'slug', 'get_image_preview', 'created_at']
+    list_filter = ['parent']
     prepopulated_fields = {'slug': ('name',)}
     search_fields = ['name']
     
@@ -25,7 +45,7 @@ class ProductAdmin(admin.ModelAdmin):
     search_fields = ['name', 'description']
     date_hierarchy = 'created_at'
     readonly_fields = ['created_at', 'updated_at', 'get_avg_rating', 'get_review_count']
-   
+    actions = ['reprice_products', 'adjust_product_stock']
     
     fieldsets = (
         ('Basic Information', {
@@ -50,6 +70,43 @@ class ProductAdmin(admin.ModelAdmin):
         return obj.get_review_count()
     get_review_count.short_description = 'Reviews'
 
+    def _bulk_form(self, request, queryset, form_class, title):
+        """Returns the bound form once submitted and valid, otherwise the confirmation page"""
+        form = form_class(request.POST if 'apply' in request.POST else None)
+        if form.is_valid():
+            return form, None
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': title,
+            'form': form,
+            'queryset': queryset,
+            'action': request.POST.get('action'),
+            'action_checkbox_name': ACTION_CHECKBOX_NAME,
+        }
+        return None, TemplateResponse(request, 'admin/shop/product/bulk_update.html', context)
+
+    @admin.action(description='Reprice selected products')
+    def reprice_products(self, request, queryset):
+        form, response = self._bulk_form(request, queryset, RepriceForm, 'Reprice products')
+        if response:
+            return response
+        value = form.cleaned_data['value']
+        if form.cleaned_data['mode'] == 'percent':
+            updated = reprice(queryset, percent=value)
+        else:
+            updated = reprice(queryset, amount=value)
+        self.message_user(request, f'{updated} product{"s" if updated != 1 else ""} repriced.')
+
+    @admin.action(description='Adjust stock of selected products')
+    def adjust_product_stock(self, request, queryset):
+        form, response = self._bulk_form(request, queryset, StockAdjustForm, 'Adjust stock')
+        if response:
+            return response
+        delta = form.cleaned_data['delta']
+        updated, _ = adjust_stock({slug: delta for slug in queryset.values_list('slug', flat=True)})
+        self.message_user(request, f'Stock updated for {updated} product{"s" if updated != 1 else ""}.')
+
 
 class ProductImageInline(admin.TabularInline):
     model = ProductImage
@@ -76,7 +133,7 @@ class OrderAdmin(admin.ModelAdmin):
     list_editable = ['status']
     search_fields = ['first_name', 'last_name', 'email', 'id']
     date_hierarchy = 'created_at'
-    readonly_fields = ['created_at', 'updated_at', 'get_final_total']
+    readonly_fields = ['created_at', 'updated_at', 'get_subtotal']
     inlines = [OrderItemInline]
     
     fieldsets = (
@@ -87,13 +144,14 @@ class OrderAdmin(admin.ModelAdmin):
             'fields': ('address', 'city', 'postal_code')
         }),
         ('Order Details', {
-            'fields': ('status', 'total_amount', 'discount_amount', 'coupon', 'get_final_total', 'created_at', 'updated_at')
+            'fields': ('status', 'get_subtotal', 'discount_amount', 'total_amount', 'coupon', 'created_at', 'updated_at')
         }),
     )
     
-    def get_final_total(self, obj):
-        return f'${obj.total_amount - obj.discount_amount}'
-    get_final_total.short_description = 'Final Total'
+    def get_subtotal(self, obj):
+        # total_amount is what was charged, after the discount
+        return f'${obj.total_amount + obj.discount_amount}'
+    get_subtotal.short_description = 'Subtotal'
 
 
 @admin.register(UserProfile)
@@ -111,6 +169,22 @@ class ProductReviewAdmin(admin.ModelAdmin):
     search_fields = ['product__name', 'user__username', 'comment']
     date_hierarchy = 'created_at'
     readonly_fields = ['created_at', 'updated_at']
+    actions = ['approve_reviews', 'unapprove_reviews']
+
+    def _set_approved(self, request, queryset, approved):
+        # One UPDATE for the whole selection; bump updated_at by hand since
+        # update() skips auto_now, and clear the caches save() would have
+        updated = queryset.update(approved=approved, updated_at=timezone.now())
+        invalidate_facets()
+        self.message_user(request, f'{updated} review{"s" if updated != 1 else ""} updated.')
+
+    @admin.action(description='Approve selected reviews')
+    def approve_reviews(self, request, queryset):
+        self._set_approved(request, queryset, True)
+
+    @admin.action(description='Unapprove selected reviews')
+    def unapprove_reviews(self, request, queryset):
+        self._set_approved(request, queryset, False)
 
 
 @admin.register(Wishlist)
@@ -146,3 +220,68 @@ class CouponAdmin(admin.ModelAdmin):
             return format_html('<span style="color: green;">✓ Valid</span>')
         return format_html('<span style="color: red;">✗ Invalid</span>')
     is_valid_display.short_description = 'Status'
+
+
+@admin.register(ProductRecommendation)
+class ProductRecommendationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'recommended', 'score', 'updated_at']
+    raw_id_fields = ['product', 'recommended']
+    search_fields = ['product__name', 'recommended__name']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'session_key', 'quantity', 'expires_at', 'created_at']
+    list_filter = ['expires_at']
+    raw_id_fields = ['product']
+    search_fields = ['product__name', 'session_key']
+
+
+@admin.register(DailySales)
+class SalesDashboardAdmin(admin.ModelAdmin):
+    """Read-only sales dashboard built from the daily rollup tables"""
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def changelist_view(self, request, extra_context=None):
+        try:
+            days = max(1, min(int(request.GET.get('days', 30)), 366))
+        except ValueError:
+            days = 30
+        context = {
+            **self.admin_site.each_context(request),
+            **dashboard_data(days=days),
+            'opts': self.model._meta,
+            'title': 'Sales dashboard',
+        }
+        return TemplateResponse(request, 'admin/shop/sales_dashboard.html', context)
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    fields = ['product', 'product_name', 'price', 'quantity']
+    readonly_fields = fields
+    extra = 0
+    can_delete = False
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'user', 'first_name', 'last_name', 'email', 'status', 'total_amount', 'created_at', 'archived_at']
+    list_filter = ['status', 'archived_at']
+    search_fields = ['first_name', 'last_name', 'email', 'id']
+    inlines = [ArchivedOrderItemInline]
+
+    def get_readonly_fields(self, request, obj=None):
+        return [field.name for field in self.model._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
@@ -0,0 +1,239 @@
+from collections import defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, ExpressionWrapper, F, QuerySet, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, Category, DailyCategorySales, DailyProductSales, DailySales, Order,
+    OrderItem, Product,
+)
+
+
+UNCOUNTED_STATUSES = {'cancelled'}
+
+_suspended = ContextVar('rollups_suspended', default=False)
+
+
+@contextmanager
+def rollups_suspended():
+    """Ignores order deletes inside the block, e.g. while orders are archived"""
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+def is_counted(status):
+    return status not in UNCOUNTED_STATUSES
+
+
+def order_date(order):
+    return timezone.localdate(order.created_at) if order.created_at else timezone.localdate()
+
+
+def _bump(model, lookup, **deltas):
+    """Adds ``deltas`` to the rollup row matching ``lookup``, creating it if needed"""
+    deltas = {field: value for field, value in deltas.items() if value}
+    if not deltas:
+        return
+    changes = {field: F(field) + value for field, value in deltas.items()}
+    if model.objects.filter(**lookup).update(**changes):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**lookup, **deltas)
+    except IntegrityError:
+        # Another request created the row first
+        model.objects.filter(**lookup).update(**changes)
+
+
+def record_order(order, sign=1, total_amount=None):
+    """Adds (or with ``sign=-1`` removes) an order's revenue and count"""
+    # total_amount is what the customer paid, after any discount
+    total_amount = order.total_amount if total_amount is None else total_amount
+    revenue = Decimal(total_amount) * sign
+    _bump(DailySales, {'date': order_date(order)}, revenue=revenue, order_count=sign)
+
+
+def record_item(item, sign=1, quantity=None, price=None):
+    """Adds (or removes) an order line's units and revenue for its product and category"""
+    quantity = (item.quantity if quantity is None else quantity) * sign
+    revenue = Decimal(item.price if price is None else price) * quantity
+    date = order_date(item.order)
+    _bump(DailySales, {'date': date}, units=quantity)
+    _bump(DailyProductSales, {'date': date, 'product_id': item.product_id}, units=quantity, revenue=revenue)
+    _bump(DailyCategorySales, {'date': date, 'category_id': item.product.category_id}, units=quantity, revenue=revenue)
+
+
+def record_order_with_items(order, sign, total_amount=None):
+    record_order(order, sign, total_amount)
+    for item in order.items.select_related('product'):
+        record_item(item, sign)
+
+
+def remember_order(order):
+    # Read from __dict__ so deferred fields aren't loaded just to remember them
+    order._rollup_status = order.__dict__.get('status')
+    order._rollup_total = order.__dict__.get('total_amount')
+
+
+def remember_item(item):
+    item._rollup_quantity = item.__dict__.get('quantity')
+    item._rollup_price = item.__dict__.get('price')
+
+
+def order_changed(order, created):
+    """Applies an order save to the rollups, using the values it was loaded with"""
+    if created:
+        if is_counted(order.status):
+            record_order(order)
+        return
+    if order._rollup_status is None:
+        return
+
+    was_counted = is_counted(order._rollup_status)
+    if was_counted != is_counted(order.status):
+        if was_counted:
+            # The rollups hold the total the order had before this save
+            record_order_with_items(order, -1, order._rollup_total)
+        else:
+            record_order_with_items(order, 1)
+    elif was_counted and order.total_amount != order._rollup_total:
+        record_order(order, -1, order._rollup_total)
+        record_order(order)
+
+
+def order_deleted(order):
+    # Its items are deleted (and un-recorded) first by the cascade
+    if not _suspended.get() and is_counted(order.status):
+        record_order(order, -1)
+
+
+def item_deleted(item, origin=None):
+    if _suspended.get() or not is_counted(item.order.status):
+        return
+    model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if issubclass(model, (Product, Category)):
+        # The cascade removes the product's rollup rows (and the category's,
+        # when that is what's deleted); bumping them would recreate rows for
+        # objects being deleted, so only the rows that survive are adjusted
+        date = order_date(item.order)
+        _bump(DailySales, {'date': date}, units=-item.quantity)
+        if issubclass(model, Product):
+            revenue = Decimal(item.price) * -item.quantity
+            _bump(
+                DailyCategorySales, {'date': date, 'category_id': item.product.category_id},
+                units=-item.quantity, revenue=revenue,
+            )
+    else:
+        record_item(item, -1)
+
+
+def item_changed(item, created):
+    if not is_counted(item.order.status):
+        return
+    if created:
+        record_item(item)
+    elif item._rollup_quantity is not None and (
+        item.quantity != item._rollup_quantity or item.price != item._rollup_price
+    ):
+        record_item(item, -1, item._rollup_quantity, item._rollup_price)
+        record_item(item)
+
+
+def rebuild_rollups(since=None, batch_size=1000):
+    """
+    Recomputes the rollups from the live and archived order tables, from
+    ``since`` onwards.
+
+    Each source is read with one grouped query per rollup and the merged rows
+    are written with bulk inserts.
+    """
+    daily = defaultdict(lambda: {'revenue': Decimal('0'), 'order_count': 0, 'units': 0})
+    per_product = defaultdict(lambda: {'units': 0, 'revenue': Decimal('0')})
+    per_category = defaultdict(lambda: {'units': 0, 'revenue': Decimal('0')})
+
+    for order_model, item_model in [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]:
+        orders = order_model.objects.exclude(status__in=UNCOUNTED_STATUSES)
+        items = item_model.objects.exclude(order__status__in=UNCOUNTED_STATUSES).exclude(product=None)
+        if since:
+            orders = orders.filter(created_at__date__gte=since)
+            items = items.filter(order__created_at__date__gte=since)
+
+        order_rows = orders.annotate(day=TruncDate('created_at')).values('day').annotate(
+            total=Sum('total_amount'), count=Count('id'),
+        ).order_by()
+        for row in order_rows.iterator():
+            daily[row['day']]['revenue'] += row['total']
+            daily[row['day']]['order_count'] += row['count']
+
+        line_revenue = ExpressionWrapper(
+            F('price') * F('quantity'), output_field=DecimalField(max_digits=14, decimal_places=2)
+        )
+        item_rows = items.annotate(day=TruncDate('order__created_at')).values(
+            'day', 'product_id', 'product__category_id'
+        ).annotate(units=Sum('quantity'), revenue=Sum(line_revenue)).order_by()
+        for row in item_rows.iterator():
+            daily[row['day']]['units'] += row['units']
+            for totals in (
+                per_product[(row['day'], row['product_id'])],
+                per_category[(row['day'], row['product__category_id'])],
+            ):
+                totals['units'] += row['units']
+                totals['revenue'] += row['revenue']
+
+    with transaction.atomic():
+        for model in [DailySales, DailyProductSales, DailyCategorySales]:
+            stale = model.objects.all()
+            if since:
+                stale = stale.filter(date__gte=since)
+            stale.delete()
+
+        DailySales.objects.bulk_create(
+            [DailySales(date=day, **values) for day, values in daily.items()], batch_size=batch_size
+        )
+        DailyProductSales.objects.bulk_create(
+            [DailyProductSales(date=day, product_id=product_id, **values)
+             for (day, product_id), values in per_product.items()],
+            batch_size=batch_size,
+        )
+        DailyCategorySales.objects.bulk_create(
+            [DailyCategorySales(date=day, category_id=category_id, **values)
+             for (day, category_id), values in per_category.items()],
+            batch_size=batch_size,
+        )
+
+    return len(daily)
+
+
+def dashboard_data(days=30, top=10):
+    """Everything the admin dashboard shows, read from the rollup tables only"""
+    today = timezone.localdate()
+    start = today - timedelta(days=days - 1)
+    week_start = today - timedelta(days=6)
+
+    daily = list(DailySales.objects.filter(date__gte=start).order_by('date'))
+    totals = DailySales.objects.filter(date__gte=start).aggregate(
+        revenue=Sum('revenue'), orders=Sum('order_count'), units=Sum('units')
+    )
+    top_products = DailyProductSales.objects.filter(date__gte=week_start).values(
+        'product__name'
+    ).annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-units')[:top]
+    top_categories = DailyCategorySales.objects.filter(date__gte=week_start).values(
+        'category__name'
+    ).annotate(units=Sum('units'), revenue=Sum('revenue')).order_by('-revenue')[:top]
+
+    return {
+        'days': days,
+        'daily': daily,
+        'totals': totals,
+        'top_products': top_products,
+        'top_categories': top_categories,
+    }
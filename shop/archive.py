@@ -0,0 +1,77 @@
+import time
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import rollups_suspended
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+ARCHIVABLE_STATUSES = ['completed', 'cancelled']
+
+ORDER_FIELDS = [
+    'id', 'user_id', 'first_name', 'last_name', 'email', 'address', 'city', 'postal_code',
+    'created_at', 'updated_at', 'status', 'total_amount', 'discount_amount', 'coupon_id',
+]
+
+
+def archivable_orders(older_than_days):
+    cutoff = timezone.now() - timedelta(days=older_than_days)
+    return Order.objects.filter(status__in=ARCHIVABLE_STATUSES, created_at__lt=cutoff)
+
+
+def _archive_batch(order_ids):
+    """Copies one batch of orders and their items to the archive and deletes them"""
+    with transaction.atomic():
+        # Re-check inside the transaction in case a status changed meanwhile
+        orders = list(
+            Order.objects.select_for_update().filter(
+                pk__in=order_ids, status__in=ARCHIVABLE_STATUSES
+            ).values(*ORDER_FIELDS)
+        )
+        ids = [order['id'] for order in orders]
+        items = OrderItem.objects.filter(order_id__in=ids).values(
+            'id', 'order_id', 'product_id', 'product__name', 'price', 'quantity'
+        )
+
+        ArchivedOrder.objects.bulk_create([ArchivedOrder(**order) for order in orders])
+        ArchivedOrderItem.objects.bulk_create([
+            ArchivedOrderItem(
+                id=item['id'], order_id=item['order_id'], product_id=item['product_id'],
+                product_name=item['product__name'], price=item['price'], quantity=item['quantity'],
+            )
+            for item in items
+        ])
+
+        # The orders stay in the sales rollups, so deleting them mustn't
+        # subtract anything
+        with rollups_suspended():
+            OrderItem.objects.filter(order_id__in=ids).delete()
+            Order.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def archive_orders(older_than_days, batch_size=200, pause=0.0, limit=None, log=None):
+    """
+    Moves old completed and cancelled orders into the archive tables.
+
+    Works through the candidates in primary key order, one short transaction
+    per batch, optionally sleeping ``pause`` seconds between batches so other
+    writers get the database. Returns the number of orders archived.
+    """
+    candidates = archivable_orders(older_than_days).order_by('pk')
+    archived = 0
+    last_id = 0
+    while limit is None or archived < limit:
+        size = batch_size if limit is None else min(batch_size, limit - archived)
+        order_ids = list(candidates.filter(pk__gt=last_id).values_list('pk', flat=True)[:size])
+        if not order_ids:
+            break
+        last_id = order_ids[-1]
+        archived += _archive_batch(order_ids)
+        if log:
+            log(f'Archived up to order #{last_id} ({archived} total)')
+        if pause:
+            time.sleep(pause)
+    return archived
@@ -0,0 +1,124 @@
+import threading
+import time
+from bisect import bisect_left
+from heapq import nlargest
+
+from django.db.models import Count, Q, Sum
+from django.urls import reverse
+
+from .models import Category, Product
+
+
+# Workers only see saves made in their own process, so the index is also
+# rebuilt after this many seconds to pick up changes from other workers.
+INDEX_MAX_AGE = 300
+# Prefixes up to this length match too many keys to rank on every keystroke,
+# so their top results are computed once when the index is built.
+SHORT_PREFIX_LENGTH = 2
+MAX_RESULTS = 8
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class PrefixIndex:
+    """
+    Sorted-array prefix index over product and category names.
+
+    Every word position of a name is indexed, so "head" finds "Wireless
+    Headphones". Lookups are a binary search plus a scan of the matching run.
+    """
+
+    def __init__(self, entries, limit=MAX_RESULTS):
+        # entries: list of (name, popularity, payload)
+        self.entries = entries
+        self.limit = limit
+        keys = []
+        for entry_id, (name, _, _) in enumerate(entries):
+            words = normalize(name).split(' ')
+            for position in range(len(words)):
+                keys.append((' '.join(words[position:]), entry_id))
+        keys.sort()
+        self.keys = [key for key, _ in keys]
+        self.entry_ids = [entry_id for _, entry_id in keys]
+
+        self.short_prefixes = {}
+        for key, entry_id in keys:
+            for length in range(1, min(SHORT_PREFIX_LENGTH, len(key)) + 1):
+                self.short_prefixes.setdefault(key[:length], set()).add(entry_id)
+        self.short_prefixes = {
+            prefix: self._rank(entry_ids)
+            for prefix, entry_ids in self.short_prefixes.items()
+        }
+
+    def _rank(self, entry_ids):
+        return nlargest(self.limit, entry_ids, key=lambda entry_id: (self.entries[entry_id][1], -entry_id))
+
+    def search(self, query):
+        prefix = normalize(query)
+        if not prefix:
+            return []
+        if len(prefix) <= SHORT_PREFIX_LENGTH:
+            ranked = self.short_prefixes.get(prefix, [])
+        else:
+            matches = set()
+            position = bisect_left(self.keys, prefix)
+            while position < len(self.keys) and self.keys[position].startswith(prefix):
+                matches.add(self.entry_ids[position])
+                position += 1
+            ranked = self._rank(matches)
+        return [self.entries[entry_id][2] for entry_id in ranked]
+
+
+def build_index():
+    """Loads every available product and category name in two queries"""
+    entries = []
+    products = Product.objects.filter(available=True).annotate(
+        sold=Sum('orderitem__quantity')
+    ).values_list('name', 'slug', 'sold')
+    for name, slug, sold in products:
+        entries.append((name, sold or 0, {
+            'label': name,
+            'type': 'product',
+            'url': reverse('product_detail', kwargs={'slug': slug}),
+        }))
+
+    categories = Category.objects.annotate(
+        product_count=Count('products', filter=Q(products__available=True))
+    ).values_list('name', 'slug', 'product_count')
+    list_url = reverse('product_list')
+    for name, slug, product_count in categories:
+        entries.append((name, product_count, {
+            'label': name,
+            'type': 'category',
+            'url': f'{list_url}?category={slug}',
+        }))
+    return PrefixIndex(entries)
+
+
+_index = None
+_built_at = 0
+_lock = threading.Lock()
+
+
+def get_index():
+    global _index, _built_at
+    index = _index
+    if index is None or time.monotonic() - _built_at > INDEX_MAX_AGE:
+        with _lock:
+            if _index is index or _index is None:
+                _index = build_index()
+                _built_at = time.monotonic()
+            index = _index
+    return index
+
+
+def invalidate_index():
+    """Makes the next lookup in this worker rebuild the index"""
+    global _index
+    _index = None
+
+
+def suggest(query):
+    return get_index().search(query)
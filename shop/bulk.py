@@ -0,0 +1,80 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Value, When
+from django.db.models.functions import Greatest, Round
+from django.utils import timezone
+
+from .catalog import mark_catalog_stale
+from .facets import invalidate_facets
+from .models import Product
+from .snapshots import invalidate_product_snapshot
+
+
+CHUNK_SIZE = 500
+
+
+def _chunks(items, size):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _invalidate(rows):
+    """Clears what Product save signals would have cleared for ``(id, slug)`` rows"""
+    for product_id, slug in rows:
+        invalidate_product_snapshot(product_id, slug)
+    invalidate_facets()
+    mark_catalog_stale()
+
+
+def reprice(products, percent=None, amount=None, chunk_size=CHUNK_SIZE):
+    """
+    Changes the price of every product in ``products`` by a percentage or a
+    fixed amount, never going below zero.
+
+    Runs one UPDATE per chunk of primary keys, computing the new price in SQL.
+    Returns the number of products updated.
+    """
+    if (percent is None) == (amount is None):
+        raise ValueError('Pass exactly one of percent or amount.')
+    if percent is not None:
+        factor = Value(Decimal('1') + Decimal(percent) / 100, output_field=DecimalField())
+        new_price = Round(F('price') * factor, 2)
+    else:
+        new_price = F('price') + Value(Decimal(amount), output_field=DecimalField())
+    new_price = Greatest(new_price, Value(Decimal('0'), output_field=DecimalField()))
+
+    rows = list(products.order_by('pk').values_list('pk', 'slug'))
+    updated = 0
+    for chunk in _chunks(rows, chunk_size):
+        with transaction.atomic():
+            updated += Product.objects.filter(pk__in=[pk for pk, _ in chunk]).update(
+                price=new_price, updated_at=timezone.now()
+            )
+    _invalidate(rows)
+    return updated
+
+
+def adjust_stock(deltas, chunk_size=CHUNK_SIZE):
+    """
+    Adds ``{sku: delta}`` to product stock, clamping at zero.
+
+    The SKU is the product slug. Each chunk is a single UPDATE with a CASE over
+    the chunk's SKUs, so concurrent sales in between are never overwritten.
+    Returns ``(updated, unknown_skus)``.
+    """
+    deltas = {sku: int(delta) for sku, delta in deltas.items() if int(delta)}
+    known = dict(Product.objects.filter(slug__in=deltas).values_list('slug', 'pk'))
+    unknown = sorted(set(deltas) - set(known))
+
+    updated = 0
+    skus = sorted(known)
+    for chunk in _chunks(skus, chunk_size):
+        whens = [When(slug=sku, then=F('stock') + Value(deltas[sku])) for sku in chunk]
+        with transaction.atomic():
+            updated += Product.objects.filter(slug__in=chunk).update(
+                stock=Greatest(Case(*whens, default=F('stock'), output_field=IntegerField()), Value(0)),
+                updated_at=timezone.now(),
+            )
+    _invalidate([(known[sku], sku) for sku in skus])
+    return updated, unknown
@@ -0,0 +1,25 @@
+def get_cart(request):
+    """
+    Returns the session cart for reading.
+
+    Visitors without a session cookie (most crawlers and first-time browsers)
+    get an empty cart without the session store being touched.
+    """
+    session = request.session
+    if session.session_key is None and not session.modified:
+        return {}
+    return session.get('cart', {})
+
+
+def cart_item_count(request):
+    return sum(item['quantity'] for item in get_cart(request).values())
+
+
+def save_cart(request, cart):
+    """Stores the cart and bumps its version, which retires any cached pricing"""
+    request.session['cart'] = cart
+    request.session['cart_version'] = request.session.get('cart_version', 0) + 1
+
+
+def cart_version(request):
+    return request.session.get('cart_version', 0)
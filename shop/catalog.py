@@ -0,0 +1,319 @@
+import json
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+from pathlib import Path
+from types import SimpleNamespace
+
+from django.conf import settings
+from django.db.models import Avg, Count, F, Max, Q, Window
+from django.db.models.functions import RowNumber
+from django.utils.dateparse import parse_datetime
+from django.utils.text import Truncator
+
+from .facets import count_facets_in_memory, row_matches
+from .models import Category, Product, ProductImage, ProductRecommendation, ProductReview
+from .navigation import build_category_tree
+from .reviews import PAGE_SIZE, SORTS, encode_cursor
+
+
+logger = logging.getLogger(__name__)
+
+# File layout: header, then a JSON block with the listing columns, category
+# tree and a slug -> (offset, length) index, then one JSON record per product
+# for the detail page. Records are only decoded when their page is requested.
+MAGIC = b'SHOPCAT1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sII')
+RECOMMENDATION_LIMIT = 4
+# How often a worker looks for a newer file
+CHECK_INTERVAL = 5
+
+ImageRef = namedtuple('ImageRef', ['url'])
+ListingProduct = namedtuple(
+    'ListingProduct',
+    ['id', 'slug', 'name', 'description', 'price', 'stock', 'image', 'category_id', 'created_at', 'avg_rating'],
+)
+
+
+def snapshot_path():
+    return Path(getattr(settings, 'CATALOG_SNAPSHOT_PATH', settings.BASE_DIR / 'catalog.snapshot'))
+
+
+def max_age():
+    return getattr(settings, 'CATALOG_SNAPSHOT_MAX_AGE', 5 * 60)
+
+
+def _image_url(field):
+    return field.url if field else None
+
+
+def _collect_images(products):
+    images = {}
+    last_created = None
+    for product_id, image, created_at in ProductImage.objects.filter(
+        product__in=products
+    ).order_by('product_id', 'order', 'created_at').values_list('product_id', 'image', 'created_at'):
+        images.setdefault(product_id, []).append(image)
+        last_created = max(last_created, created_at) if last_created else created_at
+    return images, last_created
+
+
+def _collect_reviews(products):
+    """First page of approved reviews per product, newest first, with one windowed query"""
+    reviews = {}
+    ranked = ProductReview.objects.filter(product__in=products, approved=True).annotate(
+        position=Window(RowNumber(), partition_by=F('product_id'), order_by=[F('created_at').desc(), F('id').desc()])
+    ).filter(position__lte=PAGE_SIZE + 1).select_related('user').order_by('product_id', *SORTS['newest'])
+    for review in ranked:
+        reviews.setdefault(review.product_id, []).append(review)
+    return reviews
+
+
+def _collect_recommendations(products):
+    recommendations = {}
+    rows = ProductRecommendation.objects.filter(
+        product__in=products, recommended__available=True
+    ).select_related('recommended').order_by('product_id', '-score')
+    for rec in rows:
+        items = recommendations.setdefault(rec.product_id, [])
+        if len(items) < RECOMMENDATION_LIMIT:
+            items.append({
+                'name': rec.recommended.name,
+                'slug': rec.recommended.slug,
+                'price': str(rec.recommended.price),
+                'image': _image_url(rec.recommended.image),
+            })
+    return recommendations
+
+
+def export_catalog(path=None):
+    """
+    Writes every available product to a snapshot file and atomically swaps it
+    into place. Returns the number of products written.
+    """
+    path = Path(path or snapshot_path())
+    products = Product.objects.filter(available=True).select_related('category').annotate(
+        avg_rating=Avg('reviews__rating', filter=Q(reviews__approved=True)),
+        review_count=Count('reviews', filter=Q(reviews__approved=True)),
+    ).order_by('-created_at')
+    products = list(products)
+    available = Product.objects.filter(available=True)
+    images, last_image = _collect_images(available)
+    reviews = _collect_reviews(available)
+    recommendations = _collect_recommendations(available)
+    stamps = [
+        last_image,
+        ProductReview.objects.aggregate(last=Max('updated_at'))['last'],
+        ProductRecommendation.objects.aggregate(last=Max('updated_at'))['last'],
+    ] + [product.updated_at for product in products]
+
+    records = []
+    index = {}
+    listing = []
+    offset = 0
+    for product in products:
+        gallery = [product.image.name] if product.image else []
+        gallery += [name for name in images.get(product.id, []) if name not in gallery]
+        page = reviews.get(product.id, [])
+        record = json.dumps({
+            'id': product.id,
+            'slug': product.slug,
+            'name': product.name,
+            'description': product.description,
+            'price': str(product.price),
+            'stock': product.stock,
+            'image': _image_url(product.image),
+            'category': {'id': product.category_id, 'name': product.category.name, 'slug': product.category.slug},
+            'images': [product.image.storage.url(name) for name in gallery],
+            'average_rating': round(product.avg_rating, 1) if product.avg_rating else 0,
+            'review_count': product.review_count,
+            'reviews': [
+                {
+                    'id': review.id,
+                    'username': review.user.username,
+                    'rating': review.rating,
+                    'comment': review.comment,
+                    'created_at': review.created_at.isoformat(),
+                }
+                for review in page[:PAGE_SIZE]
+            ],
+            'reviews_cursor': encode_cursor(page[PAGE_SIZE - 1], 'newest') if len(page) > PAGE_SIZE else None,
+            'recommendations': recommendations.get(product.id, []),
+        }, separators=(',', ':')).encode()
+        index[product.slug] = [offset, len(record)]
+        offset += len(record)
+        records.append(record)
+        listing.append([
+            product.id, product.slug, product.name,
+            # The list template truncates to 15 words; keep one more so it still adds the ellipsis
+            Truncator(product.description).words(16, truncate=''),
+            str(product.price), product.stock, _image_url(product.image), product.category_id,
+            product.created_at.timestamp(), product.avg_rating,
+        ])
+
+    last_modified = max((stamp for stamp in stamps if stamp), default=None)
+    meta = json.dumps({
+        'generated_at': time.time(),
+        'last_modified': last_modified.isoformat() if last_modified else None,
+        'categories': build_category_tree(Category.objects.values('id', 'name', 'slug', 'path', 'parent_id')),
+        'listing': listing,
+        'index': index,
+    }, separators=(',', ':')).encode()
+
+    temp_path = path.with_name(path.name + '.tmp')
+    with open(temp_path, 'wb') as handle:
+        handle.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(meta)))
+        handle.write(meta)
+        for record in records:
+            handle.write(record)
+    os.replace(temp_path, path)
+    return len(products)
+
+
+class CatalogFile:
+    """A memory-mapped snapshot; the listing is decoded on load, detail records on demand"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as handle:
+            self.signature = self._signature(os.fstat(handle.fileno()))
+            self.buffer = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, meta_length = HEADER.unpack_from(self.buffer, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f'{path} is not a version {FORMAT_VERSION} catalog snapshot.')
+        meta = json.loads(self.buffer[HEADER.size:HEADER.size + meta_length])
+        self.data_start = HEADER.size + meta_length
+        self.generated_at = meta['generated_at']
+        self.last_modified = parse_datetime(meta['last_modified']) if meta['last_modified'] else None
+        self.index = meta['index']
+        self.category_paths = {category['id']: category['path'] for category in meta['categories']}
+        self.listing = [
+            ListingProduct(
+                product_id, slug, name, description, Decimal(price), stock, ImageRef(image) if image else None,
+                category_id, datetime.fromtimestamp(created_at, dt_timezone.utc), avg_rating,
+            )
+            for product_id, slug, name, description, price, stock, image, category_id, created_at, avg_rating
+            in meta['listing']
+        ]
+        self.stale = False
+
+    @staticmethod
+    def _signature(stat):
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def is_fresh(self):
+        return not self.stale and time.time() - self.generated_at <= max_age()
+
+    def validators(self):
+        """Conditional GET stats matching the ones built from the database"""
+        if not self.last_modified:
+            return None
+        return {'last_modified': self.last_modified, 'count': len(self.listing)}
+
+    def list_products(self, category_path, filters, sort_by):
+        """Returns ``(products, facet_counts)`` for a category subtree, like product_list's queries"""
+        rows = self.listing
+        if category_path:
+            rows = [row for row in rows if self.category_paths.get(row.category_id, '').startswith(category_path)]
+        counts = count_facets_in_memory(rows, filters)
+        rows = [row for row in rows if row_matches(row, filters)]
+
+        if sort_by == 'price_low':
+            rows.sort(key=lambda row: row.price)
+        elif sort_by == 'price_high':
+            rows.sort(key=lambda row: row.price, reverse=True)
+        elif sort_by == 'rating':
+            rows.sort(key=lambda row: (row.avg_rating is None, -(row.avg_rating or 0)))
+        # The listing is stored newest first
+        return rows, counts
+
+    def product(self, slug):
+        """Decodes the detail record for ``slug`` into template-ready objects, or returns None"""
+        entry = self.index.get(slug)
+        if entry is None:
+            return None
+        offset, length = entry
+        start = self.data_start + offset
+        data = json.loads(self.buffer[start:start + length])
+
+        product = SimpleNamespace(
+            id=data['id'], pk=data['id'], slug=data['slug'], name=data['name'], description=data['description'],
+            price=Decimal(data['price']), stock=data['stock'],
+            image=ImageRef(data['image']) if data['image'] else None,
+            category=SimpleNamespace(**data['category']),
+        )
+        reviews = [
+            SimpleNamespace(
+                id=review['id'], rating=review['rating'], comment=review['comment'],
+                created_at=parse_datetime(review['created_at']),
+                user=SimpleNamespace(username=review['username']),
+            )
+            for review in data['reviews']
+        ]
+        recommendations = [
+            SimpleNamespace(
+                name=item['name'], slug=item['slug'], price=Decimal(item['price']),
+                image=ImageRef(item['image']) if item['image'] else None,
+            )
+            for item in data['recommendations']
+        ]
+        return SimpleNamespace(
+            product=product,
+            images=[ImageRef(url) for url in data['images']],
+            average_rating=data['average_rating'],
+            review_count=data['review_count'],
+            reviews=reviews,
+            reviews_cursor=data['reviews_cursor'],
+            recommendations=recommendations,
+        )
+
+
+_current = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _reload():
+    """Swaps in the file on disk if it differs from the loaded one"""
+    global _current
+    path = snapshot_path()
+    try:
+        signature = CatalogFile._signature(os.stat(path))
+    except FileNotFoundError:
+        _current = None
+        return
+    if _current is not None and _current.signature == signature:
+        return
+    try:
+        # Readers holding the old object keep its mapping alive until they finish
+        _current = CatalogFile(path)
+    except (OSError, ValueError) as error:
+        logger.warning('Could not load catalog snapshot %s: %s', path, error)
+        _current = None
+
+
+def get_catalog():
+    """Returns the loaded snapshot if it is fresh, otherwise None so callers use the ORM"""
+    global _checked_at
+    now = time.monotonic()
+    if now - _checked_at > CHECK_INTERVAL:
+        with _lock:
+            if now - _checked_at > CHECK_INTERVAL:
+                _reload()
+                _checked_at = now
+    catalog = _current
+    if catalog is None or not catalog.is_fresh():
+        return None
+    return catalog
+
+
+def mark_catalog_stale():
+    """Stops this worker serving the loaded snapshot until a newer file is exported"""
+    if _current is not None:
+        _current.stale = True
@@ -1,6 +1,16 @@
+from .cart import cart_item_count
+from .navigation import get_category_menu
+
+
 def cart_count(request):
-    cart = request.session.get('cart', {})
+    # Evaluated only when a template actually renders the cart badge
     return {
-        'cart_count': sum(item['quantity'] for item in cart.values())
+        'cart_count': lambda: cart_item_count(request)
     }
 
+
+def navigation(request):
+    # Passed uncalled so pages that don't render the menu never touch the cache
+    return {
+        'nav_categories': get_category_menu,
+    }
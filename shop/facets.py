@@ -0,0 +1,216 @@
+from decimal import Decimal
+
+from django.core.cache import cache
+from django.db.models import Count, Q
+
+
+PRICE_RANGES = [
+    ('0-500', 'Under ₹500', None, Decimal('500')),
+    ('500-1000', '₹500 - ₹1,000', Decimal('500'), Decimal('1000')),
+    ('1000-5000', '₹1,000 - ₹5,000', Decimal('1000'), Decimal('5000')),
+    ('5000-', 'Over ₹5,000', Decimal('5000'), None),
+]
+RATING_THRESHOLDS = [4, 3, 2, 1]
+
+# Invalidation moves to a new generation in the cache of the worker that saw
+# the change only; the timeout bounds how long other workers keep serving the
+# old counts.
+FACET_CACHE_TIMEOUT = 60 * 2
+FACET_GENERATION_KEY = 'shop:facets:generation'
+
+
+def parse_filters(params):
+    """Reads the facet filters from a request's GET parameters"""
+    price = params.get('price')
+    if price not in {key for key, _, _, _ in PRICE_RANGES}:
+        price = None
+
+    try:
+        min_rating = int(params.get('rating', ''))
+    except ValueError:
+        min_rating = None
+    if min_rating not in RATING_THRESHOLDS:
+        min_rating = None
+
+    return {
+        'price': price,
+        'rating': min_rating,
+        'in_stock': params.get('in_stock') == '1',
+    }
+
+
+def has_active_filters(filters):
+    return bool(filters['price'] or filters['rating'] or filters['in_stock'])
+
+
+def price_q(key):
+    for range_key, _, low, high in PRICE_RANGES:
+        if range_key == key:
+            q = Q()
+            if low is not None:
+                q &= Q(price__gte=low)
+            if high is not None:
+                q &= Q(price__lt=high)
+            return q
+    return Q()
+
+
+def rating_q(min_rating):
+    return Q(avg_rating__gte=min_rating)
+
+
+def stock_q():
+    return Q(stock__gt=0)
+
+
+def _filter_q(filters, exclude=None):
+    """Combines the active filters, leaving out the facet named by ``exclude``"""
+    q = Q()
+    if filters['price'] and exclude != 'price':
+        q &= price_q(filters['price'])
+    if filters['rating'] and exclude != 'rating':
+        q &= rating_q(filters['rating'])
+    if filters['in_stock'] and exclude != 'in_stock':
+        q &= stock_q()
+    return q
+
+
+def apply_filters(products, filters):
+    """Narrows an ``avg_rating`` annotated product queryset to the active facets"""
+    q = _filter_q(filters)
+    return products.filter(q) if q else products
+
+
+def compute_facet_counts(products, filters):
+    """
+    Counts every facet option in a single aggregate query.
+
+    Each facet is counted against the other active filters only, so options
+    within a facet stay selectable as alternatives to the current choice.
+    """
+    aggregates = {}
+    price_base = _filter_q(filters, exclude='price')
+    for key, _, _, _ in PRICE_RANGES:
+        aggregates[f'price_{key}'] = Count('id', filter=price_base & price_q(key))
+    rating_base = _filter_q(filters, exclude='rating')
+    for threshold in RATING_THRESHOLDS:
+        aggregates[f'rating_{threshold}'] = Count('id', filter=rating_base & rating_q(threshold))
+    aggregates['in_stock'] = Count('id', filter=_filter_q(filters, exclude='in_stock') & stock_q())
+
+    row = products.order_by().aggregate(**aggregates)
+    return {
+        'price': {key: row[f'price_{key}'] for key, _, _, _ in PRICE_RANGES},
+        'rating': {threshold: row[f'rating_{threshold}'] for threshold in RATING_THRESHOLDS},
+        'in_stock': row['in_stock'],
+    }
+
+
+# In-memory equivalents, for listings served from the catalog snapshot file.
+# Rows need ``price``, ``stock`` and ``avg_rating`` attributes.
+
+def in_price_range(price, key):
+    for range_key, _, low, high in PRICE_RANGES:
+        if range_key == key:
+            return (low is None or price >= low) and (high is None or price < high)
+    return True
+
+
+def row_matches(row, filters, exclude=None):
+    if filters['price'] and exclude != 'price' and not in_price_range(row.price, filters['price']):
+        return False
+    if filters['rating'] and exclude != 'rating' and (row.avg_rating or 0) < filters['rating']:
+        return False
+    if filters['in_stock'] and exclude != 'in_stock' and row.stock <= 0:
+        return False
+    return True
+
+
+def count_facets_in_memory(rows, filters):
+    """Same counts as ``compute_facet_counts`` in one pass over already loaded rows"""
+    counts = {
+        'price': {key: 0 for key, _, _, _ in PRICE_RANGES},
+        'rating': {threshold: 0 for threshold in RATING_THRESHOLDS},
+        'in_stock': 0,
+    }
+    for row in rows:
+        if row_matches(row, filters, exclude='price'):
+            for key, _, _, _ in PRICE_RANGES:
+                if in_price_range(row.price, key):
+                    counts['price'][key] += 1
+        if row_matches(row, filters, exclude='rating'):
+            for threshold in RATING_THRESHOLDS:
+                if (row.avg_rating or 0) >= threshold:
+                    counts['rating'][threshold] += 1
+        if row.stock > 0 and row_matches(row, filters, exclude='in_stock'):
+            counts['in_stock'] += 1
+    return counts
+
+
+def _generation():
+    return cache.get_or_set(FACET_GENERATION_KEY, 1, None)
+
+
+def invalidate_facets():
+    """Drops every cached facet summary by moving to a new cache generation"""
+    try:
+        cache.incr(FACET_GENERATION_KEY)
+    except ValueError:
+        cache.set(FACET_GENERATION_KEY, 1, None)
+
+
+def get_facet_counts(products, filters, category_slug=None, cacheable=True):
+    """
+    Returns the facet counts for ``products``.
+
+    The unfiltered summary of a category (or of the whole catalog) is what most
+    visitors see, so it is cached until a product or review changes, or for
+    ``FACET_CACHE_TIMEOUT`` in workers that didn't make the change.
+    """
+    if not cacheable or has_active_filters(filters):
+        return compute_facet_counts(products, filters)
+
+    key = f'shop:facets:{_generation()}:{category_slug or "all"}'
+    counts = cache.get(key)
+    if counts is None:
+        counts = compute_facet_counts(products, filters)
+        cache.set(key, counts, FACET_CACHE_TIMEOUT)
+    return counts
+
+
+def build_facet_options(params, filters, counts):
+    """Builds the template data for the filter sidebar, including toggle links"""
+    def toggle(name, value):
+        query = params.copy()
+        query.pop('page', None)
+        if query.get(name) == str(value):
+            query.pop(name, None)
+        else:
+            query[name] = value
+        return query.urlencode()
+
+    return {
+        'price': [
+            {
+                'label': label,
+                'count': counts['price'][key],
+                'active': filters['price'] == key,
+                'query': toggle('price', key),
+            }
+            for key, label, _, _ in PRICE_RANGES
+        ],
+        'rating': [
+            {
+                'label': f'{threshold}★ & up',
+                'count': counts['rating'][threshold],
+                'active': filters['rating'] == threshold,
+                'query': toggle('rating', threshold),
+            }
+            for threshold in RATING_THRESHOLDS
+        ],
+        'in_stock': {
+            'label': 'In stock only',
+            'count': counts['in_stock'],
+            'active': filters['in_stock'],
+            'query': toggle('in_stock', 1),
+        },
+    }
@@ -61,14 +61,25 @@ class UserProfileForm(forms.ModelForm):
             self.fields['email'].initial = self.instance.user.email
 
     def save(self, commit=True):
+        """Writes only the profile and user fields that changed, each with a single query"""
         profile = super().save(commit=False)
         if commit:
-            profile.save()
+            profile_fields = [name for name in self.changed_data if name in self._meta.fields]
+            if profile._state.adding:
+                if profile_fields:
+                    profile.save()
+            elif profile_fields:
+                profile.save(update_fields=profile_fields + ['updated_at'])
+
             user = profile.user
-            user.first_name = self.cleaned_data.get('first_name', '')
-            user.last_name = self.cleaned_data.get('last_name', '')
-            user.email = self.cleaned_data.get('email', '')
-            user.save()
+            user_fields = []
+            for name in ('first_name', 'last_name', 'email'):
+                value = self.cleaned_data.get(name, '')
+                if getattr(user, name) != value:
+                    setattr(user, name, value)
+                    user_fields.append(name)
+            if user_fields:
+                user.save(update_fields=user_fields)
         return profile
 
 
@@ -0,0 +1,265 @@
+import json
+import random
+import threading
+import time
+from collections import defaultdict
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode, urljoin
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.db.models import Sum
+from django.urls import reverse
+
+from .models import Order, OrderItem, Product
+
+
+# Relative weights of the journeys a simulated shopper can take
+DEFAULT_MIX = {'browse': 50, 'cart': 20, 'buy': 30}
+
+CHECKOUT_DETAILS = {
+    'first_name': 'Load',
+    'last_name': 'Test',
+    'email': 'loadtest@example.com',
+    'address': '1 Test Street',
+    'city': 'Testville',
+    'postal_code': '000000',
+}
+
+
+def parse_mix(value):
+    """Parses ``browse=50,cart=20,buy=30`` into a weight dict"""
+    mix = {}
+    for part in value.split(','):
+        name, _, weight = part.partition('=')
+        name = name.strip()
+        if name not in DEFAULT_MIX:
+            raise ValueError(f'Unknown journey "{name}"; choose from {", ".join(DEFAULT_MIX)}.')
+        mix[name] = float(weight)
+    if not any(mix.values()):
+        raise ValueError('At least one journey needs a positive weight.')
+    return mix
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(int(round(pct / 100 * len(sorted_values))) - 1, 0)
+    return sorted_values[min(rank, len(sorted_values) - 1)]
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    """Surfaces redirects as responses so POST outcomes can be read from Location"""
+
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class Results:
+    """Thread-safe latency and outcome counters keyed by URL name"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(lambda: defaultdict(int))
+        self.orders = []
+
+    def record(self, name, seconds, outcome):
+        with self.lock:
+            self.latencies[name].append(seconds)
+            self.outcomes[name][outcome] += 1
+
+    def order_placed(self, order_id):
+        with self.lock:
+            self.orders.append(order_id)
+
+    def summary(self, elapsed):
+        rows = []
+        for name in sorted(self.latencies):
+            latencies = sorted(self.latencies[name])
+            outcomes = self.outcomes[name]
+            rows.append({
+                'name': name,
+                'requests': len(latencies),
+                'rate': len(latencies) / elapsed if elapsed else 0,
+                'p50': percentile(latencies, 50) * 1000,
+                'p95': percentile(latencies, 95) * 1000,
+                'p99': percentile(latencies, 99) * 1000,
+                'rejected': outcomes['rejected'],
+                'throttled': outcomes['throttled'],
+                'errors': outcomes['error'],
+            })
+        return rows
+
+
+class Shopper:
+    """One simulated visitor with its own cookie jar, i.e. its own session and cart"""
+
+    def __init__(self, base_url, products, results, coupon=None, think_time=0.0, timeout=30):
+        self.base_url = base_url
+        self.products = products
+        self.results = results
+        self.coupon = coupon
+        self.think_time = think_time
+        self.timeout = timeout
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies), _NoRedirect())
+
+    def _csrf_token(self):
+        for cookie in self.cookies:
+            if cookie.name == 'csrftoken':
+                return cookie.value
+        return ''
+
+    def request(self, path, data=None, ajax=False):
+        """Sends one request; returns ``(status, headers, body, seconds, outcome)``, status 0 meaning no response"""
+        headers = {}
+        if data is not None:
+            token = self._csrf_token()
+            data = urlencode({**data, 'csrfmiddlewaretoken': token}).encode()
+            headers['X-CSRFToken'] = token
+            headers['Referer'] = self.base_url
+        if ajax:
+            headers['X-Requested-With'] = 'XMLHttpRequest'
+
+        started = time.perf_counter()
+        try:
+            response = self.opener.open(Request(urljoin(self.base_url, path), data=data, headers=headers), timeout=self.timeout)
+            status, response_headers, body = response.status, response.headers, response.read()
+        except HTTPError as error:
+            status, response_headers, body = error.code, error.headers, error.read()
+        except (URLError, OSError):
+            status, response_headers, body = 0, {}, b''
+        elapsed = time.perf_counter() - started
+
+        if status == 429:
+            outcome = 'throttled'
+        elif status == 0 or status >= 400:
+            outcome = 'error'
+        else:
+            outcome = 'ok'
+        return status, response_headers, body, elapsed, outcome
+
+    def think(self):
+        if self.think_time:
+            time.sleep(random.uniform(0, 2 * self.think_time))
+
+    def browse(self):
+        product_id, slug = random.choice(self.products)
+        self.timed('product_list', reverse('product_list'))
+        self.think()
+        self.timed('product_detail', reverse('product_detail', kwargs={'slug': slug}))
+        self.think()
+        return product_id
+
+    def add_to_cart(self, product_id):
+        status, _, body, elapsed, outcome = self.request(
+            reverse('add_to_cart', args=[product_id]), data={}, ajax=True
+        )
+        if outcome == 'ok':
+            try:
+                if not json.loads(body).get('success'):
+                    outcome = 'rejected'
+            except ValueError:
+                outcome = 'error'
+        self.results.record('add_to_cart', elapsed, outcome)
+        self.think()
+        return outcome == 'ok'
+
+    def checkout(self):
+        if self.coupon:
+            self.timed('apply_coupon', reverse('apply_coupon'), data={'code': self.coupon})
+            self.think()
+        self.timed('checkout', reverse('checkout'))
+        self.think()
+
+        status, headers, _, elapsed, outcome = self.request(reverse('checkout'), data=CHECKOUT_DETAILS)
+        location = headers.get('Location', '') if status in (301, 302, 303) else ''
+        if outcome == 'ok':
+            # Success redirects to the confirmation page; a stock failure back to the cart
+            if '/confirmation/' in location:
+                self.results.order_placed(int(location.rstrip('/').split('/')[-2]))
+            else:
+                outcome = 'rejected'
+        self.results.record('checkout [POST]', elapsed, outcome)
+
+    def timed(self, name, path, data=None):
+        """Sends a request whose status alone decides the outcome, and records it"""
+        _, _, _, elapsed, outcome = self.request(path, data=data)
+        self.results.record(name, elapsed, outcome)
+        return outcome
+
+    def run_journey(self, journey):
+        product_id = self.browse()
+        if journey == 'browse':
+            return
+        added = self.add_to_cart(product_id)
+        if journey == 'buy' and added:
+            self.checkout()
+
+
+def _pick(mix):
+    journeys = list(mix)
+    return random.choices(journeys, weights=[mix[name] for name in journeys])[0]
+
+
+def run_load_test(base_url, products, shoppers=10, duration=30.0, mix=None, coupon=None, think_time=0.0):
+    """
+    Runs ``shoppers`` concurrent visitors for ``duration`` seconds.
+
+    Each visitor repeatedly starts a fresh session and walks one journey picked
+    from ``mix``. Returns ``(results, elapsed_seconds)``.
+    """
+    mix = mix or DEFAULT_MIX
+    results = Results()
+    deadline = time.monotonic() + duration
+
+    def visitor():
+        while time.monotonic() < deadline:
+            shopper = Shopper(base_url, products, results, coupon=coupon, think_time=think_time)
+            shopper.run_journey(_pick(mix))
+
+    threads = [threading.Thread(target=visitor, daemon=True) for _ in range(shoppers)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, time.perf_counter() - started
+
+
+def check_consistency(stock_before, started_at, order_ids):
+    """
+    Compares the products' stock before and after a run with what was sold.
+
+    Assumes nothing else touched these products during the run. Returns a list
+    of human readable violations; an empty list means the books balance.
+    """
+    violations = []
+    sold = dict(
+        OrderItem.objects.filter(product_id__in=stock_before, order__created_at__gte=started_at)
+        .values_list('product_id').annotate(total=Sum('quantity'))
+    )
+    stock_after = dict(Product.objects.filter(pk__in=stock_before).values_list('pk', 'stock'))
+    for product_id, before in stock_before.items():
+        after = stock_after.get(product_id)
+        units = sold.get(product_id, 0)
+        if after is None:
+            violations.append(f'Product {product_id} disappeared during the run')
+        elif after < 0:
+            violations.append(f'Product {product_id} oversold: stock is {after}')
+        elif before - units != after:
+            violations.append(
+                f'Product {product_id}: stock went {before} -> {after} but {units} units were sold'
+            )
+        elif units > before:
+            violations.append(f'Product {product_id}: sold {units} units with only {before} in stock')
+
+    recorded = set(Order.objects.filter(pk__in=order_ids).values_list('pk', flat=True))
+    for order_id in sorted(set(order_ids) - recorded):
+        violations.append(f'Order {order_id} was confirmed to a shopper but does not exist')
+    empty = Order.objects.filter(created_at__gte=started_at, items__isnull=True).values_list('pk', flat=True)
+    for order_id in empty:
+        violations.append(f'Order {order_id} has no items')
+    return violations
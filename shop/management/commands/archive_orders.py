@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.archive import archive_orders, archivable_orders
+
+
+class Command(BaseCommand):
+    help = 'Move old completed and cancelled orders into the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 365),
+            help='Archive orders older than this many days',
+        )
+        parser.add_argument('--batch-size', type=int, default=200, help='Orders moved per transaction')
+        parser.add_argument('--pause', type=float, default=0.0, help='Seconds to sleep between batches')
+        parser.add_argument('--limit', type=int, help='Stop after archiving this many orders')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many orders would be archived')
+
+    def handle(self, *args, **options):
+        if options['dry_run']:
+            count = archivable_orders(options['days']).count()
+            self.stdout.write(f'{count} orders older than {options["days"]} days can be archived.')
+            return
+
+        archived = archive_orders(
+            options['days'],
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            limit=options['limit'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders.'))
@@ -0,0 +1,65 @@
+import time
+from importlib import import_module
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+
+ENGINES = {
+    'db': 'django.contrib.sessions.backends.db',
+    'cached_db': 'django.contrib.sessions.backends.cached_db',
+    'cache': 'django.contrib.sessions.backends.cache',
+    'signed_cookies': 'django.contrib.sessions.backends.signed_cookies',
+}
+
+SAMPLE_CART = {
+    str(product_id): {'name': f'Product {product_id}', 'price': '49.99', 'quantity': 2, 'image': None}
+    for product_id in range(1, 6)
+}
+
+
+class Command(BaseCommand):
+    help = 'Compare session engines on the cart read/write path'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000, help='Sessions created and read per engine')
+        parser.add_argument('--engines', nargs='+', choices=sorted(ENGINES), default=list(ENGINES), help='Engines to compare')
+
+    def handle(self, *args, **options):
+        iterations = options['iterations']
+        self.stdout.write(f'{"engine":<16}{"write ms/op":>14}{"read ms/op":>14}{"queries/op":>14}')
+
+        for name in options['engines']:
+            store_class = import_module(ENGINES[name]).SessionStore
+            keys = []
+
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    session = store_class()
+                    session['cart'] = SAMPLE_CART
+                    session.save()
+                    # Signed cookie sessions carry their data in the key itself
+                    keys.append(session.session_key)
+                write_time = time.perf_counter() - start
+
+                start = time.perf_counter()
+                for key in keys:
+                    store_class(key).get('cart', {})
+                read_time = time.perf_counter() - start
+
+            for key in keys:
+                store_class(key).delete()
+
+            self.stdout.write(
+                f'{name:<16}'
+                f'{write_time * 1000 / iterations:>14.3f}'
+                f'{read_time * 1000 / iterations:>14.3f}'
+                f'{len(queries) / (iterations * 2):>14.2f}'
+            )
+
+        self.stdout.write(
+            'Note: signed_cookies sessions change their key on every save, so the '
+            'cached cart pricing and wishlist sets are rebuilt after every cart change.'
+        )
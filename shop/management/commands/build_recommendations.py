@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from shop.recommendations import update_recommendations
+
+
+class Command(BaseCommand):
+    help = 'Build "frequently bought together" recommendations from order items'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Discard existing recommendations and rebuild from all orders')
+        parser.add_argument('--chunk-size', type=int, default=1000, help='Orders read per transaction')
+        parser.add_argument('--keep', type=int, default=50, help='Neighbors stored per product')
+
+    def handle(self, *args, **options):
+        mode = 'Rebuilding' if options['full'] else 'Updating'
+        self.stdout.write(f'{mode} recommendations...')
+        processed = update_recommendations(
+            full=options['full'],
+            chunk_size=options['chunk_size'],
+            keep=options['keep'],
+            log=self.stdout.write,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Processed {processed} orders.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from shop.sitemaps import build_sitemaps
+
+
+class Command(BaseCommand):
+    help = 'Regenerate the XML sitemap shards whose products changed, and the sitemap index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rewrite every shard')
+        parser.add_argument('--base-url', help='Absolute site URL; defaults to the SITE_URL setting')
+
+    def handle(self, *args, **options):
+        written, skipped = build_sitemaps(full=options['full'], base_url=options['base_url'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {written} product shards, {skipped} unchanged.'))
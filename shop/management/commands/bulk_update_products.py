@@ -0,0 +1,65 @@
+import csv
+from decimal import Decimal, InvalidOperation
+
+from django.core.management.base import BaseCommand, CommandError
+from shop.bulk import adjust_stock, reprice
+from shop.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Apply bulk price or stock changes from a CSV file. '
+        'Columns "category,percent" or "category,amount" reprice every product in a category '
+        '(by slug) and its subcategories; columns "sku,stock_delta" add to the stock of products by slug.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('csv_file', help='Path to the CSV file, with a header row')
+        parser.add_argument('--chunk-size', type=int, default=500, help='Products changed per UPDATE')
+
+    def handle(self, *args, **options):
+        with open(options['csv_file'], newline='', encoding='utf-8') as handle:
+            reader = csv.DictReader(handle)
+            columns = set(reader.fieldnames or [])
+            rows = list(reader)
+
+        if {'sku', 'stock_delta'} <= columns:
+            self.update_stock(rows, options['chunk_size'])
+        elif 'category' in columns and ({'percent', 'amount'} & columns):
+            self.update_prices(rows, options['chunk_size'])
+        else:
+            raise CommandError('Expected columns "sku,stock_delta" or "category,percent"/"category,amount".')
+
+    def update_stock(self, rows, chunk_size):
+        deltas = {}
+        for line, row in enumerate(rows, start=2):
+            try:
+                deltas[row['sku'].strip()] = deltas.get(row['sku'].strip(), 0) + int(row['stock_delta'])
+            except ValueError:
+                raise CommandError(f'Line {line}: stock_delta must be a whole number.')
+
+        updated, unknown = adjust_stock(deltas, chunk_size=chunk_size)
+        for sku in unknown:
+            self.stderr.write(f'Unknown SKU: {sku}')
+        self.stdout.write(self.style.SUCCESS(f'Updated stock for {updated} products.'))
+
+    def update_prices(self, rows, chunk_size):
+        total = 0
+        for line, row in enumerate(rows, start=2):
+            slug = row['category'].strip()
+            category = Category.objects.filter(slug=slug).first()
+            if category is None:
+                self.stderr.write(f'Line {line}: unknown category {slug}')
+                continue
+            try:
+                percent = Decimal(row['percent']) if row.get('percent') else None
+                amount = Decimal(row['amount']) if row.get('amount') else None
+                updated = reprice(
+                    Product.objects.filter(category__path__startswith=category.path),
+                    percent=percent, amount=amount, chunk_size=chunk_size,
+                )
+            except (InvalidOperation, ValueError):
+                raise CommandError(f'Line {line}: give exactly one numeric percent or amount.')
+            self.stdout.write(f'{slug}: repriced {updated} products')
+            total += updated
+        self.stdout.write(self.style.SUCCESS(f'Repriced {total} products.'))
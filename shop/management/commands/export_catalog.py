@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from shop.catalog import export_catalog, snapshot_path
+
+
+class Command(BaseCommand):
+    help = 'Write the available catalog to the snapshot file that serves anonymous catalog pages'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--path', help='Output file; defaults to the CATALOG_SNAPSHOT_PATH setting')
+
+    def handle(self, *args, **options):
+        path = options['path'] or snapshot_path()
+        count = export_catalog(path)
+        self.stdout.write(self.style.SUCCESS(f'Exported {count} products to {path}.'))
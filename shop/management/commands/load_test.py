@@ -0,0 +1,74 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from shop.loadtest import DEFAULT_MIX, check_consistency, parse_mix, run_load_test
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive concurrent simulated shoppers against a running server and report latency, '
+        'errors and stock consistency. Places real orders, so point it at a scratch database '
+        'shared with the server, and turn SHOP_THROTTLE_ENABLED off there since every shopper '
+        'comes from the same address.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/', help='Base URL of the server under test')
+        parser.add_argument('--shoppers', type=int, default=10, help='Concurrent shoppers')
+        parser.add_argument('--duration', type=float, default=30, help='Seconds to run for')
+        parser.add_argument(
+            '--mix', default=','.join(f'{name}={weight}' for name, weight in DEFAULT_MIX.items()),
+            help='Journey weights, e.g. browse=50,cart=20,buy=30',
+        )
+        parser.add_argument('--think-time', type=float, default=0.5, help='Mean pause between steps, in seconds')
+        parser.add_argument('--products', type=int, default=5, help='How many in-stock products to shop for; fewer means more contention')
+        parser.add_argument('--coupon', help='Coupon code applied before every checkout')
+
+    def handle(self, *args, **options):
+        try:
+            mix = parse_mix(options['mix'])
+        except ValueError as error:
+            raise CommandError(error)
+
+        products = list(
+            Product.objects.filter(available=True, stock__gt=0).order_by('pk').values_list('pk', 'slug', 'stock')[:options['products']]
+        )
+        if not products:
+            raise CommandError('There are no available products in stock to shop for.')
+        stock_before = {pk: stock for pk, _, stock in products}
+        started_at = timezone.now()
+
+        self.stdout.write(
+            f'Running {options["shoppers"]} shoppers for {options["duration"]:.0f}s against {options["url"]} '
+            f'on {len(products)} products...'
+        )
+        results, elapsed = run_load_test(
+            options['url'],
+            [(pk, slug) for pk, slug, _ in products],
+            shoppers=options['shoppers'],
+            duration=options['duration'],
+            mix=mix,
+            coupon=options['coupon'],
+            think_time=options['think_time'],
+        )
+
+        rows = results.summary(elapsed)
+        total = sum(row['requests'] for row in rows)
+        self.stdout.write(
+            f'\n{"url name":<16}{"requests":>10}{"req/s":>9}{"p50 ms":>9}{"p95 ms":>9}{"p99 ms":>9}'
+            f'{"rejected":>10}{"throttled":>11}{"errors":>8}{"error %":>9}'
+        )
+        for row in rows:
+            self.stdout.write(
+                f'{row["name"]:<16}{row["requests"]:>10}{row["rate"]:>9.1f}{row["p50"]:>9.1f}{row["p95"]:>9.1f}'
+                f'{row["p99"]:>9.1f}{row["rejected"]:>10}{row["throttled"]:>11}{row["errors"]:>8}'
+                f'{100 * row["errors"] / row["requests"]:>9.1f}'
+            )
+        self.stdout.write(f'\n{total} requests in {elapsed:.1f}s ({total / elapsed:.1f} req/s), {len(results.orders)} orders placed.')
+
+        violations = check_consistency(stock_before, started_at, results.orders)
+        if violations:
+            for violation in violations:
+                self.stderr.write(violation)
+            raise CommandError(f'{len(violations)} consistency violations found.')
+        self.stdout.write(self.style.SUCCESS('Stock and orders are consistent.'))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand, CommandError
+from shop.purge import AbandonedCartStats, purge_expired_sessions, session_store
+
+
+class Command(BaseCommand):
+    help = 'Delete expired sessions in small batches, optionally reporting the carts left in them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Sessions deleted per statement')
+        parser.add_argument('--pause', type=float, default=0.1, help='Seconds to sleep between batches')
+        parser.add_argument('--limit', type=int, help='Stop after deleting this many sessions')
+        parser.add_argument('--cart-stats', action='store_true', help='Report the abandoned carts in the purged sessions')
+
+    def handle(self, *args, **options):
+        if not hasattr(session_store(), 'get_model_class'):
+            raise CommandError('SESSION_ENGINE does not keep sessions in the database.')
+
+        stats = AbandonedCartStats() if options['cart_stats'] else None
+
+        def log(message):
+            if stats is not None:
+                message = f'{message}; {stats.summary()}'
+            self.stdout.write(message)
+
+        purged = purge_expired_sessions(
+            batch_size=options['batch_size'],
+            pause=options['pause'],
+            limit=options['limit'],
+            stats=stats,
+            log=log if options['verbosity'] > 1 else None,
+        )
+        self.stdout.write(self.style.SUCCESS(f'Purged {purged} expired sessions.'))
+        if stats is not None:
+            self.stdout.write(stats.summary())
+            for name, units in stats.products.most_common(10):
+                self.stdout.write(f'  {units:>6}  {name}')
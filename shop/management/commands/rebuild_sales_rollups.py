@@ -0,0 +1,16 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+from shop.analytics import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Recompute the daily sales rollups from the order tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='Only rebuild days from this date (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rollup rows inserted per statement')
+
+    def handle(self, *args, **options):
+        days = rebuild_rollups(since=options['since'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rollups for {days} days.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shop.reservations import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Release cart stock reservations whose hold has expired'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Reservations deleted per statement')
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Released {released} expired reservations.'))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shop.warmup import SNAPSHOT_LIMIT, warm_up
+
+
+class Command(BaseCommand):
+    help = 'Prime URL resolvers, compiled templates and catalog caches before taking traffic'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--snapshot-limit', type=int, default=SNAPSHOT_LIMIT, help='Most recently updated products to cache')
+
+    def handle(self, *args, **options):
+        timings = warm_up(snapshot_limit=options['snapshot_limit'], log=self.stdout.write)
+        self.stdout.write(self.style.SUCCESS(f'Warm-up finished in {sum(timings.values()) * 1000:.0f} ms.'))
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:42
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_productrecommendation_recommendationstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('session_key', models.CharField(max_length=40)),
+                ('quantity', models.PositiveIntegerField(default=1)),
+                ('expires_at', models.DateTimeField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='shop.product')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['product', 'expires_at'], name='shop_resv_product_exp_idx'), models.Index(fields=['expires_at'], name='shop_resv_expires_idx'), models.Index(fields=['session_key'], name='shop_resv_session_idx')],
+                'unique_together': {('product', 'session_key')},
+            },
+        ),
+    ]
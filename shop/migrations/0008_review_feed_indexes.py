@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-19 08:49
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0007_order_archive'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'approved', '-created_at', '-id'], name='shop_review_newest_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='productreview',
+            index=models.Index(fields=['product', 'approved', '-rating', '-created_at', '-id'], name='shop_review_rating_idx'),
+        ),
+    ]
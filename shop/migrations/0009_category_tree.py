@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:01
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast, Concat
+
+
+def set_root_paths(apps, schema_editor):
+    # Every existing category becomes a root
+    Category = apps.get_model('shop', 'Category')
+    Category.objects.update(path=Concat(Value('/'), Cast('id', CharField()), Value('/')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_review_feed_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='children', to='shop.category'),
+        ),
+        migrations.AddField(
+            model_name='category',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255),
+        ),
+        migrations.RunPython(set_root_paths, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.18 on 2026-10-19 09:41
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def carry_over_watermark(apps, schema_editor):
+    # Orders up to the old id watermark count as folded
+    Order = apps.get_model('shop', 'Order')
+    RecommendationState = apps.get_model('shop', 'RecommendationState')
+    for state in RecommendationState.objects.filter(last_order_id__gt=0):
+        folded = Order.objects.filter(pk__lte=state.last_order_id)
+        last_created_at = folded.order_by('-created_at').values_list('created_at', flat=True).first()
+        if last_created_at:
+            state.last_created_at = last_created_at
+            state.recent_order_ids = list(
+                folded.filter(created_at__gte=last_created_at - timedelta(minutes=10)).values_list('pk', flat=True)
+            )
+            state.save()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_category_parent_protect'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recommendationstate',
+            name='last_created_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='recommendationstate',
+            name='recent_order_ids',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.RunPython(carry_over_watermark, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='recommendationstate',
+            name='last_order_id',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='shop_order_created_idx'),
+        ),
+    ]
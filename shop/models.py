@@ -1,12 +1,23 @@
-from django.db import models
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import models, transaction
 from django.utils.text import slugify
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.core.validators import MinValueValidator, MaxValueValidator
+from django.db.models import Value
+from django.db.models.functions import Concat, Substr
 from django.urls import reverse
 
 class Category(models.Model):
     name = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, blank=True)
+    # A category with subcategories can't be deleted until they are moved or
+    # deleted, so a delete never silently takes a whole subtree with it
+    parent = models.ForeignKey('self', on_delete=models.PROTECT, null=True, blank=True, related_name='children')
+    # Materialized path of ids from the root, e.g. "/3/12/". A subtree is
+    # everything whose path starts with its root's path.
+    path = models.CharField(max_length=255, db_index=True, editable=False, default='')
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='categories/', blank=True, null=True)
     created_at = models.DateTimeField(auto_now_add=True)
@@ -15,10 +26,45 @@ class Category(models.Model):
         verbose_name_plural = 'Categories'
         ordering = ['name']
 
+    def clean(self):
+        if self._parent_in_subtree():
+            raise ValidationError({'parent': 'A category cannot be placed inside itself or one of its subcategories.'})
+
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
-        super().save(*args, **kwargs)
+        # A new row is inserted before its id (and so its path) is known; the
+        # transaction keeps it from being seen until the path is set
+        with transaction.atomic():
+            if self._parent_in_subtree():
+                raise ValueError('A category cannot be placed inside itself or one of its subcategories.')
+            super().save(*args, **kwargs)
+            self._update_path()
+
+    def _parent_in_subtree(self):
+        if not (self.pk and self.parent_id and self.path):
+            return False
+        parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).first() or ''
+        return parent_path.startswith(self.path)
+
+    def _update_path(self):
+        """Sets this category's path and re-roots its subtree with a single UPDATE if it moved"""
+        parent_path = '/'
+        if self.parent_id:
+            parent_path = Category.objects.filter(pk=self.parent_id).values_list('path', flat=True).get()
+        new_path = f'{parent_path}{self.pk}/'
+        if new_path == self.path:
+            return
+        old_path, self.path = self.path, new_path
+        Category.objects.filter(pk=self.pk).update(path=new_path)
+        if old_path:
+            Category.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                path=Concat(Value(new_path), Substr('path', len(old_path) + 1))
+            )
+
+    def get_descendants(self, include_self=True):
+        categories = Category.objects.filter(path__startswith=self.path)
+        return categories if include_self else categories.exclude(pk=self.pk)
 
     def __str__(self):
         return self.name
@@ -103,6 +149,9 @@ class Order(models.Model):
 
     class Meta:
         ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='shop_order_created_idx'),
+        ]
 
     def __str__(self):
         return f'Order #{self.id} - {self.first_name} {self.last_name}'
@@ -150,6 +199,10 @@ class ProductReview(models.Model):
     class Meta:
         ordering = ['-created_at']
         unique_together = ['product', 'user']
+        indexes = [
+            models.Index(fields=['product', 'approved', '-created_at', '-id'], name='shop_review_newest_idx'),
+            models.Index(fields=['product', 'approved', '-rating', '-created_at', '-id'], name='shop_review_rating_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user.username} - {self.product.name} - {self.rating} stars'
@@ -200,17 +253,18 @@ class Coupon(models.Model):
         return self.valid_from <= now <= self.valid_to
 
     def calculate_discount(self, amount):
+        amount = Decimal(str(amount))
         if not self.is_valid() or amount < self.min_purchase:
-            return 0
+            return Decimal('0.00')
         
         if self.discount_type == 'percentage':
-            discount = amount * (self.discount_value / 100)
+            discount = amount * self.discount_value / 100
             if self.max_discount:
                 discount = min(discount, self.max_discount)
         else:
             discount = min(self.discount_value, amount)
         
-        return round(discount, 2)
+        return discount.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
 
 
 class ProductImage(models.Model):
@@ -234,3 +288,143 @@ class ProductImage(models.Model):
         if self.is_primary:
             ProductImage.objects.filter(product=self.product, is_primary=True).update(is_primary=False)
         super().save(*args, **kwargs)
+
+
+class ProductRecommendation(models.Model):
+    """Precomputed "frequently bought together" neighbor of a product"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='recommendations')
+    recommended = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+')
+    score = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ['product', 'recommended']
+        ordering = ['product', '-score']
+        indexes = [
+            models.Index(fields=['product', '-score'], name='shop_rec_product_score_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.product.name} -> {self.recommended.name} ({self.score})'
+
+
+class RecommendationState(models.Model):
+    """Watermark of the orders folded into the recommendations table"""
+    last_created_at = models.DateTimeField(null=True, blank=True)
+    # Orders within the overlap window before the watermark that were already folded
+    recent_order_ids = models.JSONField(default=list, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Recommendations up to {self.last_created_at}'
+
+
+class StockReservation(models.Model):
+    """Temporary hold on stock for a cart line, released when it expires"""
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    # The cart's reservation key, which outlives the session key across a login
+    session_key = models.CharField(max_length=40)
+    quantity = models.PositiveIntegerField(default=1)
+    expires_at = models.DateTimeField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ['product', 'session_key']
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='shop_resv_product_exp_idx'),
+            models.Index(fields=['expires_at'], name='shop_resv_expires_idx'),
+            models.Index(fields=['session_key'], name='shop_resv_session_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product.name} held for {self.session_key}'
+
+
+class DailySales(models.Model):
+    """Store-wide sales rollup for one day, excluding cancelled orders"""
+    date = models.DateField(unique=True)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    order_count = models.IntegerField(default=0)
+    units = models.IntegerField(default=0)
+
+    class Meta:
+        ordering = ['-date']
+        verbose_name = 'Daily Sales'
+        verbose_name_plural = 'Daily Sales'
+
+    def __str__(self):
+        return f'{self.date}: {self.order_count} orders, {self.revenue}'
+
+
+class DailyProductSales(models.Model):
+    date = models.DateField()
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='daily_sales')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['date', 'product']
+        ordering = ['-date']
+
+    def __str__(self):
+        return f'{self.date}: {self.units} x {self.product.name}'
+
+
+class DailyCategorySales(models.Model):
+    date = models.DateField()
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='daily_sales')
+    units = models.IntegerField(default=0)
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        unique_together = ['date', 'category']
+        ordering = ['-date']
+
+    def __str__(self):
+        return f'{self.date}: {self.units} units in {self.category.name}'
+
+
+class ArchivedOrder(models.Model):
+    """Completed or cancelled order moved out of the live tables by archive_orders"""
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders')
+    first_name = models.CharField(max_length=100)
+    last_name = models.CharField(max_length=100)
+    email = models.EmailField()
+    address = models.CharField(max_length=250)
+    city = models.CharField(max_length=100)
+    postal_code = models.CharField(max_length=20)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    discount_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0)
+    coupon = models.ForeignKey('Coupon', on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='shop_archorder_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'Archived order #{self.id} - {self.first_name} {self.last_name}'
+
+    def get_absolute_url(self):
+        return reverse('order_detail', kwargs={'order_id': self.id})
+
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='items')
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    product_name = models.CharField(max_length=200)
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    quantity = models.PositiveIntegerField(default=1)
+
+    def __str__(self):
+        return f'{self.quantity} x {self.product_name}'
+
+    def get_cost(self):
+        return self.price * self.quantity
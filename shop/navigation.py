@@ -0,0 +1,74 @@
+import hashlib
+
+from django.core.cache import cache
+
+from .models import Category
+
+
+CATEGORY_MENU_KEY = 'shop:nav:category-tree'
+# Saves only clear the cache of the worker that made them; the timeout bounds
+# how long other workers keep serving the old menu.
+CATEGORY_MENU_TIMEOUT = 60 * 10
+
+
+def build_category_tree(categories):
+    """Orders category dicts depth-first, siblings by name, adding each one's ``depth``"""
+    children = {}
+    for category in sorted(categories, key=lambda category: category['name'].lower()):
+        children.setdefault(category['parent_id'], []).append(category)
+
+    tree = []
+    stack = [(category, 0) for category in reversed(children.get(None, []))]
+    while stack:
+        category, depth = stack.pop()
+        tree.append({**category, 'depth': depth})
+        stack.extend((child, depth + 1) for child in reversed(children.get(category['id'], [])))
+    return tree
+
+
+def _load_menu():
+    menu = cache.get(CATEGORY_MENU_KEY)
+    if menu is None:
+        entries = build_category_tree(Category.objects.values('id', 'name', 'slug', 'path', 'parent_id'))
+        version = hashlib.sha256(repr(entries).encode()).hexdigest()[:12]
+        menu = {'entries': entries, 'version': version}
+        cache.set(CATEGORY_MENU_KEY, menu, CATEGORY_MENU_TIMEOUT)
+    return menu
+
+
+def get_category_menu():
+    """
+    Returns the category tree as a depth-first list of
+    ``{'id', 'name', 'slug', 'path', 'parent_id', 'depth'}`` dicts.
+    """
+    return _load_menu()['entries']
+
+
+def category_menu_version():
+    """A digest of the menu, which changes when a category is renamed or moved"""
+    return _load_menu()['version']
+
+
+def get_menu_category(slug):
+    """Returns the menu entry for ``slug``, or None"""
+    for category in get_category_menu():
+        if category['slug'] == slug:
+            return category
+    return None
+
+
+def get_breadcrumbs(category_id):
+    """Returns the menu entries from the root down to ``category_id``, without a query"""
+    by_id = {category['id']: category for category in get_category_menu()}
+    category = by_id.get(category_id)
+    if category is None:
+        return []
+    return [by_id[int(ancestor)] for ancestor in category['path'].strip('/').split('/') if int(ancestor) in by_id]
+
+
+def get_subcategories(category_id):
+    return [category for category in get_category_menu() if category['parent_id'] == category_id]
+
+
+def invalidate_category_menu():
+    cache.delete(CATEGORY_MENU_KEY)
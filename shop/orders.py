@@ -0,0 +1,186 @@
+import logging
+import os
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+
+from .models import Order, OrderItem, Product
+from .reservations import commit_stock
+
+
+logger = logging.getLogger(__name__)
+
+ORDER_FIELDS = ['first_name', 'last_name', 'email', 'address', 'city', 'postal_code']
+
+
+def serialize_checkout():
+    """Whether orders go through this process's single writer thread"""
+    return getattr(settings, 'SHOP_SERIALIZE_CHECKOUT', False)
+
+
+def configure_sqlite(connection):
+    """
+    Switches a new SQLite connection to WAL, so catalog reads carry on while
+    the writer commits, and to NORMAL syncs, which are still durable in WAL
+    mode but only fsync at checkpoints.
+    """
+    if connection.vendor != 'sqlite' or not serialize_checkout():
+        return
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode=WAL')
+        cursor.execute('PRAGMA synchronous=NORMAL')
+
+
+def create_order(session_key, cart, details, pricing, coupon):
+    """
+    Sells the cart's stock and records the order in its own transaction (a
+    savepoint when run by the writer). Returns ``(order, unavailable)``, where
+    ``unavailable`` is the id of a product that ran out and nothing was saved.
+    """
+    quantities = {int(product_id): item['quantity'] for product_id, item in cart.items()}
+    with transaction.atomic():
+        unavailable = commit_stock(session_key, quantities)
+        if unavailable is not None:
+            transaction.set_rollback(True)
+            return None, unavailable
+
+        order = Order.objects.create(
+            **details,
+            total_amount=pricing.total,
+            discount_amount=pricing.discount,
+            coupon=coupon if pricing.discount else None,
+        )
+        for product_id, item in cart.items():
+            product = Product.objects.get(id=product_id)
+            OrderItem.objects.create(
+                order=order,
+                product=product,
+                price=item['price'],
+                quantity=item['quantity'],
+            )
+    return order, None
+
+
+class CheckoutTimeout(Exception):
+    """The writer took too long over an order it had already started on"""
+
+
+class OrderJob:
+    def __init__(self, args):
+        self.args = args
+        self.result = None
+        self.error = None
+        self.done = threading.Event()
+        self.lock = threading.Lock()
+        self.taken = False
+        self.withdrawn = False
+
+    def take(self):
+        """Claims the job for the writer, unless its caller gave up on it"""
+        with self.lock:
+            self.taken = not self.withdrawn
+            return self.taken
+
+    def withdraw(self):
+        """Takes the job back from the queue, unless the writer has started on it"""
+        with self.lock:
+            self.withdrawn = not self.taken
+            return self.withdrawn
+
+
+class OrderWriter:
+    """
+    Places queued orders from a single thread, committing whatever has piled
+    up (up to ``SHOP_CHECKOUT_BATCH_SIZE`` orders) in one transaction.
+
+    On SQLite every write transaction takes the database lock and syncs to
+    disk, so batching turns concurrent checkouts from lock contention into a
+    single commit. Each order still gets its own savepoint, so one that runs
+    out of stock or fails doesn't affect the others in the batch.
+
+    A checkout waits ``SHOP_CHECKOUT_TIMEOUT`` seconds for its order. If the
+    writer hasn't picked it up by then, the checkout withdraws it and writes
+    the order itself; if the writer is already on it, ``CheckoutTimeout`` is
+    raised, as the order may still be committed.
+    """
+
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.batch_size = getattr(settings, 'SHOP_CHECKOUT_BATCH_SIZE', 50)
+        self.timeout = getattr(settings, 'SHOP_CHECKOUT_TIMEOUT', 10)
+        self.pid = os.getpid()
+        self.thread = threading.Thread(target=self.run, name='shop-order-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, args):
+        job = OrderJob(args)
+        self.jobs.put(job)
+        if not job.done.wait(self.timeout):
+            if job.withdraw():
+                logger.warning('Order writer did not respond in %ss; placing the order directly', self.timeout)
+                return create_order(*job.args)
+            raise CheckoutTimeout(f'Order still being written after {self.timeout}s')
+        if job.error is not None:
+            raise job.error
+        return job.result
+
+    def run(self):
+        while True:
+            batch = [self.jobs.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.jobs.get_nowait())
+                except queue.Empty:
+                    break
+            self.write(batch)
+
+    def write(self, batch):
+        batch = [job for job in batch if job.take()]
+        if not batch:
+            return
+        try:
+            close_old_connections()
+            with transaction.atomic():
+                for job in batch:
+                    try:
+                        job.result = create_order(*job.args)
+                    except Exception as error:
+                        # Rolled back to the order's savepoint; the rest of the batch goes on
+                        job.error = error
+        except Exception as error:
+            logger.exception('Could not place a batch of %d orders', len(batch))
+            for job in batch:
+                job.result, job.error = None, error
+        finally:
+            for job in batch:
+                job.done.set()
+
+
+_writer = None
+_lock = threading.Lock()
+
+
+def _get_writer():
+    global _writer
+    # A writer started before the server forked belongs to the parent process,
+    # and one whose thread died would leave every order to time out
+    if _writer is None or _writer.pid != os.getpid() or not _writer.thread.is_alive():
+        with _lock:
+            if _writer is None or _writer.pid != os.getpid() or not _writer.thread.is_alive():
+                _writer = OrderWriter()
+    return _writer
+
+
+def place_order(session_key, cart, details, pricing, coupon):
+    """
+    Creates the order for a checkout, through the writer thread when
+    ``SHOP_SERIALIZE_CHECKOUT`` is on. Returns ``(order, unavailable)``; may
+    raise ``CheckoutTimeout`` when serialized.
+    """
+    args = (session_key, cart, details, pricing, coupon)
+    # Inside a transaction (ATOMIC_REQUESTS, tests) the order has to be part of it
+    if not serialize_checkout() or transaction.get_connection().in_atomic_block:
+        return create_order(*args)
+    return _get_writer().submit(args)
@@ -0,0 +1,62 @@
+from collections import namedtuple
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.core.cache import cache
+
+from .cart import cart_version
+
+
+CENT = Decimal('0.01')
+# Coupons can expire or be edited while a result is cached, so keep it short
+PRICING_TIMEOUT = 60 * 5
+
+CartPricing = namedtuple('CartPricing', ['lines', 'subtotal', 'discount', 'total'])
+
+
+def to_money(value):
+    return Decimal(str(value)).quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def price_cart(cart, coupon=None):
+    """
+    Prices a session cart in ``Decimal``: line totals, subtotal, coupon
+    discount and final total in a single pass over the items.
+
+    Lines are dicts with the cart item fields plus ``id`` and ``total``.
+    """
+    lines = []
+    subtotal = Decimal('0.00')
+    for product_id, item in cart.items():
+        price = to_money(item['price'])
+        line_total = price * item['quantity']
+        lines.append({
+            'id': product_id,
+            'name': item['name'],
+            'price': price,
+            'quantity': item['quantity'],
+            'total': line_total,
+            'image': item.get('image'),
+        })
+        subtotal += line_total
+
+    discount = coupon.calculate_discount(subtotal) if coupon and subtotal > 0 else Decimal('0.00')
+    return CartPricing(lines, subtotal, discount, subtotal - discount)
+
+
+def get_cart_pricing(request, cart, coupon=None):
+    """
+    Returns ``price_cart(cart, coupon)``, cached per session and cart version.
+
+    Every cart mutation goes through ``save_cart``, which bumps the version,
+    so a cached result is never served for a cart that has changed.
+    """
+    session_key = request.session.session_key
+    if not cart or not session_key:
+        return price_cart(cart, coupon)
+
+    key = f'shop:pricing:{session_key}:{cart_version(request)}:{coupon.code if coupon else ""}'
+    pricing = cache.get(key)
+    if pricing is None:
+        pricing = price_cart(cart, coupon)
+        cache.set(key, pricing, PRICING_TIMEOUT)
+    return pricing
@@ -0,0 +1,16 @@
+from .models import UserProfile
+
+
+def get_user_profile(user):
+    """
+    Returns the user's profile, cached on the user object for the rest of the request.
+
+    Profiles are created lazily: a user without one gets an unsaved profile,
+    which is inserted the first time the profile form changes something.
+    """
+    try:
+        return user.profile
+    except UserProfile.DoesNotExist:
+        profile = UserProfile(user=user)
+        user.profile = profile
+        return profile
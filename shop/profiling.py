@@ -0,0 +1,193 @@
+import cProfile
+import io
+import json
+import pstats
+import time
+import uuid
+from contextlib import ExitStack
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib import admin
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.http import FileResponse, Http404
+from django.template.response import TemplateResponse
+from django.utils import timezone
+
+
+PROFILE_PARAM = '_profile'
+PROFILE_HEADER = 'X-Profile'
+# Call tree nodes below this share of the request time are left out
+MIN_TREE_FRACTION = 0.005
+MAX_TREE_DEPTH = 40
+
+
+def profile_dir():
+    return Path(getattr(settings, 'SHOP_PROFILE_DIR', settings.BASE_DIR / 'profiles'))
+
+
+def _label(func):
+    filename, line, name = func
+    if filename == '~':
+        return name
+    return f'{name} ({Path(filename).name}:{line})'
+
+
+def call_tree(stats):
+    """
+    Flattens a cProfile run into ``[{'depth', 'name', 'time_ms', 'calls'}]``
+    rows in call order, following the caller -> callee edges from the roots.
+    """
+    callees = {}
+    roots = []
+    for func, (_, calls, _, cumulative, callers) in stats.stats.items():
+        if not callers:
+            roots.append((func, calls, cumulative))
+        for caller, (_, edge_calls, _, edge_cumulative) in callers.items():
+            callees.setdefault(caller, []).append((func, edge_calls, edge_cumulative))
+
+    total = sum(cumulative for _, _, cumulative in roots) or 1
+    rows = []
+
+    def walk(func, calls, cumulative, depth, path):
+        if cumulative / total < MIN_TREE_FRACTION or depth > MAX_TREE_DEPTH:
+            return
+        rows.append({'depth': depth, 'name': _label(func), 'time_ms': cumulative * 1000, 'calls': calls})
+        for child, child_calls, child_cumulative in sorted(callees.get(func, []), key=lambda c: -c[2]):
+            if child not in path:
+                walk(child, child_calls, child_cumulative, depth + 1, path | {child})
+
+    for func, calls, cumulative in sorted(roots, key=lambda r: -r[2]):
+        walk(func, calls, cumulative, 0, {func})
+    return rows
+
+
+def save_profile(request, response, profiler, queries, elapsed):
+    """Writes the raw profile and a JSON summary; returns the profile id"""
+    directory = profile_dir()
+    directory.mkdir(parents=True, exist_ok=True)
+    # Microseconds keep ids, and so pruning, in request order within a second
+    profile_id = f'{timezone.now():%Y%m%d-%H%M%S-%f}-{uuid.uuid4().hex[:6]}'
+
+    profiler.dump_stats(directory / f'{profile_id}.prof')
+    summary = io.StringIO()
+    stats = pstats.Stats(profiler, stream=summary)
+    stats.sort_stats('cumulative').print_stats(40)
+
+    data = {
+        'id': profile_id,
+        'created_at': timezone.now().isoformat(),
+        'method': request.method,
+        'path': request.get_full_path(),
+        'user': request.user.get_username(),
+        'status': response.status_code,
+        'duration_ms': elapsed * 1000,
+        'sql_ms': sum(query['duration_ms'] for query in queries),
+        'queries': queries,
+        'tree': call_tree(stats),
+        'stats': summary.getvalue(),
+    }
+    (directory / f'{profile_id}.json').write_text(json.dumps(data))
+    _prune(directory, getattr(settings, 'SHOP_PROFILE_KEEP', 50))
+    return profile_id
+
+
+def _prune(directory, keep):
+    for summary in sorted(directory.glob('*.json'), reverse=True)[keep:]:
+        summary.unlink(missing_ok=True)
+        summary.with_suffix('.prof').unlink(missing_ok=True)
+
+
+class ProfilingMiddleware:
+    """
+    Profiles a request when a staff user asks for it with ``?_profile`` or an
+    ``X-Profile`` header.
+
+    Other requests only pay for the flag lookup, and with
+    ``SHOP_PROFILING_ENABLED = False`` the middleware is removed altogether.
+    """
+
+    def __init__(self, get_response):
+        if not getattr(settings, 'SHOP_PROFILING_ENABLED', False):
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if PROFILE_PARAM not in request.GET and PROFILE_HEADER not in request.headers:
+            return self.get_response(request)
+        if not request.user.is_staff:
+            return self.get_response(request)
+
+        queries = []
+        started = time.perf_counter()
+
+        def record_sql(execute, sql, params, many, context):
+            query_started = time.perf_counter()
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                queries.append({
+                    'alias': context['connection'].alias,
+                    'start_ms': (query_started - started) * 1000,
+                    'duration_ms': (time.perf_counter() - query_started) * 1000,
+                    'sql': sql,
+                })
+
+        profiler = cProfile.Profile()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(record_sql))
+            profiler.enable()
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        response['X-Profile-Id'] = save_profile(request, response, profiler, queries, elapsed)
+        return response
+
+
+def _load(profile_id):
+    path = profile_dir() / f'{profile_id}.json'
+    if not path.is_file():
+        raise Http404('No such profile.')
+    return json.loads(path.read_text())
+
+
+def profile_list(request):
+    profiles = []
+    for path in sorted(profile_dir().glob('*.json'), reverse=True):
+        data = json.loads(path.read_text())
+        data['query_count'] = len(data['queries'])
+        profiles.append(data)
+    context = {
+        **admin.site.each_context(request),
+        'title': 'Request profiles',
+        'profiles': profiles,
+    }
+    return TemplateResponse(request, 'admin/shop/profiles/list.html', context)
+
+
+def profile_detail(request, profile_id):
+    profile = _load(profile_id)
+    total = profile['duration_ms'] or 1
+    for query in profile['queries']:
+        query['offset_pct'] = query['start_ms'] / total * 100
+        query['width_pct'] = max(query['duration_ms'] / total * 100, 0.5)
+    for row in profile['tree']:
+        row['indent'] = row['depth'] * 16
+    context = {
+        **admin.site.each_context(request),
+        'title': f'Profile of {profile["method"]} {profile["path"]}',
+        'profile': profile,
+    }
+    return TemplateResponse(request, 'admin/shop/profiles/detail.html', context)
+
+
+def profile_download(request, profile_id):
+    path = profile_dir() / f'{profile_id}.prof'
+    if not path.is_file():
+        raise Http404('No such profile.')
+    return FileResponse(path.open('rb'), as_attachment=True, filename=path.name)
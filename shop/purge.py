@@ -0,0 +1,77 @@
+import time
+from collections import Counter
+from decimal import Decimal, InvalidOperation
+from importlib import import_module
+
+from django.conf import settings
+from django.utils import timezone
+
+
+def session_store():
+    return import_module(settings.SESSION_ENGINE).SessionStore
+
+
+class AbandonedCartStats:
+    """Running totals over the carts left in purged sessions"""
+
+    def __init__(self):
+        self.sessions = 0
+        self.carts = 0
+        self.units = 0
+        self.value = Decimal('0')
+        self.products = Counter()
+
+    def add(self, session):
+        self.sessions += 1
+        cart = session.get('cart')
+        if not cart:
+            return
+        self.carts += 1
+        for product_id, item in cart.items():
+            quantity = item.get('quantity', 0)
+            self.units += quantity
+            self.products[item.get('name') or product_id] += quantity
+            try:
+                self.value += Decimal(str(item.get('price', 0))) * quantity
+            except InvalidOperation:
+                pass
+
+    def summary(self):
+        share = self.carts / self.sessions * 100 if self.sessions else 0
+        return f'{self.carts} of {self.sessions} sessions held a cart ({share:.1f}%): {self.units} units worth {self.value:.2f}'
+
+
+def purge_expired_sessions(batch_size=1000, pause=0.0, limit=None, stats=None, log=None):
+    """
+    Deletes sessions that expired before the purge started.
+
+    Each batch picks the oldest expired keys through the ``expire_date`` index
+    and deletes them by primary key, so no statement holds the table for
+    long; ``pause`` seconds between batches let other writers in. Session
+    data is only fetched, one batch at a time, when ``stats`` (an
+    ``AbandonedCartStats``) should be fed. Returns the number deleted.
+    """
+    store = session_store()
+    model = store.get_model_class()
+    decoder = store()
+    expired = model.objects.filter(expire_date__lt=timezone.now())
+    oldest_first = expired.order_by('expire_date')
+    purged = 0
+    while limit is None or purged < limit:
+        size = batch_size if limit is None else min(batch_size, limit - purged)
+        if stats is None:
+            keys = list(oldest_first.values_list('session_key', flat=True)[:size])
+        else:
+            rows = list(oldest_first.values_list('session_key', 'session_data')[:size])
+            keys = [key for key, _ in rows]
+            for _, data in rows:
+                stats.add(decoder.decode(data))
+        if not keys:
+            break
+        # Re-checking the expiry spares a session that was renewed in the meantime
+        purged += expired.filter(session_key__in=keys).delete()[0]
+        if log:
+            log(f'Purged {purged} expired sessions')
+        if pause:
+            time.sleep(pause)
+    return purged
@@ -0,0 +1,135 @@
+from collections import Counter, defaultdict
+from datetime import timedelta
+from itertools import combinations
+
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Order, OrderItem, ProductRecommendation, RecommendationState
+
+
+# Orders commit a little after their created_at is set, and not in id order,
+# so each run reads back this far behind the watermark. An order whose
+# transaction stays open longer than this is never counted.
+RECOMMENDATION_OVERLAP = timedelta(minutes=10)
+
+
+def _pair_counts(order_products):
+    """Counts co-purchases in both directions for a batch of orders"""
+    pairs = Counter()
+    for products in order_products.values():
+        for a, b in combinations(sorted(products), 2):
+            pairs[(a, b)] += 1
+            pairs[(b, a)] += 1
+    return pairs
+
+
+def _merge_pairs(pairs, keep):
+    """
+    Adds a batch of pair counts to the neighbors table.
+
+    Only the ``keep`` strongest neighbors of each product are stored, so a
+    pair that was pruned earlier starts counting again from the new batch.
+    """
+    affected = {product_id for product_id, _ in pairs}
+    existing = {
+        (rec.product_id, rec.recommended_id): rec
+        for rec in ProductRecommendation.objects.filter(product_id__in=affected)
+    }
+
+    by_product = defaultdict(list)
+    for rec in existing.values():
+        by_product[rec.product_id].append(rec)
+    now = timezone.now()
+    for (product_id, recommended_id), count in pairs.items():
+        rec = existing.get((product_id, recommended_id))
+        if rec is None:
+            rec = ProductRecommendation(product_id=product_id, recommended_id=recommended_id, score=0)
+            by_product[product_id].append(rec)
+        rec.score += count
+        rec.updated_at = now
+
+    to_create, to_update, to_delete = [], [], []
+    for product_id, recs in by_product.items():
+        recs.sort(key=lambda rec: rec.score, reverse=True)
+        for rec in recs[:keep]:
+            if rec.pk is None:
+                to_create.append(rec)
+            elif (rec.product_id, rec.recommended_id) in pairs:
+                to_update.append(rec)
+        to_delete.extend(rec.pk for rec in recs[keep:] if rec.pk is not None)
+
+    if to_delete:
+        ProductRecommendation.objects.filter(pk__in=to_delete).delete()
+    ProductRecommendation.objects.bulk_update(to_update, ['score', 'updated_at'], batch_size=500)
+    ProductRecommendation.objects.bulk_create(to_create, batch_size=500)
+    return len(to_create) + len(to_update)
+
+
+def update_recommendations(full=False, chunk_size=1000, keep=50, log=None):
+    """
+    Folds orders placed since the last run into the recommendations table.
+
+    Orders are read by creation time in chunks of ``chunk_size``, starting
+    ``RECOMMENDATION_OVERLAP`` before the watermark so orders that committed
+    late are still picked up; the state remembers which orders in that
+    window were already counted. Each chunk is merged in its own transaction
+    together with the watermark, so an interrupted run resumes where it
+    stopped. ``full`` discards the table and starts over.
+    """
+    state, _ = RecommendationState.objects.get_or_create(pk=1)
+    if full:
+        with transaction.atomic():
+            ProductRecommendation.objects.all().delete()
+            state.last_created_at = None
+            state.recent_order_ids = []
+            state.save()
+
+    orders = Order.objects.order_by('created_at', 'id')
+    if state.last_created_at:
+        orders = orders.filter(created_at__gte=state.last_created_at - RECOMMENDATION_OVERLAP)
+    seen = set(state.recent_order_ids)
+    cursor = None
+    processed = 0
+    while True:
+        chunk = orders
+        if cursor:
+            created_at, order_id = cursor
+            chunk = chunk.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=order_id))
+        rows = list(chunk.values_list('created_at', 'id', 'status')[:chunk_size])
+        if not rows:
+            break
+        cursor = rows[-1][:2]
+        new = [order_id for _, order_id, status in rows if order_id not in seen and status != 'cancelled']
+
+        order_products = defaultdict(set)
+        items = OrderItem.objects.filter(order_id__in=new).values_list('order_id', 'product_id')
+        for order_id, product_id in items.iterator(chunk_size=2000):
+            order_products[order_id].add(product_id)
+
+        watermark = max(filter(None, [state.last_created_at, cursor[0]]))
+        seen.update(order_id for _, order_id, _ in rows)
+        seen = set(Order.objects.filter(
+            pk__in=seen, created_at__gte=watermark - RECOMMENDATION_OVERLAP
+        ).values_list('pk', flat=True))
+
+        with transaction.atomic():
+            written = _merge_pairs(_pair_counts(order_products), keep) if order_products else 0
+            state.last_created_at = watermark
+            state.recent_order_ids = sorted(seen)
+            state.save()
+
+        processed += len(order_products)
+        if log:
+            log(f'Orders up to {watermark:%Y-%m-%d %H:%M:%S}: {len(order_products)} orders, {written} neighbors written')
+
+    return processed
+
+
+def get_recommendations(product, limit=4):
+    """Returns the top co-purchased products with a single indexed query"""
+    recs = ProductRecommendation.objects.filter(
+        product=product, recommended__available=True
+    ).select_related('recommended').order_by('-score')[:limit]
+    return [rec.recommended for rec in recs]
@@ -0,0 +1,122 @@
+import uuid
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThanOrEqual
+from django.utils import timezone
+
+from .catalog import mark_catalog_stale
+from .models import Product, StockReservation
+from .snapshots import invalidate_product_snapshot
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'CART_RESERVATION_TTL', 15 * 60))
+
+
+def reservation_key(request, create=True):
+    """
+    Returns the key the cart's stock holds are filed under.
+
+    It lives in the session data instead of being the session key, which
+    ``login()`` rotates, so the holds follow the cart into the account.
+    """
+    key = request.session.get('reservation_key')
+    if key is None and create:
+        key = request.session['reservation_key'] = uuid.uuid4().hex
+    return key
+
+
+def _active_reservations(exclude_session=None):
+    reservations = StockReservation.objects.filter(expires_at__gt=timezone.now())
+    if exclude_session:
+        reservations = reservations.exclude(session_key=exclude_session)
+    return reservations
+
+
+def reserved_subquery(exclude_session=None, product=OuterRef('pk')):
+    """Sum of active reservations for ``product``, for use in annotations"""
+    return Coalesce(Subquery(
+        _active_reservations(exclude_session).filter(
+            product=product
+        ).order_by().values('product').annotate(total=Sum('quantity')).values('total')
+    ), Value(0))
+
+
+def reserve(product, session_key, quantity):
+    """
+    Holds ``quantity`` units of ``product`` for a cart.
+
+    The check is part of the write: a single conditional UPDATE sets the hold
+    only if the product's stock covers it on top of the other carts' active
+    holds, the same way ``commit_stock`` sells stock, so editing a cart never
+    waits on a product lock. A hold that doesn't fit leaves the previous one
+    as it was. Returns ``(True, quantity)``, or ``(False, available)`` with
+    the most the cart could hold.
+    """
+    stock = Subquery(Product.objects.filter(pk=OuterRef('product')).order_by().values('stock'))
+    hold, created = StockReservation.objects.get_or_create(
+        product_id=product.pk, session_key=session_key,
+        defaults={'quantity': 0, 'expires_at': timezone.now()},
+    )
+    reserved = StockReservation.objects.filter(
+        GreaterThanOrEqual(stock, Value(quantity) + reserved_subquery(session_key, OuterRef('product'))),
+        pk=hold.pk,
+    ).update(quantity=quantity, expires_at=timezone.now() + reservation_ttl())
+    if reserved:
+        return True, quantity
+    if created:
+        hold.delete()
+    available = Product.objects.filter(pk=product.pk).annotate(
+        unreserved=F('stock') - reserved_subquery(session_key)
+    ).values_list('unreserved', flat=True).first()
+    return False, max(available or 0, 0)
+
+
+def release(product_id, session_key):
+    if session_key:
+        StockReservation.objects.filter(product_id=product_id, session_key=session_key).delete()
+
+
+def release_session(session_key):
+    if session_key:
+        StockReservation.objects.filter(session_key=session_key).delete()
+
+
+def commit_stock(session_key, quantities):
+    """
+    Converts a session's holds into sold stock for ``{product_id: quantity}``.
+
+    Each product is decremented with a single conditional UPDATE that leaves
+    room for the other sessions' active holds. Must run inside a transaction;
+    returns the id of the first product that couldn't be fulfilled, or None.
+    """
+    now = timezone.now()
+    for product_id, quantity in quantities.items():
+        updated = Product.objects.filter(
+            pk=product_id,
+            stock__gte=Value(quantity) + reserved_subquery(exclude_session=session_key),
+        ).update(stock=F('stock') - quantity, updated_at=now)
+        if not updated:
+            return product_id
+        # update() skips the save signals that normally drop the snapshots
+        transaction.on_commit(lambda product_id=product_id: invalidate_product_snapshot(product_id))
+    transaction.on_commit(mark_catalog_stale)
+    release_session(session_key)
+    return None
+
+
+def release_expired(batch_size=1000, now=None):
+    """Deletes expired reservations in batches of primary keys; returns the count"""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        batch = list(
+            StockReservation.objects.filter(expires_at__lte=now).values_list('pk', flat=True)[:batch_size]
+        )
+        if not batch:
+            return total
+        total += StockReservation.objects.filter(pk__in=batch).delete()[0]
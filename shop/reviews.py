@@ -0,0 +1,77 @@
+import base64
+import json
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+from .models import ProductReview
+
+
+SORTS = {
+    'newest': ['-created_at', '-id'],
+    'highest': ['-rating', '-created_at', '-id'],
+}
+PAGE_SIZE = 10
+
+
+def encode_cursor(review, sort):
+    values = {'c': review.created_at.isoformat(), 'i': review.id}
+    if sort == 'highest':
+        values['r'] = review.rating
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Returns the cursor values, or None if the cursor is malformed"""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        created_at = parse_datetime(values['c'])
+        if created_at is None:
+            return None
+        return {
+            'created_at': created_at,
+            'id': int(values['i']),
+            'rating': int(values['r']) if 'r' in values else None,
+        }
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+def _after(cursor, sort):
+    """Keyset condition for the rows that come after ``cursor`` in ``sort`` order"""
+    newer = Q(created_at__lt=cursor['created_at']) | Q(created_at=cursor['created_at'], id__lt=cursor['id'])
+    if sort == 'highest':
+        return Q(rating__lt=cursor['rating']) | (Q(rating=cursor['rating']) & newer)
+    return newer
+
+
+def review_page(product, sort='newest', rating=None, cursor=None, limit=PAGE_SIZE):
+    """
+    Returns ``(reviews, next_cursor)`` for one page of a product's approved reviews.
+
+    Pages are addressed by the last row seen rather than an offset, so every
+    page is an index range scan however deep the reader goes.
+    """
+    if sort not in SORTS:
+        sort = 'newest'
+    reviews = ProductReview.objects.filter(product=product, approved=True)
+    if rating:
+        reviews = reviews.filter(rating=rating)
+    if cursor:
+        position = decode_cursor(cursor)
+        if position and (sort != 'highest' or position['rating'] is not None):
+            reviews = reviews.filter(_after(position, sort))
+
+    page = list(reviews.select_related('user').order_by(*SORTS[sort])[:limit + 1])
+    next_cursor = encode_cursor(page[limit - 1], sort) if len(page) > limit else None
+    return page[:limit], next_cursor
+
+
+def serialize_review(review):
+    return {
+        'id': review.id,
+        'username': review.user.username,
+        'rating': review.rating,
+        'comment': review.comment,
+        'created_at': review.created_at.strftime('%b %d, %Y'),
+    }
@@ -1,17 +1,103 @@
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_init, post_save, post_delete
 from django.dispatch import receiver
-from django.contrib.auth.models import User
-from .models import UserProfile
+from .models import (
+    Category, Product, ProductReview, Order, OrderItem, Wishlist, ProductImage, ProductRecommendation,
+)
+from . import analytics
+from .catalog import mark_catalog_stale
+from .facets import invalidate_facets
+from .autocomplete import invalidate_index
+from .navigation import invalidate_category_menu
+from .orders import configure_sqlite
+from .snapshots import invalidate_product_snapshot
+from .wishlists import invalidate_wishlist
 
 
-@receiver(post_save, sender=User)
-def create_user_profile(sender, instance, created, **kwargs):
-    if created:
-        UserProfile.objects.create(user=instance)
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+def invalidate_facet_cache(sender, **kwargs):
+    invalidate_facets()
 
 
-@receiver(post_save, sender=User)
-def save_user_profile(sender, instance, **kwargs):
-    if hasattr(instance, 'profile'):
-        instance.profile.save()
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_autocomplete_index(sender, **kwargs):
+    invalidate_index()
 
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_navigation(sender, **kwargs):
+    # post_save fires before Category.save() sets the path, so wait for the commit
+    transaction.on_commit(invalidate_category_menu)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_snapshots(sender, instance, **kwargs):
+    invalidate_product_snapshot(instance.pk, instance.slug)
+
+
+# Sales rollups
+
+@receiver(post_init, sender=Order)
+def remember_order_values(sender, instance, **kwargs):
+    analytics.remember_order(instance)
+
+
+@receiver(post_init, sender=OrderItem)
+def remember_item_values(sender, instance, **kwargs):
+    analytics.remember_item(instance)
+
+
+@receiver(post_save, sender=Order)
+def update_order_rollups(sender, instance, created, **kwargs):
+    analytics.order_changed(instance, created)
+    analytics.remember_order(instance)
+
+
+@receiver(post_save, sender=OrderItem)
+def update_item_rollups(sender, instance, created, **kwargs):
+    analytics.item_changed(instance, created)
+    analytics.remember_item(instance)
+
+
+@receiver(post_delete, sender=Order)
+def remove_order_rollups(sender, instance, **kwargs):
+    analytics.order_deleted(instance)
+
+
+@receiver(post_delete, sender=OrderItem)
+def remove_item_rollups(sender, instance, origin=None, **kwargs):
+    analytics.item_deleted(instance, origin)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+@receiver(post_save, sender=ProductReview)
+@receiver(post_delete, sender=ProductReview)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+@receiver(post_save, sender=ProductRecommendation)
+def stop_serving_catalog_snapshot(sender, **kwargs):
+    # Only this worker notices; the others rely on the snapshot's max age
+    mark_catalog_stale()
+
+
+@receiver(post_save, sender=Wishlist)
+@receiver(post_delete, sender=Wishlist)
+def invalidate_wishlist_set(sender, instance, **kwargs):
+    invalidate_wishlist(instance.user_id)
+
+
+@receiver(connection_created)
+def configure_connection(sender, connection, **kwargs):
+    configure_sqlite(connection)
@@ -0,0 +1,172 @@
+import json
+import os
+from datetime import timezone
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, ExpressionWrapper, F, IntegerField, Max, Q, Value
+from django.urls import reverse
+
+from .models import Category, Product
+
+
+# Products are sharded by primary key range, so a product never moves
+# between files and a shard can never exceed the 50,000 URL limit
+SHARD_SIZE = 50000
+INDEX_NAME = 'sitemap.xml'
+CATEGORY_SHARD = 'sitemap-categories.xml'
+STATE_NAME = 'state.json'
+
+URLSET_OPEN = '<?xml version="1.0" encoding="UTF-8"?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+URLSET_CLOSE = '</urlset>\n'
+
+
+def sitemap_root():
+    return Path(getattr(settings, 'SITEMAP_ROOT', settings.BASE_DIR / 'sitemaps'))
+
+
+def site_url():
+    return getattr(settings, 'SITE_URL', 'http://localhost:8000').rstrip('/')
+
+
+def product_shard_name(shard):
+    return f'sitemap-products-{shard}.xml'
+
+
+def _lastmod(value):
+    return value.astimezone(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ') if value else None
+
+
+class StreamingWriter:
+    """Writes ``<url>`` entries straight to a temp file and swaps it into place on close"""
+
+    def __init__(self, path, opening=URLSET_OPEN, closing=URLSET_CLOSE):
+        self.path = path
+        self.temp_path = path.with_name(path.name + '.tmp')
+        self.closing = closing
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        self.file.write(opening)
+        self.count = 0
+
+    def write(self, tag, loc, lastmod=None):
+        entry = f'<{tag}><loc>{escape(loc)}</loc>'
+        if lastmod:
+            entry += f'<lastmod>{lastmod}</lastmod>'
+        self.file.write(entry + f'</{tag}>\n')
+        self.count += 1
+
+    def close(self):
+        self.file.write(self.closing)
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            self.temp_path.unlink(missing_ok=True)
+
+
+def _shard_expression():
+    return ExpressionWrapper(F('pk') / Value(SHARD_SIZE), output_field=IntegerField())
+
+
+def shard_signatures():
+    """
+    Returns ``{shard: (signature, lastmod)}`` for every product shard in one
+    grouped query. The signature changes whenever a product in the shard is
+    saved, added, deleted or changes availability.
+    """
+    rows = Product.objects.annotate(shard=_shard_expression()).order_by().values('shard').annotate(
+        last=Max('updated_at'), total=Count('id'), available=Count('id', filter=Q(available=True)),
+    )
+    return {
+        row['shard']: (f'{row["last"].isoformat()}|{row["total"]}|{row["available"]}', _lastmod(row['last']))
+        for row in rows
+        if row['available']
+    }
+
+
+def write_product_shard(directory, shard, base_url):
+    products = Product.objects.filter(
+        available=True, pk__gte=shard * SHARD_SIZE, pk__lt=(shard + 1) * SHARD_SIZE
+    ).only('pk', 'slug', 'updated_at').order_by('pk')
+    with StreamingWriter(directory / product_shard_name(shard)) as writer:
+        for product in products.iterator(chunk_size=2000):
+            writer.write('url', base_url + product.get_absolute_url(), _lastmod(product.updated_at))
+    return writer.count
+
+
+def write_category_shard(directory, base_url):
+    """Writes the category listings, each dated by its most recently updated product"""
+    list_url = base_url + reverse('product_list')
+    categories = Category.objects.annotate(
+        last=Max('products__updated_at', filter=Q(products__available=True))
+    ).order_by('slug').values_list('slug', 'last')
+    with StreamingWriter(directory / CATEGORY_SHARD) as writer:
+        for slug, last in categories.iterator(chunk_size=2000):
+            writer.write('url', f'{list_url}?category={slug}', _lastmod(last))
+    return writer.count
+
+
+def write_index(directory, base_url, entries):
+    opening = '<?xml version="1.0" encoding="UTF-8"?>\n<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">\n'
+    with StreamingWriter(directory / INDEX_NAME, opening, '</sitemapindex>\n') as writer:
+        for name, lastmod in entries:
+            writer.write('sitemap', f'{base_url}{reverse("sitemap_file", args=[name])}', lastmod)
+
+
+def build_sitemaps(full=False, base_url=None, log=None):
+    """
+    Regenerates the product shards whose signature changed since the last
+    run (all of them with ``full``), the category sitemap and the index.
+
+    Returns ``(written, skipped)`` shard counts.
+    """
+    log = log or (lambda message: None)
+    base_url = (base_url or site_url()).rstrip('/')
+    directory = sitemap_root()
+    directory.mkdir(parents=True, exist_ok=True)
+    state_path = directory / STATE_NAME
+
+    state = {}
+    if not full and state_path.is_file():
+        state = json.loads(state_path.read_text())
+        if state.get('base_url') != base_url:
+            state = {}
+    previous = state.get('shards', {})
+
+    signatures = shard_signatures()
+    written = skipped = 0
+    for shard, (signature, _) in sorted(signatures.items()):
+        if previous.get(str(shard)) == signature and (directory / product_shard_name(shard)).is_file():
+            skipped += 1
+            continue
+        count = write_product_shard(directory, shard, base_url)
+        log(f'{product_shard_name(shard)}: {count} URLs')
+        written += 1
+
+    # Shards that no longer have any available products are removed
+    current = {product_shard_name(shard) for shard in signatures}
+    for path in directory.glob(product_shard_name('*')):
+        if path.name not in current:
+            path.unlink()
+
+    categories = write_category_shard(directory, base_url)
+    log(f'{CATEGORY_SHARD}: {categories} URLs')
+
+    lastmods = [lastmod for _, lastmod in signatures.values() if lastmod]
+    entries = [(CATEGORY_SHARD, max(lastmods) if lastmods else None)]
+    entries += [(product_shard_name(shard), lastmod) for shard, (_, lastmod) in sorted(signatures.items())]
+    write_index(directory, base_url, entries)
+
+    state_path.write_text(json.dumps({
+        'base_url': base_url,
+        'shards': {str(shard): signature for shard, (signature, _) in signatures.items()},
+    }))
+    return written, skipped
@@ -0,0 +1,158 @@
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+from django.core.cache import cache
+from django.http import Http404
+
+from .models import Product
+
+
+ProductSnapshot = namedtuple(
+    'ProductSnapshot', ['id', 'slug', 'name', 'price', 'stock', 'image_url', 'available']
+)
+ProductSnapshot.pk = property(lambda self: self.id)
+
+# Level 1 lives in the worker and is kept short because other workers' saves
+# can't clear it; level 2 is the Django cache. With the default local-memory
+# cache level 2 is per worker too, so a snapshot can trail another worker's
+# save by up to SHARED_TTL: they only feed catalog pages, while the cart,
+# reservations and checkout read price and stock from the database.
+LOCAL_TTL = 5
+LOCAL_MAX_ENTRIES = 2000
+SHARED_TTL = 60 * 10
+MISSING_TTL = 30
+
+MISSING = 'missing'
+
+
+class LocalCache:
+    """Small LRU of ``key -> (expires, value)`` for the current process"""
+
+    def __init__(self, max_entries=LOCAL_MAX_ENTRIES, ttl=LOCAL_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.entries.pop(key, None)
+
+
+_local = LocalCache()
+
+
+def _id_key(product_id):
+    return f'shop:product:id:{product_id}'
+
+
+def _slug_key(slug):
+    return f'shop:product:slug:{slug}'
+
+
+def make_snapshot(product):
+    return ProductSnapshot(
+        id=product.pk,
+        slug=product.slug,
+        name=product.name,
+        price=product.price,
+        stock=product.stock,
+        image_url=product.image.url if product.image else None,
+        available=product.available,
+    )
+
+
+def _read(key, load, ttl=SHARED_TTL):
+    """Read-through lookup: process cache, then shared cache, then ``load()``"""
+    value = _local.get(key)
+    if value is None:
+        value = cache.get(key)
+        if value is None:
+            value = load()
+            cache.set(key, MISSING if value is None else value, ttl if value is not None else MISSING_TTL)
+        _local.set(key, value or MISSING)
+    return None if value == MISSING else value
+
+
+def _load_by_id(product_id):
+    product = Product.objects.filter(pk=product_id).first()
+    return make_snapshot(product) if product else None
+
+
+def get_product_snapshot(product_id):
+    """Returns the snapshot for ``product_id``, or None if there is no such product"""
+    try:
+        product_id = int(product_id)
+    except (TypeError, ValueError):
+        return None
+    return _read(_id_key(product_id), lambda: _load_by_id(product_id))
+
+
+def get_product_snapshot_by_slug(slug):
+    """
+    Returns the snapshot for ``slug``, or None.
+
+    The slug key only maps to the product id, so invalidating a product only
+    has to clear its id key; a mapping left behind by a slug change is caught
+    by comparing the snapshot's slug.
+    """
+    def load_id():
+        return Product.objects.filter(slug=slug).values_list('pk', flat=True).first()
+
+    product_id = _read(_slug_key(slug), load_id)
+    if product_id is None:
+        return None
+    snapshot = get_product_snapshot(product_id)
+    if snapshot is None or snapshot.slug != slug:
+        invalidate_product_snapshot(product_id, slug)
+        product_id = load_id()
+        return get_product_snapshot(product_id) if product_id else None
+    return snapshot
+
+
+def prime_product_snapshots(products):
+    """Writes shared-cache snapshots for ``products`` in one round trip; returns the count"""
+    entries = {}
+    for product in products:
+        entries[_id_key(product.pk)] = make_snapshot(product)
+        entries[_slug_key(product.slug)] = product.pk
+    cache.set_many(entries, SHARED_TTL)
+    return len(entries) // 2
+
+
+def invalidate_product_snapshot(product_id, slug=None):
+    keys = [_id_key(product_id)]
+    if slug:
+        keys.append(_slug_key(slug))
+    for key in keys:
+        _local.delete(key)
+    cache.delete_many(keys)
+
+
+def get_snapshot_or_404(product_id=None, slug=None, available_only=False):
+    if slug is not None:
+        snapshot = get_product_snapshot_by_slug(slug)
+    else:
+        snapshot = get_product_snapshot(product_id)
+    if snapshot is None or (available_only and not snapshot.available):
+        raise Http404('No Product matches the given query.')
+    return snapshot
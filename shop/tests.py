@@ -1,3 +1,1141 @@
-from django.test import TestCase
+import os
+import runpy
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.models import Session
+from django.core.cache import caches
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.models import ProtectedError, Sum
+from django.template import engines
+from django.template.loaders.cached import Loader as CachedLoader
+from django.test import Client, LiveServerTestCase, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from . import autocomplete, catalog, facets, orders, reservations, sitemaps, snapshots, wishlists
+from .analytics import rebuild_rollups
+from .archive import archive_orders
+from .bulk import reprice
+from .loadtest import check_consistency
+from .catalog import export_catalog
+from .models import (
+    ArchivedOrder, Category, Coupon, DailyCategorySales, DailyProductSales, DailySales, Order, OrderItem, Product,
+    ProductRecommendation, ProductReview, RecommendationState, StockReservation, Wishlist,
+)
+from .navigation import get_category_menu, get_menu_category
+from .pricing import price_cart
+from .purge import AbandonedCartStats, purge_expired_sessions
+from .recommendations import get_recommendations, update_recommendations
+from .reservations import commit_stock, release_expired, reserve
+from .snapshots import get_product_snapshot, get_product_snapshot_by_slug
+from .throttling import TokenBucket, client_ident, client_ip
+
+
+def make_product(category, name, price='10.00', stock=5, **fields):
+    return Product.objects.create(
+        category=category, name=name, description='A product', price=price, stock=stock, **fields
+    )
+
+
+CHECKOUT_DETAILS = {
+    'first_name': 'Ada', 'last_name': 'Lovelace', 'email': 'ada@example.com',
+    'address': '1 Analytical Way', 'city': 'London', 'postal_code': 'N1',
+}
+
+
+# Never created, so catalog pages come from the database unless a test exports a snapshot
+NO_SNAPSHOT = Path(tempfile.gettempdir()) / f'shop-tests-{os.getpid()}' / 'catalog.snapshot'
+
+
+@override_settings(CATALOG_SNAPSHOT_PATH=NO_SNAPSHOT)
+class ShopTestCase(TestCase):
+    """Starts every test with empty per-process caches and no catalog snapshot file"""
+
+    def setUp(self):
+        for cache in caches.all():
+            cache.clear()
+        snapshots._local.entries.clear()
+        autocomplete.invalidate_index()
+        catalog._current = None
+        catalog._checked_at = 0.0
+
+
+class StaticFilesTests(TestCase):
+    def test_pages_render_without_collectstatic(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, '/static/shop/css/shop.css')
+        self.assertContains(response, '/static/shop/js/shop.js')
+
+
+class ConditionalGetTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Electronics')
+        self.product = make_product(self.category, 'Phone')
+
+    def test_list_not_modified(self):
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get('/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    def test_detail_not_modified_until_product_changes(self):
+        response = self.client.get('/product/phone/')
+        etag = response['ETag']
+        self.assertEqual(self.client.get('/product/phone/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        self.product.price = '12.00'
+        self.product.save()
+        self.assertEqual(self.client.get('/product/phone/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_cart_changes_etag(self):
+        etag = self.client.get('/').get('ETag')
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        response = self.client.get('/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_flash_message_is_not_hidden_by_a_304(self):
+        self.product.stock = 1
+        self.product.save()
+        etag = self.client.get('/product/phone/')['ETag']
+        Client().post(f'/cart/add/{self.product.pk}/')
+
+        response = self.client.post(f'/cart/add/{self.product.pk}/')
+        self.assertRedirects(response, '/product/phone/', fetch_redirect_response=False)
+        response = self.client.get('/product/phone/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Only 0 items available in stock!')
+        # Once the message has been shown the page validates again
+        self.assertEqual(self.client.get('/product/phone/', HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_category_rename_changes_etag(self):
+        etag = self.client.get('/product/phone/')['ETag']
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Gadgets'
+            self.category.save()
+        response = self.client.get('/product/phone/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, 'Gadgets')
+
+    def test_logged_in_users_get_full_responses(self):
+        user = User.objects.create_user('shopper', password='secret-pass-1')
+        self.client.force_login(user)
+        response = self.client.get('/')
+        self.assertNotIn('ETag', response)
+        self.assertNotIn('Last-Modified', response)
+
+    def test_missing_product(self):
+        self.assertEqual(self.client.get('/product/nothing/').status_code, 404)
+
+
+class FacetTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Audio')
+        self.cheap = make_product(category, 'Earbuds', price='100', stock=0)
+        make_product(category, 'Speaker', price='700', stock=3)
+        make_product(category, 'Amplifier', price='7000', stock=1)
+        user = User.objects.create_user('reviewer')
+        ProductReview.objects.create(product=self.cheap, user=user, rating=5, comment='Great')
+
+    def facets(self, query=''):
+        return self.client.get(f'/?category=audio{query}').context['facets']
+
+    def test_counts_without_filters(self):
+        facets = self.facets()
+        self.assertEqual([option['count'] for option in facets['price']], [1, 1, 0, 1])
+        self.assertEqual([option['count'] for option in facets['rating']], [1, 1, 1, 1])
+        self.assertEqual(facets['in_stock']['count'], 2)
+
+    def test_counts_ignore_their_own_filter(self):
+        response = self.client.get('/?category=audio&in_stock=1&price=500-1000')
+        self.assertEqual([product.name for product in response.context['products']], ['Speaker'])
+        facets = response.context['facets']
+        # Price counts apply the stock filter but not the price filter, and vice versa
+        self.assertEqual([option['count'] for option in facets['price']], [0, 1, 0, 1])
+        self.assertEqual(facets['in_stock']['count'], 1)
+        self.assertEqual([option['count'] for option in facets['rating']], [0, 0, 0, 0])
+
+    def test_new_review_updates_cached_counts(self):
+        self.assertEqual(self.facets()['rating'][0]['count'], 1)
+        speaker = Product.objects.get(name='Speaker')
+        ProductReview.objects.create(product=speaker, user=User.objects.create_user('other'), rating=4)
+        self.assertEqual(self.facets()['rating'][0]['count'], 2)
+
+    def test_change_made_by_another_worker_shows_up_after_the_timeout(self):
+        self.assertEqual(self.facets()['in_stock']['count'], 2)
+        # update() skips the signals, like a save handled by another worker
+        Product.objects.filter(name='Earbuds').update(stock=4)
+        self.assertEqual(self.facets()['in_stock']['count'], 2)
+
+        later = time.time() + facets.FACET_CACHE_TIMEOUT + 1
+        with mock.patch('django.core.cache.backends.locmem.time.time', return_value=later):
+            self.assertEqual(self.facets()['in_stock']['count'], 3)
+
+
+class RecommendationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Garden')
+        self.spade, self.rake, self.hose = [make_product(category, name) for name in ['Spade', 'Rake', 'Hose']]
+
+    def order(self, *products, created_at=None, **fields):
+        order = Order.objects.create(**CHECKOUT_DETAILS, **fields)
+        for product in products:
+            OrderItem.objects.create(order=order, product=product, price=product.price, quantity=1)
+        if created_at:
+            Order.objects.filter(pk=order.pk).update(created_at=created_at)
+        return order
+
+    def scores(self, product):
+        return dict(ProductRecommendation.objects.filter(product=product).values_list('recommended__name', 'score'))
+
+    def test_co_purchases_are_ranked(self):
+        self.order(self.spade, self.rake)
+        self.order(self.spade, self.rake, self.hose)
+        cancelled = self.order(self.spade, self.hose)
+        Order.objects.filter(pk=cancelled.pk).update(status='cancelled')
+
+        self.assertEqual(update_recommendations(chunk_size=1), 2)
+        self.assertEqual(self.scores(self.spade), {'Rake': 2, 'Hose': 1})
+        self.assertEqual(get_recommendations(self.spade), [self.rake, self.hose])
+
+    def test_order_committed_behind_the_watermark_is_counted_once(self):
+        self.order(self.spade, self.rake, pk=10)
+        update_recommendations()
+        watermark = RecommendationState.objects.get().last_created_at
+
+        # Took a lower id and an earlier timestamp than the last run's newest order, but committed after the run
+        self.order(self.spade, self.hose, pk=5, created_at=watermark - timedelta(minutes=1))
+        self.assertEqual(update_recommendations(), 1)
+        self.assertEqual(update_recommendations(), 0)
+        self.assertEqual(self.scores(self.spade), {'Rake': 1, 'Hose': 1})
+
+        update_recommendations(full=True)
+        self.assertEqual(self.scores(self.spade), {'Rake': 1, 'Hose': 1})
+
+
+class AutocompleteTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        audio = Category.objects.create(name='Headwear')
+        self.headphones = make_product(audio, 'Wireless Headphones')
+        self.torch = make_product(audio, 'Head Torch')
+        make_product(audio, 'Headband', available=False)
+        order = Order.objects.create(**CHECKOUT_DETAILS)
+        OrderItem.objects.create(order=order, product=self.torch, price='10.00', quantity=3)
+
+    def labels(self, query):
+        return [result['label'] for result in autocomplete.suggest(query)]
+
+    def test_word_prefixes_ranked_by_sales(self):
+        self.assertEqual(self.labels('head'), ['Head Torch', 'Headwear', 'Wireless Headphones'])
+        self.assertEqual(self.labels('  HEADP'), ['Wireless Headphones'])
+        self.assertEqual(self.labels('wireless h'), ['Wireless Headphones'])
+        self.assertEqual(self.labels('xyz'), [])
+
+    def test_short_prefixes_use_the_precomputed_ranking(self):
+        self.assertEqual(self.labels('h')[:2], ['Head Torch', 'Headwear'])
+        self.assertEqual(self.labels('t'), ['Head Torch'])
+
+    def test_saves_rebuild_the_index(self):
+        self.assertEqual(self.labels('head'), ['Head Torch', 'Headwear', 'Wireless Headphones'])
+        self.torch.available = False
+        self.torch.save()
+        self.assertEqual(self.labels('head'), ['Headwear', 'Wireless Headphones'])
+
+    def test_view(self):
+        response = self.client.get('/search/autocomplete/', {'q': 'wire'})
+        self.assertEqual(response.json(), {'results': [
+            {'label': 'Wireless Headphones', 'type': 'product', 'url': '/product/wireless-headphones/'},
+        ]})
+
+
+class ReservationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Toys'), 'Kite', stock=1)
+
+    def held(self):
+        return list(StockReservation.objects.order_by('session_key').values_list('session_key', 'quantity'))
+
+    def test_two_sessions_cannot_both_hold_the_last_unit(self):
+        first, second = Client(), Client()
+        self.assertTrue(first.post(f'/cart/add/{self.product.pk}/', HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()['success'])
+        response = second.post(f'/cart/add/{self.product.pk}/', HTTP_X_REQUESTED_WITH='XMLHttpRequest').json()
+        self.assertFalse(response['success'])
+        self.assertEqual(self.held(), [(first.session['reservation_key'], 1)])
+
+    def test_hold_written_first_wins(self):
+        # Session b's hold lands between session a creating its row and a's conditional update
+        ttl = reservations.reservation_ttl
+        results = {}
+
+        def interleaved():
+            if not results:
+                results['b'] = None
+                results['b'] = reserve(self.product, 'b', 1)
+            return ttl()
+
+        with mock.patch.object(reservations, 'reservation_ttl', interleaved):
+            results['a'] = reserve(self.product, 'a', 1)
+        self.assertEqual(results, {'a': (False, 0), 'b': (True, 1)})
+        self.assertEqual(self.held(), [('b', 1)])
+
+    def test_holds_follow_the_cart_through_login(self):
+        User.objects.create_user('shopper', password='kite-flyer-1')
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        response = self.client.post('/login/', {'username': 'shopper', 'password': 'kite-flyer-1'})
+        self.assertEqual(response.status_code, 302)
+
+        self.client.post('/checkout/', CHECKOUT_DETAILS)
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 0)
+        self.assertEqual(self.held(), [])
+
+    def test_failed_hold_keeps_the_previous_quantity(self):
+        self.product.stock = 2
+        self.product.save()
+        reserve(self.product, 'a', 1)
+        reserve(self.product, 'b', 1)
+        self.assertEqual(reserve(self.product, 'a', 2), (False, 1))
+        self.assertEqual(self.held(), [('a', 1), ('b', 1)])
+
+    def test_expired_holds_free_their_stock(self):
+        reserve(self.product, 'a', 1)
+        self.assertEqual(reserve(self.product, 'b', 1), (False, 0))
+        StockReservation.objects.filter(session_key='a').update(expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(reserve(self.product, 'b', 1), (True, 1))
+
+        self.assertEqual(release_expired(), 1)
+        self.assertEqual(self.held(), [('b', 1)])
+
+    def test_checkout_leaves_other_holds_alone(self):
+        self.product.stock = 3
+        self.product.save()
+        reserve(self.product, 'a', 2)
+        reserve(self.product, 'b', 1)
+        with transaction.atomic():
+            self.assertEqual(commit_stock('b', {self.product.pk: 2}), self.product.pk)
+        with transaction.atomic():
+            self.assertIsNone(commit_stock('b', {self.product.pk: 1}))
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 2)
+        self.assertEqual(self.held(), [('a', 2)])
+
+
+class NavigationTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.category = Category.objects.create(name='Outdoors')
+
+    def test_menu_is_built_once(self):
+        with self.assertNumQueries(1):
+            get_category_menu()
+        with self.assertNumQueries(0):
+            self.assertEqual([entry['slug'] for entry in get_category_menu()], ['outdoors'])
+        self.assertContains(self.client.get('/'), '?category=outdoors')
+
+    def test_saves_rebuild_the_menu(self):
+        get_category_menu()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Camping'
+            self.category.save()
+        self.assertEqual([entry['name'] for entry in get_category_menu()], ['Camping'])
+
+    def test_templates_are_compiled_once(self):
+        loader = engines['django'].engine.template_loaders[0]
+        self.assertIsInstance(loader, CachedLoader)
+        self.client.get('/')
+        self.assertIn('shop/base.html', loader.get_template_cache)
+
+
+class WarmUpTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Outdoors'), 'Tent')
+        self.loader = engines['django'].engine.template_loaders[0]
+        self.loader.reset()
+
+    def assertWarm(self):
+        self.assertIn('shop/product_list.html', self.loader.get_template_cache)
+        with self.assertNumQueries(0):
+            get_category_menu()
+            self.assertEqual(get_product_snapshot(self.product.pk).name, 'Tent')
+
+    def test_gunicorn_master_warms_up_before_forking(self):
+        config = runpy.run_path(str(Path(settings.BASE_DIR) / 'gunicorn.conf.py'))
+        self.assertTrue(config['preload_app'])
+        server = SimpleNamespace(cfg=SimpleNamespace(preload_app=True), log=mock.Mock())
+
+        config['post_worker_init'](server)
+        self.assertNotIn('shop/product_list.html', self.loader.get_template_cache)
+
+        config['when_ready'](server)
+        self.assertWarm()
+        logged = [call.args[0] for call in server.log.info.call_args_list]
+        self.assertEqual([line.split(':')[0] for line in logged], ['Warm-up urls', 'Warm-up templates', 'Warm-up data'])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('warm_up', stdout=out)
+        self.assertIn('Warm-up finished', out.getvalue())
+        self.assertWarm()
+
+
+@override_settings(SHOP_THROTTLE_ENABLED=False)
+class LoadTestTests(LiveServerTestCase):
+    def setUp(self):
+        self.tent = make_product(Category.objects.create(name='Outdoors'), 'Tent', stock=3)
+
+    def test_shopper_buys_out_the_stock(self):
+        # The live server shares the in-memory test database's one connection
+        # between its threads, so concurrent shoppers would share transactions
+        out = StringIO()
+        call_command(
+            'load_test', url=self.live_server_url, shoppers=1, duration=2, mix='buy=1', think_time=0, stdout=out,
+        )
+        self.assertIn('Stock and orders are consistent.', out.getvalue())
+        self.assertIn('checkout [POST]', out.getvalue())
+        self.tent.refresh_from_db()
+        self.assertEqual(self.tent.stock, 0)
+        self.assertEqual(OrderItem.objects.aggregate(units=Sum('quantity'))['units'], 3)
+
+    def test_consistency_check_reports_lost_updates(self):
+        started_at = timezone.now()
+        self.assertEqual(check_consistency({self.tent.pk: 3}, started_at, []), [])
+        Product.objects.filter(pk=self.tent.pk).update(stock=2)
+        self.assertEqual(
+            check_consistency({self.tent.pk: 3}, started_at, [99]),
+            [
+                f'Product {self.tent.pk}: stock went 3 -> 2 but 0 units were sold',
+                'Order 99 was confirmed to a shopper but does not exist',
+            ],
+        )
+
+
+class LazySessionTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Tea'), 'Green Tea')
+
+    def session_queries(self, *urls):
+        with CaptureQueriesContext(connection) as queries:
+            responses = [self.client.get(url) for url in urls]
+        return responses, [query for query in queries if 'django_session' in query['sql']]
+
+    def test_anonymous_browsing_never_touches_the_session_store(self):
+        responses, queries = self.session_queries('/', '/product/green-tea/', '/?category=tea')
+        self.assertEqual(queries, [])
+        for response in responses:
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+        self.assertEqual(Session.objects.count(), 0)
+
+    def test_cart_is_read_once_there_is_one(self):
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        responses, queries = self.session_queries('/')
+        self.assertEqual(responses[0].context['cart_count'], 1)
+        self.assertEqual(len(queries), 1)
+
+    def test_benchmark_command(self):
+        out = StringIO()
+        call_command('benchmark_sessions', iterations=3, engines=['db', 'signed_cookies'], stdout=out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual([line.split()[0] for line in lines[1:3]], ['db', 'signed_cookies'])
+        self.assertEqual(Session.objects.count(), 0)
+
+
+class ThrottlingTests(ShopTestCase):
+    def search(self, **headers):
+        return self.client.get('/', {'search': 'kite'}, **headers)
+
+    def test_search_limit(self):
+        for _ in range(20):
+            self.assertEqual(self.search().status_code, 200)
+        response = self.search()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        # Browsing without a search isn't throttled
+        self.assertEqual(self.client.get('/').status_code, 200)
+
+    def test_bucket_refills(self):
+        bucket = TokenBucket(caches['throttle'], 'bucket', capacity=2, refill_rate=1)
+        self.assertEqual([bucket.consume(now=100), bucket.consume(now=100)], [0, 0])
+        self.assertEqual(bucket.consume(now=100), 1)
+        self.assertEqual(bucket.consume(now=101.5), 0)
+
+    def test_buckets_use_wall_clock_time(self):
+        # Monotonic clocks differ between processes, so a shared cache needs the wall clock
+        TokenBucket(caches['throttle'], 'bucket', capacity=2, refill_rate=1).consume()
+        tokens, updated = caches['throttle'].get('bucket')
+        self.assertAlmostEqual(updated, time.time(), delta=5)
+
+    def test_session_cookie_is_the_key_without_loading_the_user(self):
+        factory = RequestFactory()
+        first, second = factory.get('/'), factory.get('/')
+        first.COOKIES['sessionid'], second.COOKIES['sessionid'] = 'a' * 32, 'b' * 32
+        # The requests have no user, so reading request.user would fail
+        with self.assertNumQueries(0):
+            idents = {client_ident(first), client_ident(second)}
+        self.assertEqual(len(idents), 2)
+        self.assertNotIn('a' * 32, ''.join(idents))
+        self.assertTrue(client_ident(factory.get('/', REMOTE_ADDR='10.0.0.1')).startswith('ip:'))
+
+    def test_throttled_request_makes_no_queries(self):
+        self.client.force_login(User.objects.create_user('flooder'))
+        for _ in range(20):
+            self.search()
+        with self.assertNumQueries(0):
+            self.assertEqual(self.search().status_code, 429)
+
+    @override_settings(SHOP_TRUSTED_PROXY_COUNT=1)
+    def test_clients_behind_a_proxy_get_their_own_buckets(self):
+        for _ in range(20):
+            self.search(HTTP_X_FORWARDED_FOR='203.0.113.1')
+        self.assertEqual(self.search(HTTP_X_FORWARDED_FOR='203.0.113.1').status_code, 429)
+        self.assertEqual(self.search(HTTP_X_FORWARDED_FOR='203.0.113.2').status_code, 200)
+        # An address the client adds in front of the proxy's entry is ignored
+        self.assertEqual(self.search(HTTP_X_FORWARDED_FOR='198.51.100.7, 203.0.113.1').status_code, 429)
+
+    @override_settings(SHOP_CLIENT_IP_HEADER='CF-Connecting-IP')
+    def test_client_ip_header(self):
+        request = RequestFactory().get('/', HTTP_CF_CONNECTING_IP='203.0.113.9', REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(client_ip(request), '203.0.113.9')
+        self.assertEqual(client_ip(RequestFactory().get('/', REMOTE_ADDR='10.0.0.1')), '10.0.0.1')
+
+
+class CheckoutTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        category = Category.objects.create(name='Books')
+        self.book = make_product(category, 'Notebook', price='19.99', stock=5)
+        now = timezone.now()
+        Coupon.objects.create(
+            code='TENOFF', discount_type='percentage', discount_value=10,
+            valid_from=now - timedelta(days=1), valid_to=now + timedelta(days=1),
+        )
+
+    def checkout(self, quantity=3, coupon=None):
+        self.client.post(f'/cart/add/{self.book.pk}/')
+        if quantity > 1:
+            self.client.post(f'/cart/update/{self.book.pk}/', {'quantity': quantity})
+        if coupon:
+            self.client.post('/cart/apply-coupon/', {'code': coupon})
+        response = self.client.post('/checkout/', CHECKOUT_DETAILS)
+        self.assertEqual(response.status_code, 302)
+        return Order.objects.get()
+
+    def test_total_is_the_amount_charged(self):
+        order = self.checkout(coupon='TENOFF')
+        # 3 x 19.99 = 59.97, less 10% rounded half up
+        self.assertEqual(order.discount_amount, Decimal('6.00'))
+        self.assertEqual(order.total_amount, Decimal('53.97'))
+        self.assertEqual(order.coupon.code, 'TENOFF')
+        item = order.items.get()
+        self.assertEqual((item.price, item.quantity), (Decimal('19.99'), 3))
+
+        self.book.refresh_from_db()
+        self.assertEqual(self.book.stock, 2)
+        self.assertFalse(StockReservation.objects.exists())
+
+        response = self.client.get(f'/order/{order.pk}/confirmation/')
+        self.assertContains(response, '$53.97')
+
+    def test_order_without_coupon(self):
+        order = self.checkout()
+        self.assertEqual((order.total_amount, order.discount_amount, order.coupon), (Decimal('59.97'), 0, None))
+
+    def test_timed_out_checkout_keeps_the_cart(self):
+        self.client.post(f'/cart/add/{self.book.pk}/')
+        with mock.patch('shop.views.place_order', side_effect=orders.CheckoutTimeout):
+            response = self.client.post('/checkout/', CHECKOUT_DETAILS, follow=True)
+        self.assertRedirects(response, '/cart/')
+        self.assertContains(response, 'taking longer than usual')
+        self.assertContains(response, 'Notebook')
+        self.assertFalse(Order.objects.exists())
+
+
+@override_settings(SHOP_SERIALIZE_CHECKOUT=True, SHOP_CHECKOUT_TIMEOUT=5, CATALOG_SNAPSHOT_PATH=NO_SNAPSHOT)
+class OrderWriterTests(TransactionTestCase):
+    """Orders placed through the writer thread, which needs real commits"""
+
+    def setUp(self):
+        category = Category.objects.create(name='Hats')
+        self.hat = make_product(category, 'Hat', price='2.00', stock=3)
+        orders._writer = None
+        self.addCleanup(setattr, orders, '_writer', None)
+
+    def order(self, session_key='buyer'):
+        cart = {str(self.hat.pk): {'name': 'Hat', 'price': '2.00', 'quantity': 1}}
+        return orders.place_order(session_key, cart, CHECKOUT_DETAILS, price_cart(cart), None)
+
+    def test_concurrent_orders_share_the_last_units(self):
+        results = []
+        threads = [threading.Thread(target=lambda i=i: results.append(self.order(f'buyer-{i}'))) for i in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(order is not None for order, _ in results), [False, False, True, True, True])
+        self.assertEqual(Order.objects.count(), 3)
+        self.hat.refresh_from_db()
+        self.assertEqual(self.hat.stock, 0)
+
+    @override_settings(SHOP_CHECKOUT_TIMEOUT=0.1)
+    def test_order_still_queued_is_placed_directly(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(orders.OrderWriter, 'run', lambda writer: release.wait()):
+            writer = orders._get_writer()
+
+        with self.assertLogs('shop.orders', 'WARNING'):
+            order, unavailable = self.order()
+        self.assertIsNotNone(order)
+        # The writer skips the withdrawn job instead of placing it a second time
+        writer.write([writer.jobs.get_nowait()])
+        self.assertEqual(Order.objects.count(), 1)
+
+    @override_settings(SHOP_CHECKOUT_TIMEOUT=0.1)
+    def test_order_the_writer_is_stuck_on_times_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+        with mock.patch.object(orders, 'create_order', side_effect=lambda *args: release.wait()):
+            with self.assertRaises(orders.CheckoutTimeout):
+                self.order()
+        self.assertFalse(Order.objects.exists())
+
+    def test_dead_writer_is_replaced(self):
+        with mock.patch.object(orders.OrderWriter, 'run', lambda writer: None):
+            dead = orders._get_writer()
+        dead.thread.join()
+
+        order, unavailable = self.order()
+        self.assertIsNotNone(order)
+        self.assertIsNot(orders._writer, dead)
+        self.assertTrue(orders._writer.thread.is_alive())
+
+
+class SalesRollupTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Games'), 'Chess', price='20.00', stock=10)
+
+    def place_order(self, quantity=2, discount='5.00'):
+        order = Order.objects.create(
+            **CHECKOUT_DETAILS,
+            total_amount=Decimal('20.00') * quantity - Decimal(discount),
+            discount_amount=Decimal(discount),
+        )
+        OrderItem.objects.create(order=order, product=self.product, price='20.00', quantity=quantity)
+        return order
+
+    def daily(self):
+        return DailySales.objects.values('revenue', 'order_count', 'units').get()
+
+    def test_revenue_is_the_discounted_total(self):
+        self.place_order()
+        self.assertEqual(self.daily(), {'revenue': Decimal('35.00'), 'order_count': 1, 'units': 2})
+        product_sales = DailyProductSales.objects.get(product=self.product)
+        self.assertEqual((product_sales.units, product_sales.revenue), (2, Decimal('40.00')))
+
+    def test_status_and_total_changes(self):
+        order = self.place_order()
+        order.total_amount = Decimal('30.00')
+        order.save()
+        self.assertEqual(self.daily()['revenue'], Decimal('30.00'))
+
+        order.status = 'cancelled'
+        order.save()
+        self.assertEqual(self.daily(), {'revenue': Decimal('0.00'), 'order_count': 0, 'units': 0})
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.place_order()
+        self.place_order(quantity=1, discount='0')
+        incremental = self.daily()
+        DailySales.objects.update(revenue=0, order_count=0, units=0)
+        rebuild_rollups()
+        self.assertEqual(self.daily(), incremental)
+        self.assertEqual(incremental['revenue'], Decimal('55.00'))
+
+    def rollups(self):
+        return {
+            model.__name__: sorted(
+                row for row in model.objects.values_list(*fields) if any(row[-2:])
+            )
+            for model, fields in [
+                (DailySales, ['date', 'order_count', 'units', 'revenue']),
+                (DailyProductSales, ['date', 'product_id', 'units', 'revenue']),
+                (DailyCategorySales, ['date', 'category_id', 'units', 'revenue']),
+            ]
+        }
+
+    def assertMatchesRebuild(self):
+        incremental = self.rollups()
+        rebuild_rollups()
+        self.assertEqual(incremental, self.rollups())
+
+    def test_cancelling_with_a_new_total_matches_rebuild(self):
+        order = self.place_order()
+        self.place_order(quantity=1, discount='0')
+        order.status = 'cancelled'
+        order.total_amount = Decimal('99.00')
+        order.save()
+        self.assertEqual(self.daily(), {'revenue': Decimal('20.00'), 'order_count': 1, 'units': 1})
+        self.assertMatchesRebuild()
+
+    def test_product_deletes_match_rebuild(self):
+        dice = make_product(self.product.category, 'Dice', price='3.00')
+        tiles = make_product(self.product.category, 'Tiles', price='8.00')
+        self.place_order()
+        for product in (dice, tiles):
+            order = self.place_order(quantity=1, discount='0')
+            OrderItem.objects.create(order=order, product=product, price=product.price, quantity=3)
+
+        dice.delete()
+        self.assertMatchesRebuild()
+        Product.objects.filter(pk=tiles.pk).delete()
+        self.assertMatchesRebuild()
+        category_sales = DailyCategorySales.objects.get()
+        self.assertEqual((category_sales.units, category_sales.revenue), (4, Decimal('80.00')))
+
+
+class ArchiveTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user('regular')
+        self.product = make_product(Category.objects.create(name='Garden'), 'Spade', price='15.00')
+
+    def order(self, days_ago, status):
+        order = Order.objects.create(**CHECKOUT_DETAILS, user=self.user, status=status, total_amount='15.00')
+        OrderItem.objects.create(order=order, product=self.product, price='15.00', quantity=1)
+        Order.objects.filter(pk=order.pk).update(created_at=timezone.now() - timedelta(days=days_ago))
+        return order.pk
+
+    def test_only_old_finished_orders_are_archived(self):
+        recent = self.order(10, 'completed')
+        pending = self.order(400, 'pending')
+        cancelled = self.order(500, 'cancelled')
+        self.assertEqual(archive_orders(365, batch_size=1), 1)
+        self.assertEqual(set(Order.objects.values_list('pk', flat=True)), {recent, pending})
+        archived = ArchivedOrder.objects.get()
+        self.assertEqual((archived.pk, archived.items.count()), (cancelled, 1))
+
+    def test_history_merges_live_and_archived_orders_by_date(self):
+        recent = self.order(10, 'completed')
+        newer_archived = self.order(380, 'completed')
+        pending = self.order(400, 'pending')
+        older_archived = self.order(500, 'completed')
+        archive_orders(365)
+
+        self.client.force_login(self.user)
+        response = self.client.get('/orders/')
+        self.assertEqual([order.pk for order in response.context['orders']], [recent, newer_archived, pending, older_archived])
+        self.assertEqual(self.client.get(f'/order/{older_archived}/').status_code, 200)
+
+
+class ReviewFeedTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Music'), 'Guitar')
+        start = timezone.now() - timedelta(days=30)
+        # Review n is n days newer than the start, with ratings cycling 1-5; two share a timestamp
+        for n in range(13):
+            review = ProductReview.objects.create(
+                product=self.product, user=User.objects.create_user(f'player{n}'), rating=n % 5 + 1, comment=f'Review {n}',
+            )
+            ProductReview.objects.filter(pk=review.pk).update(created_at=start + timedelta(days=min(n, 11)))
+
+    def feed(self, **params):
+        return self.client.get(f'/product/{self.product.pk}/reviews/', params).json()
+
+    def comments(self, page):
+        return [review['comment'] for review in page['reviews']]
+
+    def test_pages_follow_each_other_without_gaps(self):
+        first = self.feed()
+        self.assertEqual(self.comments(first)[:3], ['Review 12', 'Review 11', 'Review 10'])
+        second = self.feed(cursor=first['next_cursor'])
+        self.assertEqual(self.comments(second), ['Review 2', 'Review 1', 'Review 0'])
+        self.assertIsNone(second['next_cursor'])
+
+    def test_highest_rated_with_rating_filter(self):
+        page = self.feed(sort='highest')
+        self.assertEqual([review['rating'] for review in page['reviews']], [5, 5, 4, 4, 3, 3, 3, 2, 2, 2])
+        rest = self.feed(sort='highest', cursor=page['next_cursor'])
+        self.assertEqual([review['rating'] for review in rest['reviews']], [1, 1, 1])
+
+        self.assertEqual(self.comments(self.feed(rating=5)), ['Review 9', 'Review 4'])
+
+    def test_bad_cursor_starts_over(self):
+        self.assertEqual(self.feed(cursor='not-a-cursor'), self.feed())
+
+    def test_unapproved_reviews_are_left_out(self):
+        admin_user = User.objects.create_superuser('admin', 'admin@example.com', 'admin-pass-1')
+        self.client.force_login(admin_user)
+        hidden = ProductReview.objects.filter(rating=5).values_list('pk', flat=True)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.post('/admin/shop/productreview/', {
+                'action': 'unapprove_reviews', '_selected_action': list(hidden),
+            })
+        self.assertEqual(len([query for query in queries if query['sql'].startswith('UPDATE "shop_productreview"')]), 1)
+        self.assertEqual(ProductReview.objects.filter(approved=False).count(), 2)
+        self.assertNotIn(5, [review['rating'] for review in self.feed(sort='highest')['reviews']])
+
+
+class SnapshotTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Kitchen'), 'Kettle', price='30.00', stock=4)
+
+    def test_save_and_delete_invalidate_snapshots(self):
+        self.assertEqual(get_product_snapshot(self.product.pk).price, Decimal('30.00'))
+        self.product.price = Decimal('25.00')
+        self.product.save()
+        self.assertEqual(get_product_snapshot(self.product.pk).price, Decimal('25.00'))
+        self.assertEqual(get_product_snapshot_by_slug('kettle').price, Decimal('25.00'))
+
+        self.product.delete()
+        self.assertIsNone(get_product_snapshot(self.product.pk))
+        self.assertIsNone(get_product_snapshot_by_slug('kettle'))
+
+    def test_slug_change(self):
+        get_product_snapshot_by_slug('kettle')
+        self.product.slug = 'electric-kettle'
+        self.product.save()
+        self.assertIsNone(get_product_snapshot_by_slug('kettle'))
+        self.assertEqual(get_product_snapshot_by_slug('electric-kettle').id, self.product.pk)
+
+    def test_cart_ignores_stale_snapshots(self):
+        get_product_snapshot(self.product.pk)
+        # A save handled by another worker leaves this worker's snapshot behind
+        Product.objects.filter(pk=self.product.pk).update(price='35.00', stock=2)
+        self.assertEqual(get_product_snapshot(self.product.pk).price, Decimal('30.00'))
+
+        self.client.post(f'/cart/add/{self.product.pk}/')
+        self.assertEqual(self.client.session['cart'][str(self.product.pk)]['price'], '35.00')
+        self.assertEqual(self.client.get('/cart/').context['cart_items'][0]['stock'], 2)
+        self.client.post(f'/cart/update/{self.product.pk}/', {'quantity': 3})
+        self.assertEqual(StockReservation.objects.get().quantity, 1)
+
+    def test_withdrawn_product_is_not_shown_from_a_stale_snapshot(self):
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.assertEqual(self.client.get('/product/kettle/').status_code, 200)
+        Product.objects.filter(pk=self.product.pk).update(available=False)
+        self.assertTrue(get_product_snapshot_by_slug('kettle').available)
+
+        self.assertEqual(self.client.get('/product/kettle/').status_code, 404)
+        self.assertEqual(self.client.post(f'/cart/add/{self.product.pk}/').status_code, 404)
+        self.assertNotIn('cart', self.client.session)
+
+
+class ProfilingTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(SHOP_PROFILE_DIR=self.directory, SHOP_PROFILE_KEEP=2)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        make_product(Category.objects.create(name='Outdoors'), 'Tent')
+
+    def saved(self):
+        return sorted(path.name for path in self.directory.iterdir())
+
+    def test_only_staff_requests_are_profiled(self):
+        self.assertNotIn('X-Profile-Id', self.client.get('/?_profile'))
+        self.client.force_login(User.objects.create_user('shopper'))
+        self.assertNotIn('X-Profile-Id', self.client.get('/', headers={'X-Profile': '1'}))
+        self.assertEqual(self.saved(), [])
+
+    def test_newest_profiles_are_kept(self):
+        self.client.force_login(User.objects.create_user('ops', is_staff=True))
+        self.assertNotIn('X-Profile-Id', self.client.get('/'))
+        profile_ids = [self.client.get('/?_profile')['X-Profile-Id'] for _ in range(2)]
+        profile_ids.append(self.client.get('/', headers={'X-Profile': '1'})['X-Profile-Id'])
+
+        kept = profile_ids[1:]
+        self.assertEqual(self.saved(), sorted(f'{profile_id}.{ext}' for profile_id in kept for ext in ('json', 'prof')))
+        self.assertEqual(self.client.get(f'/admin/profiles/{profile_ids[0]}/').status_code, 404)
+
+        response = self.client.get('/admin/profiles/')
+        for profile_id in kept:
+            self.assertContains(response, profile_id)
+        response = self.client.get(f'/admin/profiles/{kept[-1]}/')
+        self.assertContains(response, 'FROM &quot;shop_product&quot;')
+        response = self.client.get(f'/admin/profiles/{kept[-1]}/download/')
+        self.assertEqual(response['Content-Disposition'], f'attachment; filename="{kept[-1]}.prof"')
+        response.close()
+
+
+class WishlistTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.product = make_product(Category.objects.create(name='Shoes'), 'Boot')
+        self.user = User.objects.create_user('fan')
+        self.client.force_login(self.user)
+
+    def is_wishlisted(self):
+        return self.client.get('/product/boot/').context['is_wishlisted']
+
+    def test_toggle_retires_the_cached_set(self):
+        self.assertFalse(self.is_wishlisted())
+        stale_key = wishlists._key(self.client.get('/').wsgi_request)
+
+        self.client.post(f'/wishlist/toggle/{self.product.pk}/')
+        self.assertTrue(self.is_wishlisted())
+        # Another worker's copy of the old set is no longer consulted
+        self.assertEqual(list(caches['default'].get(stale_key)), [])
+
+        self.client.post(f'/wishlist/toggle/{self.product.pk}/')
+        self.assertFalse(self.is_wishlisted())
+
+    def test_cached_set_saves_the_query(self):
+        Wishlist.objects.create(user=self.user, product=self.product)
+        self.client.get('/')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(self.is_wishlisted())
+        self.assertFalse([query for query in queries if 'shop_wishlist' in query['sql']])
+
+    def test_new_session_loads_a_fresh_set(self):
+        self.assertFalse(self.is_wishlisted())
+        Wishlist.objects.create(user=self.user, product=self.product)
+        self.client.logout()
+        self.client.force_login(self.user)
+        self.assertTrue(self.is_wishlisted())
+
+    def test_deleted_item_retires_the_cached_set(self):
+        item = Wishlist.objects.create(user=self.user, product=self.product)
+        self.assertContains(self.client.get('/product/boot/'), 'class="bi bi-heart-fill text-danger"')
+
+        # Removed outside the session, as the admin would
+        item.delete()
+        response = self.client.get('/product/boot/')
+        self.assertNotContains(response, 'class="bi bi-heart-fill text-danger"')
+        self.assertContains(response, 'class="bi bi-heart"')
+
+
+@mock.patch.object(sitemaps, 'SHARD_SIZE', 2)
+class SitemapTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = Path(directory.name)
+        settings_override = override_settings(SITEMAP_ROOT=self.directory)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        # Shards of two ids: 1 | 2, 3 | 4, 5
+        category = Category.objects.create(name='Outdoors')
+        self.products = [make_product(category, f'Item {pk}', pk=pk) for pk in range(1, 6)]
+
+    def build(self):
+        out = StringIO()
+        call_command('build_sitemaps', base_url='https://shop.example/', stdout=out)
+        return out.getvalue()
+
+    def read(self, name):
+        response = self.client.get(f'/sitemaps/{name}')
+        self.assertEqual(response['Content-Type'], 'application/xml')
+        return b''.join(response.streaming_content).decode()
+
+    def test_products_are_split_into_shards(self):
+        self.assertIn('Wrote 3 product shards, 0 unchanged.', self.build())
+        index = b''.join(self.client.get('/sitemap.xml').streaming_content).decode()
+        for name in ['sitemap-categories.xml', 'sitemap-products-0.xml', 'sitemap-products-1.xml', 'sitemap-products-2.xml']:
+            self.assertIn(f'<loc>https://shop.example/sitemaps/{name}</loc>', index)
+        shard = self.read('sitemap-products-1.xml')
+        self.assertEqual(shard.count('<url>'), 2)
+        self.assertIn('<loc>https://shop.example/product/item-2/</loc>', shard)
+        self.assertIn('<loc>https://shop.example/product/item-3/</loc>', shard)
+        self.assertIn('<loc>https://shop.example/?category=outdoors</loc>', self.read('sitemap-categories.xml'))
+
+    def test_only_changed_shards_are_rewritten(self):
+        self.build()
+        self.assertIn('Wrote 0 product shards, 3 unchanged.', self.build())
+
+        self.products[4].name = 'Renamed'
+        self.products[4].save()
+        out = self.build()
+        self.assertIn('Wrote 1 product shards, 2 unchanged.', out)
+        self.assertIn('sitemap-products-2.xml: 2 URLs', out)
+
+        Product.objects.filter(pk__in=[2, 3]).update(available=False)
+        self.build()
+        self.assertEqual(self.client.get('/sitemaps/sitemap-products-1.xml').status_code, 404)
+        self.assertNotIn('sitemap-products-1.xml', self.read('sitemap.xml'))
+
+    def test_only_sitemap_files_are_served(self):
+        self.build()
+        self.assertEqual(self.client.get('/sitemaps/state.json').status_code, 404)
+
+
+class CategoryTreeTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        self.clothing = Category.objects.create(name='Clothing')
+        self.shirts = Category.objects.create(name='Shirts', parent=self.clothing)
+        self.linen = Category.objects.create(name='Linen', parent=self.shirts)
+        self.shoes = Category.objects.create(name='Footwear')
+        make_product(self.linen, 'Linen Shirt')
+        make_product(self.clothing, 'Scarf')
+        make_product(self.shoes, 'Sandal')
+
+    def test_paths(self):
+        self.assertEqual(self.linen.path, f'/{self.clothing.pk}/{self.shirts.pk}/{self.linen.pk}/')
+        self.assertEqual(set(self.clothing.get_descendants()), {self.clothing, self.shirts, self.linen})
+
+    def test_listing_includes_subcategories(self):
+        response = self.client.get('/?category=clothing')
+        self.assertEqual({product.name for product in response.context['products']}, {'Linen Shirt', 'Scarf'})
+        self.assertEqual([entry['slug'] for entry in response.context['subcategories']], ['shirts'])
+
+    def test_breadcrumbs(self):
+        response = self.client.get('/?category=linen')
+        self.assertEqual([entry['slug'] for entry in response.context['category_breadcrumbs']], ['clothing', 'shirts', 'linen'])
+        response = self.client.get('/product/linen-shirt/')
+        self.assertContains(response, '?category=shirts')
+
+    def test_moving_a_category_reroots_its_subtree(self):
+        self.client.get('/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shirts.parent = self.shoes
+            self.shirts.save()
+        self.linen.refresh_from_db()
+        self.assertEqual(self.linen.path, f'/{self.shoes.pk}/{self.shirts.pk}/{self.linen.pk}/')
+        response = self.client.get('/?category=linen')
+        self.assertEqual([entry['slug'] for entry in response.context['category_breadcrumbs']], ['footwear', 'shirts', 'linen'])
+
+    def test_menu_is_rebuilt_after_the_path_is_set(self):
+        self.client.get('/')
+        with self.captureOnCommitCallbacks(execute=True):
+            socks = Category.objects.create(name='Socks', parent=self.clothing)
+        entry = get_menu_category('socks')
+        self.assertEqual(entry['path'], f'/{self.clothing.pk}/{socks.pk}/')
+
+    def test_cycles_are_rejected(self):
+        self.clothing.parent = self.linen
+        with self.assertRaises(ValueError):
+            self.clothing.save()
+
+    def test_parent_with_subcategories_cannot_be_deleted(self):
+        with self.assertRaises(ProtectedError):
+            self.clothing.delete()
+        self.assertEqual(Product.objects.count(), 3)
+
+
+class CatalogSnapshotTests(ShopTestCase):
+    def setUp(self):
+        super().setUp()
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        settings_override = override_settings(CATALOG_SNAPSHOT_PATH=Path(directory.name) / 'catalog.snapshot')
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+        self.category = Category.objects.create(name='Tools')
+        self.hammer = make_product(self.category, 'Hammer', price='12.00', stock=3)
+        export_catalog()
+
+    def listed_price(self):
+        product = self.client.get('/').context['products'][0]
+        return product.price, isinstance(product, catalog.ListingProduct)
+
+    def test_pages_are_served_from_the_snapshot(self):
+        self.assertEqual(self.listed_price(), (Decimal('12.00'), True))
+        response = self.client.get('/product/hammer/')
+        self.assertEqual(response.context['product'].price, Decimal('12.00'))
+        self.assertNotIsInstance(response.context['product'], Product)
+
+    def test_bulk_reprice_stops_serving_the_snapshot(self):
+        self.listed_price()
+        reprice(Product.objects.all(), percent=50)
+        self.assertEqual(self.listed_price(), (Decimal('18.00'), False))
+
+    def test_checkout_stops_serving_the_snapshot(self):
+        self.listed_price()
+        self.client.post(f'/cart/add/{self.hammer.pk}/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/checkout/', CHECKOUT_DETAILS)
+        response = self.client.get('/product/hammer/')
+        self.assertEqual(response.context['product'].stock, 2)
+
+    def test_snapshot_expires(self):
+        with override_settings(CATALOG_SNAPSHOT_MAX_AGE=0):
+            self.assertEqual(self.listed_price(), (Decimal('12.00'), False))
+
+
+class PurgeSessionsTests(TestCase):
+    def make_session(self, cart=None, expired_days=1):
+        session = SessionStore()
+        if cart is not None:
+            session['cart'] = cart
+        session.save()
+        expire_date = timezone.now() - timedelta(days=expired_days)
+        Session.objects.filter(session_key=session.session_key).update(expire_date=expire_date)
+        return session.session_key
+
+    def purge(self, **options):
+        out = StringIO()
+        call_command('purge_sessions', pause=0, stdout=out, **options)
+        return out.getvalue()
+
+    def test_batches_delete_only_expired_sessions(self):
+        for _ in range(7):
+            self.make_session()
+        live = self.make_session(expired_days=-1)
+
+        out = self.purge(batch_size=3, verbosity=2)
+        self.assertIn('Purged 3 expired sessions\nPurged 6 expired sessions\nPurged 7 expired sessions\n', out)
+        self.assertIn('Purged 7 expired sessions.', out)
+        self.assertEqual(list(Session.objects.values_list('session_key', flat=True)), [live])
+
+    def test_limit_purges_the_oldest_first(self):
+        keys = [self.make_session(expired_days=days) for days in range(7, 0, -1)]
+
+        self.assertIn('Purged 5 expired sessions.', self.purge(batch_size=2, limit=5))
+        self.assertEqual(set(Session.objects.values_list('session_key', flat=True)), set(keys[5:]))
+
+    def test_cart_stats(self):
+        hat = {'1': {'name': 'Hat', 'price': '2.50', 'quantity': 2}}
+        scarf = {'2': {'name': 'Scarf', 'price': '4.00', 'quantity': 1}}
+        for cart in [hat, hat, {**hat, **scarf}, {}, None]:
+            self.make_session(cart)
+
+        out = self.purge(batch_size=2, cart_stats=True)
+        self.assertIn('3 of 5 sessions held a cart (60.0%): 7 units worth 19.00', out)
+        self.assertIn('       6  Hat\n       1  Scarf\n', out)
+
+    def test_renewed_session_is_kept(self):
+        key = self.make_session()
+
+        class RenewingStats(AbandonedCartStats):
+            # Runs between picking the batch and deleting it
+            def add(self, session):
+                super().add(session)
+                Session.objects.filter(session_key=key).update(expire_date=timezone.now() + timedelta(days=1))
+
+        self.assertEqual(purge_expired_sessions(stats=RenewingStats()), 0)
+        self.assertTrue(Session.objects.filter(session_key=key).exists())
+
+    @override_settings(SESSION_ENGINE='django.contrib.sessions.backends.cache')
+    def test_requires_database_sessions(self):
+        with self.assertRaises(CommandError):
+            self.purge()
@@ -0,0 +1,144 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse, JsonResponse
+
+
+PERIODS = {'s': 1, 'sec': 1, 'm': 60, 'min': 60, 'h': 3600, 'hour': 3600}
+
+
+def parse_rate(rate):
+    """Turns "30/min" into ``(capacity, tokens refilled per second)``"""
+    count, period = rate.split('/')
+    count = int(count)
+    return count, count / PERIODS[period]
+
+
+# Serializes the read-modify-write of a bucket between this worker's threads
+_lock = threading.Lock()
+
+
+class TokenBucket:
+    """
+    Token bucket whose state lives in a cache backend.
+
+    Updates are only atomic within a process. With the default local-memory
+    cache every worker keeps its own buckets, so a client can make up to the
+    limit times the number of workers; a shared backend makes the limits
+    global, at the cost of an occasional extra request getting through when
+    two workers refill the same bucket at once. Buckets are stamped with
+    wall-clock time, which unlike ``time.monotonic()`` agrees between the
+    processes and hosts sharing the cache.
+    """
+
+    def __init__(self, cache, key, capacity, refill_rate):
+        self.cache = cache
+        self.key = key
+        self.capacity = capacity
+        self.refill_rate = refill_rate
+
+    def consume(self, now=None):
+        """Takes one token; returns 0 if allowed, else seconds until one is available"""
+        with _lock:
+            if now is None:
+                now = time.time()
+            tokens, updated = self.cache.get(self.key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_rate)
+            if tokens < 1:
+                self.cache.set(self.key, (tokens, now), self.timeout)
+                return (1 - tokens) / self.refill_rate
+            self.cache.set(self.key, (tokens - 1, now), self.timeout)
+            return 0
+
+    @property
+    def timeout(self):
+        # Past this point the bucket would be full again, so the entry can go
+        return math.ceil(self.capacity / self.refill_rate)
+
+
+def client_ip(request):
+    """
+    The visitor's address as reported by the trusted proxies in front of the site.
+
+    ``SHOP_CLIENT_IP_HEADER`` names a header the CDN sets to the client address
+    (such as ``CF-Connecting-IP``); ``SHOP_TRUSTED_PROXY_COUNT`` is the number
+    of proxies that append to ``X-Forwarded-For``, so the entry that many
+    places from the end is the address the outermost proxy saw. Entries
+    further left are client-supplied and ignored. Without either setting, or
+    when a request didn't come through the proxies, ``REMOTE_ADDR`` is used.
+    """
+    header = getattr(settings, 'SHOP_CLIENT_IP_HEADER', None)
+    if header and request.headers.get(header):
+        return request.headers[header].strip()
+    proxies = getattr(settings, 'SHOP_TRUSTED_PROXY_COUNT', 0)
+    if proxies:
+        forwarded = [address.strip() for address in request.headers.get('X-Forwarded-For', '').split(',')]
+        forwarded = [address for address in forwarded if address]
+        if len(forwarded) >= proxies:
+            return forwarded[-proxies]
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def client_ident(request):
+    """
+    Identifies the caller without touching the database.
+
+    Requests that carry a session cookie are keyed by a hash of it, so the
+    limit is decided before the session or user is loaded, and shoppers
+    behind a shared address still get a bucket each; everything else is
+    keyed by IP address. A client that invents a new cookie for every request
+    gets a new bucket each time, so floods like that are left to the proxy or
+    CDN in front of the site.
+    """
+    cookie = request.COOKIES.get(settings.SESSION_COOKIE_NAME)
+    if cookie:
+        return f'session:{hashlib.sha256(cookie.encode()).hexdigest()[:32]}'
+    return f'ip:{client_ip(request)}'
+
+
+class ThrottleMiddleware:
+    """
+    Rejects over-limit requests with 429 before the view runs.
+
+    Limits are configured per URL name in ``shop.urls.THROTTLES``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        from .urls import THROTTLES
+        self.throttles = {
+            name: dict(config, rate=parse_rate(config['rate']))
+            for name, config in THROTTLES.items()
+        }
+        self.cache = caches[getattr(settings, 'SHOP_THROTTLE_CACHE', 'default')]
+
+    def __call__(self, request):
+        return self.get_response(request)
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if not getattr(settings, 'SHOP_THROTTLE_ENABLED', True):
+            return None
+        url_name = request.resolver_match.url_name if request.resolver_match else None
+        config = self.throttles.get(url_name)
+        if config is None:
+            return None
+        if config.get('when') and config['when'] not in request.GET:
+            return None
+
+        capacity, refill_rate = config['rate']
+        key = f'throttle:{url_name}:{client_ident(request)}'
+        wait = TokenBucket(self.cache, key, capacity, refill_rate).consume()
+        if not wait:
+            return None
+
+        message = 'Too many requests. Please slow down and try again shortly.'
+        if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
+            response = JsonResponse({'success': False, 'message': message}, status=429)
+        else:
+            response = HttpResponse(message, status=429, content_type='text/plain')
+        response['Retry-After'] = str(math.ceil(wait))
+        return response
@@ -2,10 +2,23 @@ from django.urls import path
 from django.contrib.auth import views as auth_views
 from . import views
 
+# Token-bucket limits enforced by shop.throttling.ThrottleMiddleware, keyed by
+# URL name. A rate of "N/period" allows bursts of N requests and refills N
+# tokens per period; "when" limits the throttle to requests carrying that GET
+# parameter.
+THROTTLES = {
+    'product_list': {'rate': '20/min', 'when': 'search'},
+    'autocomplete': {'rate': '120/min'},
+    'add_to_cart': {'rate': '30/min'},
+    'update_cart': {'rate': '30/min'},
+    'toggle_wishlist': {'rate': '30/min'},
+}
+
 urlpatterns = [
     # Product views
     path('', views.product_list, name='product_list'),
     path('product/<slug:slug>/', views.product_detail, name='product_detail'),
+    path('search/autocomplete/', views.autocomplete, name='autocomplete'),
     
     # Cart views
     path('cart/', views.view_cart, name='view_cart'),
@@ -29,8 +42,13 @@ urlpatterns = [
     
     # Reviews
     path('product/<int:product_id>/review/', views.add_review, name='add_review'),
+    path('product/<int:product_id>/reviews/', views.review_feed, name='review_feed'),
     
     # Wishlist
     path('wishlist/', views.wishlist_view, name='wishlist'),
     path('wishlist/toggle/<int:product_id>/', views.toggle_wishlist, name='toggle_wishlist'),
+    
+    # Sitemaps
+    path('sitemap.xml', views.sitemap_file, name='sitemap_index'),
+    path('sitemaps/<str:name>', views.sitemap_file, name='sitemap_file'),
 ]
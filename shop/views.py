@@ -1,34 +1,159 @@
+import heapq
+from operator import attrgetter
+
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
 from django.contrib.auth import login, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib.auth.forms import UserCreationForm
-from django.db.models import Q, Avg, Count
-from django.http import JsonResponse
-from django.views.decorators.http import require_POST
+from django.db.models import Q, Avg, Count, Max, OuterRef, Subquery
+from django.http import FileResponse, Http404, JsonResponse
+from django.views.decorators.http import require_POST, condition
 from django.core.mail import send_mail
 from django.conf import settings
 from django.utils import timezone
 from .models import (
-    Product, Category, Order, OrderItem, UserProfile, 
-    ProductReview, Wishlist, Coupon
+    Product, Order,
+    ProductReview, Wishlist, Coupon, ProductImage, ProductRecommendation, ArchivedOrder
 )
 from .forms import ReviewForm, UserProfileForm, CouponApplyForm
+from .facets import (
+    apply_filters, build_facet_options, get_facet_counts, invalidate_facets, parse_filters
+)
+from .recommendations import get_recommendations
+from .autocomplete import suggest
+from .reservations import release, reservation_key, reserve
+from .navigation import category_menu_version, get_breadcrumbs, get_category_menu, get_menu_category, get_subcategories
+from .cart import cart_item_count, get_cart, save_cart
+from .reviews import review_page, serialize_review
+from .pricing import get_cart_pricing
+from .snapshots import get_product_snapshot, get_product_snapshot_by_slug, get_snapshot_or_404, make_snapshot
+from .wishlists import get_wishlist_ids, touch_wishlist
+from .sitemaps import INDEX_NAME, sitemap_root
+from .catalog import get_catalog
+from .profiles import get_user_profile
+from .orders import ORDER_FIELDS, CheckoutTimeout, place_order
+
+
+# Conditional GET helpers
+#
+# Catalog pages are only validated for anonymous visitors: for logged-in users
+# the page also depends on wishlist and review state that the timestamps below
+# do not cover, so they always get a full response. Neither is a page with a
+# flash message waiting, since the browser's copy wouldn't show it.
+
+def _skip_validation(request):
+    return request.user.is_authenticated or len(messages.get_messages(request)) > 0
+
+
+def _list_catalog(request):
+    """The snapshot file, for the anonymous, non-search listings it can serve"""
+    if request.user.is_authenticated or request.GET.get('search'):
+        return None
+    return get_catalog()
+
+
+def _list_validators(request):
+    catalog = _list_catalog(request)
+    if catalog and not hasattr(request, '_catalog_validators'):
+        request._catalog_validators = catalog.validators()
+    if not hasattr(request, '_catalog_validators'):
+        products = Product.objects.all()
+        category_slug = request.GET.get('category')
+        search_query = request.GET.get('search')
+        if category_slug:
+            category = get_menu_category(category_slug)
+            if category:
+                products = products.filter(category__path__startswith=category['path'])
+            else:
+                products = products.none()
+        if search_query:
+            products = products.filter(
+                Q(name__icontains=search_query) |
+                Q(description__icontains=search_query)
+            )
+        stats = products.aggregate(
+            last_modified=Max('updated_at'),
+            last_review=Max('reviews__updated_at'),
+            count=Count('id', distinct=True),
+        )
+        # Ratings drive the rating facet and sort, so review changes count too
+        if stats['last_review'] and stats['last_review'] > stats['last_modified']:
+            stats['last_modified'] = stats['last_review']
+        request._catalog_validators = stats
+    return request._catalog_validators
+
+
+def _detail_validators(request, slug):
+    catalog = get_catalog()
+    if catalog and slug in catalog.index and not hasattr(request, '_catalog_validators'):
+        request._catalog_validators = catalog.validators()
+    if not hasattr(request, '_catalog_validators'):
+        last_image = ProductImage.objects.filter(
+            product=OuterRef('pk')
+        ).order_by('-created_at').values('created_at')[:1]
+        last_review = ProductReview.objects.filter(
+            product=OuterRef('pk')
+        ).order_by('-updated_at').values('updated_at')[:1]
+        last_recommendation = ProductRecommendation.objects.filter(
+            product=OuterRef('pk')
+        ).order_by('-updated_at').values('updated_at')[:1]
+        review_count = ProductReview.objects.filter(
+            product=OuterRef('pk'), approved=True
+        ).order_by().values('product').annotate(c=Count('id')).values('c')
+        snapshot = get_product_snapshot_by_slug(slug)
+        if snapshot is None or not snapshot.available:
+            request._catalog_validators = None
+            return None
+        row = Product.objects.filter(pk=snapshot.id, available=True).annotate(
+            last_image=Subquery(last_image),
+            last_review=Subquery(last_review),
+            last_recommendation=Subquery(last_recommendation),
+            review_count=Subquery(review_count),
+        ).values(
+            'updated_at', 'last_image', 'last_review', 'last_recommendation', 'review_count'
+        ).first()
+        stats = None
+        if row:
+            stamps = [row['updated_at'], row['last_image'], row['last_review'], row['last_recommendation']]
+            stats = {
+                'last_modified': max(stamp for stamp in stamps if stamp),
+                'count': row['review_count'] or 0,
+            }
+        request._catalog_validators = stats
+    return request._catalog_validators
 
 
-def product_list(request):
+def _catalog_etag(request, get_stats):
+    if _skip_validation(request):
+        return None
+    stats = get_stats()
+    if not stats or not stats['last_modified']:
+        return None
+    cart = get_cart(request)
+    cart_count = sum(item['quantity'] for item in cart.values())
+    stamp = int(stats['last_modified'].timestamp() * 1000000)
+    # The menu and breadcrumbs change with category renames and moves, which no timestamp records
+    return f'W/"{stamp}-{stats["count"]}-{cart_count}-{category_menu_version()}"'
+
+
+def _catalog_last_modified(request, get_stats):
+    # Last-Modified can't express the cart badge, so only offer it when the
+    # visitor has nothing in their cart. Nor can it express category changes,
+    # but browsers send If-None-Match along with it, which takes precedence.
+    if _skip_validation(request) or get_cart(request):
+        return None
+    stats = get_stats()
+    return stats['last_modified'] if stats else None
+
+
+def _query_product_list(current, search_query, filters, sort_by):
     products = Product.objects.filter(available=True).annotate(
         avg_rating=Avg('reviews__rating', filter=Q(reviews__approved=True))
     )
-    categories = Category.objects.all()
-    
-    category_slug = request.GET.get('category')
-    search_query = request.GET.get('search')
-    sort_by = request.GET.get('sort', 'newest')
-    
-    if category_slug:
-        category = get_object_or_404(Category, slug=category_slug)
-        products = products.filter(category=category)
+    if current:
+        # Subcategories are included: one indexed prefix match on the path
+        products = products.filter(category__path__startswith=current['path'])
     
     if search_query:
         products = products.filter(
@@ -36,6 +161,12 @@ def product_list(request):
             Q(description__icontains=search_query)
         )
     
+    # Faceted filters: counts are taken before the facets narrow the listing
+    facet_counts = get_facet_counts(
+        products, filters, category_slug=current['slug'] if current else None, cacheable=not search_query
+    )
+    products = apply_filters(products, filters)
+    
     # Sorting
     if sort_by == 'price_low':
         products = products.order_by('price')
@@ -45,37 +176,78 @@ def product_list(request):
         products = products.order_by('-avg_rating')
     else:
         products = products.order_by('-created_at')
+    return products, facet_counts
+
+
+@condition(
+    etag_func=lambda request: _catalog_etag(request, lambda: _list_validators(request)),
+    last_modified_func=lambda request: _catalog_last_modified(request, lambda: _list_validators(request)),
+)
+def product_list(request):
+    categories = get_category_menu()
+    category_slug = request.GET.get('category')
+    search_query = request.GET.get('search')
+    sort_by = request.GET.get('sort', 'newest')
+    filters = parse_filters(request.GET)
+    current = None
     
-    cart = request.session.get('cart', {})
+    if category_slug:
+        current = get_menu_category(category_slug)
+        if current is None:
+            raise Http404('No Category matches the given query.')
+    
+    catalog = _list_catalog(request)
+    if catalog:
+        products, facet_counts = catalog.list_products(current['path'] if current else None, filters, sort_by)
+    else:
+        products, facet_counts = _query_product_list(current, search_query, filters, sort_by)
+    
+    cart = get_cart(request)
     cart_count = sum(item['quantity'] for item in cart.values())
     
-    wishlist_ids = []
-    if request.user.is_authenticated:
-        wishlist_ids = list(Wishlist.objects.filter(user=request.user).values_list('product_id', flat=True))
+    wishlist_ids = get_wishlist_ids(request)
     
     context = {
         'products': products,
         'categories': categories,
         'cart_count': cart_count,
         'current_category': category_slug,
+        'category_breadcrumbs': get_breadcrumbs(current['id']) if current else [],
+        'subcategories': get_subcategories(current['id']) if current else [],
         'search_query': search_query,
         'sort_by': sort_by,
         'wishlist_ids': wishlist_ids,
+        'filters': filters,
+        'facets': build_facet_options(request.GET, filters, facet_counts),
     }
     return render(request, 'shop/product_list.html', context)
 
 
+@condition(
+    etag_func=lambda request, slug: _catalog_etag(request, lambda: _detail_validators(request, slug)),
+    last_modified_func=lambda request, slug: _catalog_last_modified(
+        request, lambda: _detail_validators(request, slug)
+    ),
+)
 def product_detail(request, slug):
-    product = get_object_or_404(Product, slug=slug, available=True)
-    cart = request.session.get('cart', {})
+    if not request.user.is_authenticated:
+        catalog = get_catalog()
+        record = catalog.product(slug) if catalog else None
+        if record:
+            return _render_catalog_detail(request, record)
+    
+    # The snapshot turns unknown or unavailable slugs away without a query
+    snapshot = get_snapshot_or_404(slug=slug, available_only=True)
+    # The snapshot may predate the product being withdrawn, so the database has the last word
+    product = get_object_or_404(Product.objects.select_related('category'), pk=snapshot.id, available=True)
+    cart = get_cart(request)
     cart_count = sum(item['quantity'] for item in cart.values())
     
-    reviews = ProductReview.objects.filter(product=product, approved=True).order_by('-created_at')[:10]
-    is_wishlisted = False
+    reviews, reviews_cursor = review_page(product)
+    is_wishlisted = product.id in get_wishlist_ids(request)
     user_review = None
     
     if request.user.is_authenticated:
-        is_wishlisted = Wishlist.objects.filter(user=request.user, product=product).exists()
         user_review = ProductReview.objects.filter(user=request.user, product=product).first()
     
     # Get all product images
@@ -84,8 +256,10 @@ def product_detail(request, slug):
     
     context = {
         'product': product,
+        'category_breadcrumbs': get_breadcrumbs(product.category_id),
         'cart_count': cart_count,
         'reviews': reviews,
+        'reviews_cursor': reviews_cursor,
         'is_wishlisted': is_wishlisted,
         'user_review': user_review,
         'review_form': ReviewForm() if request.user.is_authenticated else None,
@@ -93,13 +267,41 @@ def product_detail(request, slug):
         'review_count': product.get_review_count(),
         'all_images': all_images,
         'additional_images': additional_images,
+        'recommendations': get_recommendations(product),
     }
     return render(request, 'shop/product_detail.html', context)
 
 
+def _render_catalog_detail(request, record):
+    """Renders product_detail for an anonymous visitor from a catalog snapshot record"""
+    context = {
+        'product': record.product,
+        'category_breadcrumbs': get_breadcrumbs(record.product.category.id),
+        'cart_count': cart_item_count(request),
+        'reviews': record.reviews,
+        'reviews_cursor': record.reviews_cursor,
+        'is_wishlisted': False,
+        'user_review': None,
+        'review_form': None,
+        'average_rating': record.average_rating,
+        'review_count': record.review_count,
+        'all_images': record.images,
+        'additional_images': [],
+        'recommendations': record.recommendations,
+    }
+    return render(request, 'shop/product_detail.html', context)
+
+
+def autocomplete(request):
+    query = request.GET.get('q', '')[:100]
+    return JsonResponse({'results': suggest(query)})
+
+
 @require_POST
 def add_to_cart(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    # The price copied into the cart and the stock check come from the database,
+    # since another worker's save may not have reached this one's snapshots yet
+    product = make_snapshot(get_object_or_404(Product, pk=product_id, available=True))
     
     if product.stock <= 0:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -111,10 +313,11 @@ def add_to_cart(request, product_id):
     product_id_str = str(product_id)
     
     current_quantity = cart.get(product_id_str, {}).get('quantity', 0)
-    if current_quantity + 1 > product.stock:
+    reserved, available = reserve(product, reservation_key(request), current_quantity + 1)
+    if not reserved:
         if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
-            return JsonResponse({'success': False, 'message': f'Only {product.stock} items available in stock!'})
-        messages.error(request, f'Only {product.stock} items available in stock!')
+            return JsonResponse({'success': False, 'message': f'Only {available} items available in stock!'})
+        messages.error(request, f'Only {available} items available in stock!')
         return redirect('product_detail', slug=product.slug)
     
     if product_id_str in cart:
@@ -124,10 +327,10 @@ def add_to_cart(request, product_id):
             'name': product.name,
             'price': str(product.price),
             'quantity': 1,
-            'image': product.image.url if product.image else None,
+            'image': product.image_url,
         }
     
-    request.session['cart'] = cart
+    save_cart(request, cart)
     cart_count = sum(item['quantity'] for item in cart.values())
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -142,12 +345,9 @@ def add_to_cart(request, product_id):
 
 
 def view_cart(request):
-    cart = request.session.get('cart', {})
-    cart_items = []
-    total = 0
+    cart = get_cart(request)
     coupon_code = request.session.get('coupon_code')
     coupon = None
-    discount = 0
     
     if coupon_code:
         try:
@@ -155,34 +355,22 @@ def view_cart(request):
         except Coupon.DoesNotExist:
             request.session.pop('coupon_code', None)
     
-    for product_id, item in cart.items():
-        try:
-            product = Product.objects.get(id=product_id)
-            item_total = float(item['price']) * item['quantity']
-            cart_items.append({
-                'id': product_id,
-                'name': item['name'],
-                'price': item['price'],
-                'quantity': item['quantity'],
-                'total': item_total,
-                'image': item.get('image'),
-                'stock': product.stock,
-            })
-            total += item_total
-        except Product.DoesNotExist:
-            continue
-    
-    if coupon and total > 0:
-        discount = coupon.calculate_discount(total)
-    
-    final_total = total - discount
+    # Drop products that have left the catalogue since they were added. Stock
+    # is read from the database, like on the other cart and checkout paths.
+    stock = dict(Product.objects.filter(pk__in=[int(product_id) for product_id in cart]).values_list('pk', 'stock'))
+    if len(stock) < len(cart):
+        cart = {product_id: item for product_id, item in cart.items() if int(product_id) in stock}
+        save_cart(request, cart)
+    
+    pricing = get_cart_pricing(request, cart, coupon)
+    cart_items = [{**line, 'stock': stock[int(line['id'])]} for line in pricing.lines]
     cart_count = sum(item['quantity'] for item in cart.values())
     
     context = {
         'cart_items': cart_items,
-        'total': total,
-        'discount': discount,
-        'final_total': final_total,
+        'total': pricing.subtotal,
+        'discount': pricing.discount,
+        'final_total': pricing.total,
         'cart_count': cart_count,
         'coupon': coupon,
         'coupon_form': CouponApplyForm(),
@@ -197,20 +385,20 @@ def update_cart(request, product_id):
     quantity = int(request.POST.get('quantity', 1))
     
     if product_id_str in cart:
-        try:
-            product = Product.objects.get(id=product_id)
-            if quantity > product.stock:
-                messages.error(request, f'Only {product.stock} items available in stock!')
+        product = get_product_snapshot(product_id)
+        if product is None:
+            del cart[product_id_str]
+        elif quantity > 0:
+            reserved, available = reserve(product, reservation_key(request), quantity)
+            if not reserved:
+                messages.error(request, f'Only {available} items available in stock!')
                 return redirect('view_cart')
-            
-            if quantity > 0:
-                cart[product_id_str]['quantity'] = quantity
-            else:
-                del cart[product_id_str]
-        except Product.DoesNotExist:
+            cart[product_id_str]['quantity'] = quantity
+        else:
+            release(product_id, reservation_key(request, create=False))
             del cart[product_id_str]
-    
-    request.session['cart'] = cart
+        
+        save_cart(request, cart)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         cart_count = sum(item['quantity'] for item in cart.values())
@@ -226,7 +414,8 @@ def remove_from_cart(request, product_id):
     
     if product_id_str in cart:
         del cart[product_id_str]
-        request.session['cart'] = cart
+        save_cart(request, cart)
+        release(product_id, reservation_key(request, create=False))
         messages.success(request, 'Item removed from cart!')
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
@@ -264,54 +453,43 @@ def remove_coupon(request):
 
 
 def checkout(request):
-    cart = request.session.get('cart', {})
+    cart = get_cart(request)
     
     if not cart:
         messages.warning(request, 'Your cart is empty!')
         return redirect('product_list')
     
-    cart_items = []
-    total = 0
-    
-    for product_id, item in cart.items():
-        item_total = float(item['price']) * item['quantity']
-        cart_items.append({
-            'id': product_id,
-            'name': item['name'],
-            'price': item['price'],
-            'quantity': item['quantity'],
-            'total': item_total,
-        })
-        total += item_total
+    coupon = None
+    coupon_code = request.session.get('coupon_code')
+    if coupon_code:
+        coupon = Coupon.objects.filter(code=coupon_code).first()
+    pricing = get_cart_pricing(request, cart, coupon)
     
     if request.method == 'POST':
-        order = Order.objects.create(
-            first_name=request.POST.get('first_name'),
-            last_name=request.POST.get('last_name'),
-            email=request.POST.get('email'),
-            address=request.POST.get('address'),
-            city=request.POST.get('city'),
-            postal_code=request.POST.get('postal_code'),
-            total_amount=total,
-        )
+        details = {field: request.POST.get(field) for field in ORDER_FIELDS}
+        try:
+            order, unavailable = place_order(reservation_key(request, create=False), cart, details, pricing, coupon)
+        except CheckoutTimeout:
+            messages.error(request, 'Your order is taking longer than usual. Please check your order history before trying again.')
+            return redirect('view_cart')
         
-        for product_id, item in cart.items():
-            product = Product.objects.get(id=product_id)
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                price=item['price'],
-                quantity=item['quantity'],
-            )
+        if unavailable is not None:
+            name = cart[str(unavailable)]['name']
+            messages.error(request, f'Sorry, {name} no longer has enough stock for your order.')
+            return redirect('view_cart')
         
-        request.session['cart'] = {}
+        # Stock was decremented with UPDATEs, which don't fire save signals
+        invalidate_facets()
+        save_cart(request, {})
         return redirect('order_confirmation', order_id=order.id)
     
     cart_count = sum(item['quantity'] for item in cart.values())
     
     context = {
-        'cart_items': cart_items,
-        'total': total,
+        'cart_items': pricing.lines,
+        'total': pricing.subtotal,
+        'discount': pricing.discount,
+        'final_total': pricing.total,
         'cart_count': cart_count,
     }
     return render(request, 'shop/checkout.html', context)
@@ -335,8 +513,11 @@ def order_confirmation(request, order_id):
 
 @login_required
 def order_detail(request, order_id):
-    order = get_object_or_404(Order, id=order_id, user=request.user)
-    cart_count = sum(item['quantity'] for item in request.session.get('cart', {}).values())
+    order = Order.objects.filter(id=order_id, user=request.user).first()
+    if order is None:
+        # Old orders may have been moved out by archive_orders
+        order = get_object_or_404(ArchivedOrder, id=order_id, user=request.user)
+    cart_count = cart_item_count(request)
     
     context = {
         'order': order,
@@ -347,8 +528,14 @@ def order_detail(request, order_id):
 
 @login_required
 def order_history(request):
-    orders = Order.objects.filter(user=request.user).order_by('-created_at')
-    cart_count = sum(item['quantity'] for item in request.session.get('cart', {}).values())
+    # Old pending orders are never archived, so the two lists interleave
+    orders = list(heapq.merge(
+        Order.objects.filter(user=request.user).order_by('-created_at'),
+        ArchivedOrder.objects.filter(user=request.user).order_by('-created_at'),
+        key=attrgetter('created_at'),
+        reverse=True,
+    ))
+    cart_count = cart_item_count(request)
     
     context = {
         'orders': orders,
@@ -370,7 +557,7 @@ def register(request):
     else:
         form = UserCreationForm()
     
-    cart_count = sum(item['quantity'] for item in request.session.get('cart', {}).values())
+    cart_count = cart_item_count(request)
     
     return render(request, 'shop/register.html', {
         'form': form,
@@ -381,15 +568,15 @@ def register(request):
 @login_required
 def profile(request):
     if request.method == 'POST':
-        form = UserProfileForm(request.POST, request.FILES, instance=request.user.profile)
+        form = UserProfileForm(request.POST, request.FILES, instance=get_user_profile(request.user))
         if form.is_valid():
             form.save()
             messages.success(request, 'Profile updated successfully!')
             return redirect('profile')
     else:
-        form = UserProfileForm(instance=request.user.profile)
+        form = UserProfileForm(instance=get_user_profile(request.user))
     
-    cart_count = sum(item['quantity'] for item in request.session.get('cart', {}).values())
+    cart_count = cart_item_count(request)
     
     context = {
         'form': form,
@@ -402,13 +589,13 @@ def profile(request):
 @login_required
 @require_POST
 def add_review(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    product = get_snapshot_or_404(product_id=product_id)
     form = ReviewForm(request.POST)
     
     if form.is_valid():
         review, created = ProductReview.objects.update_or_create(
             user=request.user,
-            product=product,
+            product_id=product.id,
             defaults={
                 'rating': form.cleaned_data['rating'],
                 'comment': form.cleaned_data['comment'],
@@ -424,14 +611,31 @@ def add_review(request, product_id):
     return redirect('product_detail', slug=product.slug)
 
 
+def review_feed(request, product_id):
+    try:
+        rating = int(request.GET.get('rating', ''))
+    except ValueError:
+        rating = None
+    reviews, next_cursor = review_page(
+        product_id,
+        sort=request.GET.get('sort', 'newest'),
+        rating=rating if rating in range(1, 6) else None,
+        cursor=request.GET.get('cursor'),
+    )
+    return JsonResponse({
+        'reviews': [serialize_review(review) for review in reviews],
+        'next_cursor': next_cursor,
+    })
+
+
 # Wishlist Views
 @login_required
 @require_POST
 def toggle_wishlist(request, product_id):
-    product = get_object_or_404(Product, id=product_id)
+    product = get_snapshot_or_404(product_id=product_id)
     wishlist_item, created = Wishlist.objects.get_or_create(
         user=request.user,
-        product=product
+        product_id=product.id
     )
     
     if not created:
@@ -441,6 +645,7 @@ def toggle_wishlist(request, product_id):
     else:
         is_wishlisted = True
         message = 'Added to wishlist'
+    touch_wishlist(request)
     
     if request.headers.get('X-Requested-With') == 'XMLHttpRequest':
         return JsonResponse({
@@ -456,10 +661,21 @@ def toggle_wishlist(request, product_id):
 @login_required
 def wishlist_view(request):
     wishlist_items = Wishlist.objects.filter(user=request.user).select_related('product')
-    cart_count = sum(item['quantity'] for item in request.session.get('cart', {}).values())
+    cart_count = cart_item_count(request)
     
     context = {
         'wishlist_items': wishlist_items,
         'cart_count': cart_count,
     }
     return render(request, 'shop/wishlist.html', context)
+
+
+# Sitemaps are written by `python manage.py build_sitemaps`
+
+def sitemap_file(request, name=INDEX_NAME):
+    if not (name == INDEX_NAME or (name.startswith('sitemap-') and name.endswith('.xml'))):
+        raise Http404('No such sitemap.')
+    path = sitemap_root() / name
+    if not path.is_file():
+        raise Http404('No such sitemap.')
+    return FileResponse(path.open('rb'), content_type='application/xml')
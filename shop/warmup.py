@@ -0,0 +1,98 @@
+import logging
+import time
+from pathlib import Path
+
+from django.apps import apps
+from django.db import connections
+from django.db.models import Avg, Q
+from django.template.loader import get_template
+from django.urls import resolve, reverse
+
+from . import urls as shop_urls
+from .autocomplete import get_index
+from .facets import get_facet_counts, parse_filters
+from .models import Product
+from .navigation import get_category_menu
+from .snapshots import prime_product_snapshots
+
+
+logger = logging.getLogger(__name__)
+
+# Placeholder values used to reverse patterns that take arguments
+SAMPLE_ARGUMENTS = {'int': 1, 'slug': 'warm-up', 'str': 'warm-up', 'path': 'warm-up', 'uuid': '00000000-0000-0000-0000-000000000000'}
+SNAPSHOT_LIMIT = 1000
+
+
+def _converter_name(converter):
+    return type(converter).__name__.replace('Converter', '').lower()
+
+
+def warm_urls():
+    """Reverses and resolves every named shop pattern once, which builds the resolver caches"""
+    count = 0
+    for pattern in shop_urls.urlpatterns:
+        if not pattern.name:
+            continue
+        kwargs = {
+            name: SAMPLE_ARGUMENTS.get(_converter_name(converter), 'warm-up')
+            for name, converter in pattern.pattern.converters.items()
+        }
+        resolve(reverse(pattern.name, kwargs=kwargs))
+        count += 1
+    return count
+
+
+def warm_templates():
+    """Compiles every template shipped in the shop app into the cached loader"""
+    template_dir = Path(apps.get_app_config('shop').path) / 'templates'
+    count = 0
+    for path in sorted(template_dir.rglob('*.html')):
+        get_template(path.relative_to(template_dir).as_posix())
+        count += 1
+    return count
+
+
+def warm_data(snapshot_limit=SNAPSHOT_LIMIT):
+    """Primes the category menu, autocomplete index, facet counts and product snapshots"""
+    categories = get_category_menu()
+    get_index()
+
+    # Same base queryset as product_list, so the cached summaries are the ones it reads
+    products = Product.objects.filter(available=True).annotate(
+        avg_rating=Avg('reviews__rating', filter=Q(reviews__approved=True))
+    )
+    filters = parse_filters({})
+    get_facet_counts(products, filters)
+    for category in categories:
+        get_facet_counts(
+            products.filter(category__path__startswith=category['path']), filters, category_slug=category['slug']
+        )
+
+    recent = Product.objects.filter(available=True).order_by('-updated_at')[:snapshot_limit]
+    snapshots = prime_product_snapshots(recent)
+    return {'categories': len(categories), 'snapshots': snapshots}
+
+
+def warm_up(snapshot_limit=SNAPSHOT_LIMIT, log=None):
+    """
+    Runs every warm-up stage and returns ``{stage: seconds}``.
+
+    Database connections are closed at the end so a gunicorn master that warms
+    up before forking doesn't hand the same connection to every worker.
+    """
+    log = log or logger.info
+    stages = [
+        ('urls', warm_urls),
+        ('templates', warm_templates),
+        ('data', lambda: warm_data(snapshot_limit=snapshot_limit)),
+    ]
+    timings = {}
+    try:
+        for name, stage in stages:
+            started = time.perf_counter()
+            result = stage()
+            timings[name] = time.perf_counter() - started
+            log(f'Warm-up {name}: {result} in {timings[name] * 1000:.0f} ms')
+    finally:
+        connections.close_all()
+    return timings
@@ -0,0 +1,79 @@
+from array import array
+from bisect import bisect_left
+
+from django.core.cache import cache
+
+from .models import Wishlist
+
+
+# The cache is per worker, so the set is keyed on the user's session and a
+# version kept in it (both stored in the database) that every toggle bumps:
+# the next page, whichever worker serves it, loads the set afresh. Saves and
+# deletes made outside that session, in the admin or on another device, move
+# the user to a new generation in the cache of the worker that made them;
+# other workers show them once the entry expires.
+WISHLIST_TIMEOUT = 60 * 10
+
+
+class WishlistSet:
+    """Sorted array of a user's wishlisted product ids with binary-search membership"""
+
+    __slots__ = ['ids']
+
+    def __init__(self, ids=()):
+        self.ids = array('l', sorted(ids))
+
+    def __contains__(self, product_id):
+        try:
+            product_id = int(product_id)
+        except (TypeError, ValueError):
+            return False
+        position = bisect_left(self.ids, product_id)
+        return position < len(self.ids) and self.ids[position] == product_id
+
+    def __iter__(self):
+        return iter(self.ids)
+
+    def __len__(self):
+        return len(self.ids)
+
+
+def _generation_key(user_id):
+    return f'shop:wishlist:{user_id}:generation'
+
+
+def _key(request):
+    # Logging in starts a new session key, so a new session never picks up an old set
+    user_id = request.user.pk
+    generation = cache.get_or_set(_generation_key(user_id), 1, None)
+    return f'shop:wishlist:{user_id}:{generation}:{request.session.session_key}:{wishlist_version(request)}'
+
+
+def wishlist_version(request):
+    return request.session.get('wishlist_version', 0)
+
+
+def touch_wishlist(request):
+    """Retires the cached set after the user's wishlist changed"""
+    request.session['wishlist_version'] = wishlist_version(request) + 1
+
+
+def invalidate_wishlist(user_id):
+    """Retires the user's cached sets in every session"""
+    try:
+        cache.incr(_generation_key(user_id))
+    except ValueError:
+        cache.set(_generation_key(user_id), 1, None)
+
+
+def get_wishlist_ids(request):
+    """Returns the user's ``WishlistSet``; anonymous users get an empty one without a query"""
+    user = request.user
+    if not user.is_authenticated:
+        return WishlistSet()
+    key = _key(request)
+    ids = cache.get(key)
+    if ids is None:
+        ids = WishlistSet(Wishlist.objects.filter(user=user).values_list('product_id', flat=True))
+        cache.set(key, ids, WISHLIST_TIMEOUT)
+    return ids